@@ -0,0 +1 @@
+"""Бенчмарки горячих путей бота. Запуск: python -m benchmarks.<имя_модуля>"""
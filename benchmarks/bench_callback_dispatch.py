@@ -0,0 +1,120 @@
+"""
+Бенчмарк накладных расходов маршрутизации нажатия кнопки (Dispatcher.feed_update).
+
+legacy   - прежняя схема: по обработчику на действие с фильтрами F.data == / startswith,
+           аргументы разбираются split(":") в обработчике
+registry - реестр действий utils.callback_data: разбор в мидлвари и один обработчик
+           с поиском действия в словаре
+
+Обработчики пустые, запросов к API нет: измеряется только доставка до обработчика.
+Действия и их порядок - из реального реестра бота.
+
+Запуск: python -m benchmarks.bench_callback_dispatch [повторов]
+"""
+import asyncio
+import logging
+import sys
+import time
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Update
+
+from handlers import callback_router
+from middlewares.callback_route import CallbackRouteMiddleware
+from utils.callback_data import CallbackRegistry, get_callback_registry
+
+ROUNDS = 5
+
+
+def sample_data(action: str, arg_types) -> str:
+    """Правдоподобная callback_data для действия"""
+    args = []
+    for arg_type in arg_types:
+        if arg_type is int:
+            args.append("1234")
+        elif isinstance(arg_type, tuple):
+            args.append(arg_type[0])
+        else:
+            args.append("value")
+    return ":".join([action, *args])
+
+
+def build_legacy(entries) -> Dispatcher:
+    router = Router()
+    for entry in entries:
+        async def handler(callback: CallbackQuery, _arity=len(entry.arg_types)):
+            if _arity:
+                callback.data.split(":", _arity)
+
+        if entry.arg_types:
+            router.callback_query(F.data.startswith(f"{entry.action}:"))(handler)
+        else:
+            router.callback_query(F.data == entry.action)(handler)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(router)
+    return dp
+
+
+def build_registry(registry: CallbackRegistry) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.callback_query.outer_middleware(CallbackRouteMiddleware(registry))
+    dp.include_router(callback_router)
+    return dp
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates, repeats: int) -> float:
+    """Лучшее среднее время feed_update на одно обновление (мкс)"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for update in updates:
+                await dp.feed_update(bot, update)
+        best = min(best, (time.perf_counter() - started) / (repeats * len(updates)))
+    return best * 1e6
+
+
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logging.disable(logging.WARNING)
+
+    # Копия реестра бота с пустыми обработчиками (без обращений к БД и API)
+    entries = get_callback_registry().entries()
+    registry = CallbackRegistry()
+    for entry in entries:
+        async def empty(callback: CallbackQuery):
+            pass
+        registry.route(entry.action, **dict(zip(entry.arg_names, entry.arg_types)))(empty)
+
+    bot = Bot("123456:BENCH")
+
+    def update(data: str) -> Update:
+        return Update.model_validate({
+            "update_id": 1,
+            "callback_query": {
+                "id": "1",
+                "from": {"id": 42, "is_bot": False, "first_name": "Admin"},
+                "chat_instance": "1",
+                "data": data,
+            },
+        }, context={"bot": bot})
+
+    cases = {
+        "первое действие": [update(sample_data(entries[0].action, entries[0].arg_types))],
+        "последнее": [update(sample_data(entries[-1].action, entries[-1].arg_types))],
+        "все действия": [update(sample_data(entry.action, entry.arg_types)) for entry in entries],
+    }
+
+    legacy = build_legacy(entries)
+    current = build_registry(registry)
+    print(f"{len(entries)} действий, мкс на обновление (лучшее из {ROUNDS})")
+    for label, updates in cases.items():
+        legacy_us = await measure(legacy, bot, updates, repeats)
+        registry_us = await measure(current, bot, updates, repeats)
+        print(f"{label:<16} legacy {legacy_us:8.1f}   registry {registry_us:8.1f}   x{legacy_us / registry_us:.1f}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
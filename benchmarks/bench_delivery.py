@@ -0,0 +1,114 @@
+"""
+Сравнение задержки реакции на нажатия кнопок: polling против webhook.
+
+Бот (Dispatcher aiogram с обработчиком callback_query: answer + editMessageText)
+работает с локальной имитацией Bot API (benchmarks.fake_telegram). Сценарий:
+пачки нажатий со случайными интервалами; задержка - от нажатия до получения
+имитацией answerCallbackQuery бота. delay_ms - односторонняя сетевая задержка
+до Telegram.
+
+Запуск: python -m benchmarks.bench_delivery [нажатий] [delay_ms]
+"""
+import asyncio
+import logging
+import random
+import statistics
+import sys
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import CallbackQuery
+
+from benchmarks.fake_telegram import BOT_TOKEN, FakeTelegramAPI
+from config import Config
+from services.webhook_server import WebhookServer
+
+HANDLER_WORK = 0.005  # Имитация работы обработчика (сек)
+WEBHOOK_PORT = 18443
+
+
+def build_dispatcher() -> Dispatcher:
+    router = Router()
+
+    @router.callback_query(F.data == "refresh")
+    async def refresh(callback: CallbackQuery):
+        await asyncio.sleep(HANDLER_WORK)
+        await callback.answer()
+        await callback.message.edit_text(f"menu {callback.id}")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def click_workload(api: FakeTelegramAPI, clicks: int) -> list:
+    """Пачки по 1-5 нажатий с паузами 0-150 мс (детерминированно)"""
+    rng = random.Random(1)
+    answered = []
+    while len(answered) < clicks:
+        for _ in range(min(rng.randint(1, 5), clicks - len(answered))):
+            answered.append(api.click())
+            await asyncio.sleep(rng.uniform(0, 0.02))
+        await asyncio.sleep(rng.uniform(0, 0.15))
+    latencies = await asyncio.gather(*answered)
+    # Ожидание последних editMessageText, чтобы остановка не обрывала обработчики
+    while api.calls.get("editMessageText", 0) < clicks:
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+def report(mode: str, latencies: list, api: FakeTelegramAPI) -> None:
+    latencies = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{mode:<8} p50 {statistics.median(latencies):7.1f} ms   p95 {p95:7.1f} ms   "
+        f"макс. {latencies[-1]:7.1f} ms   getUpdates: {api.calls.get('getUpdates', 0)}"
+    )
+
+
+async def run_polling(clicks: int, delay: float) -> None:
+    api = FakeTelegramAPI(delay=delay)
+    await api.start()
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+    dp = build_dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    try:
+        await asyncio.sleep(0.2)
+        report("polling", await click_workload(api, clicks), api)
+    finally:
+        await dp.stop_polling()
+        await polling
+        await api.close()
+
+
+async def run_webhook(clicks: int, delay: float) -> None:
+    api = FakeTelegramAPI(delay=delay)
+    await api.start()
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+    dp = build_dispatcher()
+    config = Config()
+    server = WebhookServer(dp, bot, path="/webhook", secret_token="bench-secret",
+                           max_concurrency=config.update_concurrency)
+    await server.start("127.0.0.1", WEBHOOK_PORT)
+    try:
+        await bot.set_webhook(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", secret_token="bench-secret")
+        report("webhook", await click_workload(api, clicks), api)
+    finally:
+        await server.stop()
+        await bot.session.close()
+        await api.close()
+
+
+async def main():
+    clicks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{clicks} нажатий, сетевая задержка {delay * 1000:.0f} ms в одну сторону, "
+          f"обработчик {HANDLER_WORK * 1000:.0f} ms")
+    await run_polling(clicks, delay)
+    await run_webhook(clicks, delay)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
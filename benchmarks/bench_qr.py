@@ -0,0 +1,99 @@
+"""
+Бенчмарк рендеринга QR-кода конфигурации клиента: время и размер результата.
+
+legacy - прежний путь: version=1 с подбором, уровень L, StyledPilImage + RoundedModuleDrawer
+styled/bitmap/svg - бэкенды utils.qr_generator с автоматическим выбором версии и уровня коррекции
+
+Запуск: python -m benchmarks.bench_qr [box_size]
+"""
+import base64
+import io
+import os
+import sys
+import time
+
+import qrcode
+from qrcode.image.styledpil import StyledPilImage
+from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
+
+from utils.qr_generator import QR_BACKENDS, build_qr
+
+ROUNDS = 5
+
+EC_NAMES = {
+    qrcode.constants.ERROR_CORRECT_L: "L",
+    qrcode.constants.ERROR_CORRECT_M: "M",
+    qrcode.constants.ERROR_CORRECT_Q: "Q",
+    qrcode.constants.ERROR_CORRECT_H: "H",
+}
+
+
+def sample_config() -> str:
+    """Конфигурация клиента AmneziaWG типичного размера"""
+    def key() -> str:
+        return base64.b64encode(os.urandom(32)).decode('ascii')
+
+    return (
+        "[Interface]\n"
+        f"PrivateKey = {key()}\n"
+        "Address = 10.10.0.42/32, fd42:42:42::2a/128\n"
+        "DNS = 1.1.1.1, 1.0.0.1\n"
+        "Jc = 4\nJmin = 40\nJmax = 70\nS1 = 52\nS2 = 117\n"
+        "H1 = 1233451742\nH2 = 1788923416\nH3 = 832714421\nH4 = 1941328102\n\n"
+        "[Peer]\n"
+        f"PublicKey = {key()}\n"
+        f"PresharedKey = {key()}\n"
+        "AllowedIPs = 0.0.0.0/0, ::/0\n"
+        "Endpoint = vpn.example.com:51820\n"
+        "PersistentKeepalive = 25\n"
+    )
+
+
+def legacy_render(data: str, box_size: int) -> bytes:
+    """Рендеринг до выбора бэкендов (для сравнения)"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=box_size, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(
+        image_factory=StyledPilImage,
+        module_drawer=RoundedModuleDrawer(),
+        fill_color="black",
+        back_color="white"
+    )
+    bio = io.BytesIO()
+    img.save(bio, format='PNG')
+    return bio.getvalue()
+
+
+def measure(label: str, render) -> float:
+    """Лучшее время и размер результата (для байтовых результатов)"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        output = render()
+        best = min(best, time.perf_counter() - started)
+    size = f"{len(output):9} B" if isinstance(output, bytes) else ""
+    print(f"{label:<8} {best * 1000:9.2f} ms {size}")
+    return best
+
+
+def main():
+    box_size = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    data = sample_config()
+
+    qr = build_qr(data)
+    print(
+        f"Конфигурация {len(data)} байт: версия {qr.version}, "
+        f"коррекция {EC_NAMES[qr.error_correction]}, box_size {box_size} (лучшее из {ROUNDS})"
+    )
+
+    # legacy - построение и рендеринг; для бэкендов построение матрицы измеряется отдельно
+    legacy = measure("legacy", lambda: legacy_render(data, box_size))
+    build = measure("build", lambda: build_qr(data).get_matrix())
+    for name, backend in QR_BACKENDS.items():
+        elapsed = build + measure(name, lambda: backend.render(qr, box_size))
+        print(f"{'':<8} с построением {elapsed * 1000:.2f} ms, x{legacy / elapsed:.1f} быстрее legacy")
+
+
+if __name__ == "__main__":
+    main()
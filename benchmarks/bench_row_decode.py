@@ -0,0 +1,120 @@
+"""
+Бенчмарк декодирования строк clients: стоимость выборки + декодирования 10k строк.
+
+legacy  - TEXT-даты, aiosqlite.Row (sqlite3.Row), доступ по именам, fromisoformat, try/except
+current - INTEGER epoch, кортежи, позиционный Database._row_to_client
+
+Запуск: python -m benchmarks.bench_row_decode [количество_строк]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+
+import aiosqlite
+
+from database.database import CLIENT_SELECT, Client, Database
+from database.migrations import MigrationContext, _migration_baseline, _migration_epoch_timestamps
+
+ROUNDS = 5
+
+
+def legacy_row_to_client(row: aiosqlite.Row) -> Client:
+    """Декодер строки до перехода на epoch (для сравнения)"""
+    expires_at = None
+    if row["expires_at"]:
+        expires_at = datetime.fromisoformat(row["expires_at"])
+
+    created_at = None
+    if row["created_at"]:
+        created_at = datetime.fromisoformat(row["created_at"])
+
+    last_ip = ""
+    daily_ips = ""
+    ipv6_address = ""
+    has_ipv6 = False
+
+    try:
+        last_ip = row["last_ip"] or ""
+        daily_ips = row["daily_ips"] or ""
+        ipv6_address = row["ipv6_address"] or ""
+        has_ipv6 = bool(row["has_ipv6"])
+    except (IndexError, KeyError):
+        pass
+
+    return Client(
+        id=row["id"],
+        name=row["name"],
+        public_key=row["public_key"],
+        private_key=row["private_key"],
+        preshared_key=row["preshared_key"],
+        ip_address=row["ip_address"],
+        ipv6_address=ipv6_address,
+        has_ipv6=has_ipv6,
+        endpoint=row["endpoint"],
+        created_at=created_at,
+        expires_at=expires_at,
+        traffic_limit=row["traffic_limit"],
+        traffic_used=row["traffic_used"],
+        is_active=bool(row["is_active"]),
+        is_blocked=bool(row["is_blocked"]),
+        last_ip=last_ip,
+        daily_ips=daily_ips
+    )
+
+
+async def build_legacy(rows: int) -> aiosqlite.Connection:
+    """БД в схеме до перехода на epoch, заполненная синтетическими клиентами"""
+    conn = await aiosqlite.connect(":memory:")
+    await _migration_baseline(MigrationContext(conn, 1))
+    now = datetime.now()
+    await conn.executemany(
+        """
+        INSERT INTO clients (name, public_key, private_key, preshared_key, ip_address,
+                             endpoint, created_at, expires_at, traffic_limit, traffic_used, last_ip)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                f"client-{i}", f"pub{i:040d}", f"priv{i:040d}", f"psk{i:040d}",
+                f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}", "vpn.example.com",
+                str(now - timedelta(days=i % 90)), str(now + timedelta(days=i % 30)),
+                10 * 1024 ** 3, i * 1024 ** 2, "203.0.113.7"
+            )
+            for i in range(rows)
+        ]
+    )
+    await conn.commit()
+    return conn
+
+
+async def measure(label: str, conn: aiosqlite.Connection, sql: str, decoder) -> float:
+    """Лучшее время выборки + декодирования всех строк"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        cursor = await conn.execute(sql)
+        [decoder(row) for row in await cursor.fetchall()]
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<10} {best * 1000:8.2f} ms")
+    return best
+
+
+async def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"Декодирование {rows} строк clients (лучшее из {ROUNDS})")
+
+    conn = await build_legacy(rows)
+    conn.row_factory = aiosqlite.Row
+    legacy = await measure("legacy", conn, "SELECT * FROM clients", legacy_row_to_client)
+
+    conn.row_factory = None
+    await _migration_epoch_timestamps(MigrationContext(conn, 2))
+    current = await measure("current", conn, CLIENT_SELECT, Database(":memory:")._row_to_client)
+
+    await conn.close()
+    print(f"Ускорение: x{legacy / current:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Бенчмарк поиска клиентов Database.search_clients на синтетической БД.
+
+Запуск: python -m benchmarks.bench_search [количество_клиентов]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database.database import Client, Database, to_epoch
+
+ROUNDS = 20
+TERMS = [
+    ("точное имя", "user-31337"),
+    ("подстрока имени", "31337"),
+    ("частая подстрока", "user"),
+    ("короткая строка", "77"),
+    ("редкая короткая", "-4"),
+    ("префикс IPv4", "10.0.122."),
+    ("префикс IPv6", "fd42:42:42::7a"),
+    ("префикс ключа", f"pub{31337:040d}"[:40]),
+    ("нет совпадений", "zzzzzz"),
+]
+
+
+def make_client(i: int) -> Client:
+    return Client(
+        name=f"user-{i}",
+        public_key=f"pub{i:040d}",
+        private_key=f"priv{i:040d}",
+        ip_address=f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}",
+        ipv6_address=f"fd42:42:42::{i:x}",
+        has_ipv6=True,
+        endpoint="vpn.example.com",
+        expires_at=datetime.now() + timedelta(days=30),
+    )
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"), pool_size=1)
+        await db.init_db()
+        async with db.pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO clients (name, public_key, private_key, ip_address, ipv6_address,"
+                " has_ipv6, endpoint, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (c.name, c.public_key, c.private_key, c.ip_address, c.ipv6_address,
+                     c.has_ipv6, c.endpoint, to_epoch(c.expires_at))
+                    for c in map(make_client, range(count))
+                ]
+            )
+            await conn.commit()
+
+        print(f"Поиск среди {count} клиентов (медиана из {ROUNDS}, страница 10)")
+        for label, term in TERMS:
+            timings = []
+            for _ in range(ROUNDS):
+                started = time.perf_counter()
+                result = await db.search_clients(term, limit=10)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            first = result.clients[0].name if result.clients else "-"
+            total = f"{result.total}{'+' if result.truncated else ''}"
+            print(f"{label:<18} {term!r:<46} {timings[len(timings) // 2] * 1000:6.2f} ms  "
+                  f"найдено {total:>5}, первый: {first}")
+
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+"""
+Локальная имитация Bot API Telegram для бенчмарков доставки обновлений.
+
+Поддерживает getMe, getUpdates (long polling), setWebhook/deleteWebhook,
+answerCallbackQuery, editMessageText и sendMessage. Нажатия кнопок
+(callback_query) доставляются через getUpdates или POST на webhook бота,
+с односторонней сетевой задержкой delay для каждого перехода.
+"""
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+BOT_TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+ADMIN_USER = {"id": 42, "is_bot": False, "first_name": "Admin"}
+
+
+class FakeTelegramAPI:
+    """Имитация Bot API: очередь обновлений, webhook и учет ответов бота на нажатия"""
+
+    def __init__(self, delay: float = 0.0, webhook_connections: int = 40):
+        self.delay = delay
+        self.webhook_connections = webhook_connections
+        self.url = ""
+
+        self._updates: List[dict] = []
+        self._update_id = 0
+        self._new_updates = asyncio.Event()
+        self._clicked_at: Dict[str, float] = {}
+        self._answered: Dict[str, asyncio.Future] = {}
+        self._webhook_url: Optional[str] = None
+        self._webhook_secret = ""
+        self._webhook_slots = asyncio.Semaphore(webhook_connections)
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks = set()
+
+        self.calls: Dict[str, int] = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        self._client = aiohttp.ClientSession()
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def click(self, data: str = "refresh") -> asyncio.Future:
+        """Нажатие кнопки; future завершается задержкой до answerCallbackQuery бота"""
+        self._update_id += 1
+        callback_id = str(self._update_id)
+        update = {
+            "update_id": self._update_id,
+            "callback_query": {
+                "id": callback_id,
+                "from": ADMIN_USER,
+                "chat_instance": "1",
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": ADMIN_USER["id"], "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            },
+        }
+        self._clicked_at[callback_id] = time.monotonic()
+        self._answered[callback_id] = asyncio.get_running_loop().create_future()
+
+        if self._webhook_url:
+            task = asyncio.create_task(self._post_webhook(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+        return self._answered[callback_id]
+
+    async def _post_webhook(self, update: dict) -> None:
+        async with self._webhook_slots:
+            await asyncio.sleep(self.delay)
+            async with self._client.post(
+                self._webhook_url,
+                data=json.dumps(update),
+                headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self._webhook_secret},
+            ) as response:
+                await response.read()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        await asyncio.sleep(self.delay)
+
+        if method == "getUpdates":
+            result = await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "setWebhook":
+            self._webhook_url = params["url"]
+            self._webhook_secret = params.get("secret_token", "")
+            result = True
+        elif method == "deleteWebhook":
+            self._webhook_url = None
+            result = True
+        elif method == "answerCallbackQuery":
+            answered = self._answered.get(params["callback_query_id"])
+            if answered is not None and not answered.done():
+                answered.set_result(time.monotonic() - self._clicked_at[params["callback_query_id"]])
+            result = True
+        elif method in ("editMessageText", "sendMessage"):
+            result = {
+                "message_id": int(params.get("message_id", 1)),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        self.calls[method] = self.calls.get(method, 0) + 1
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[dict]:
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        updates = list(self._updates)
+        # Ответ идет обратно по сети; нажатия за это время попадут в следующий getUpdates
+        await asyncio.sleep(self.delay)
+        return updates
@@ -22,13 +22,79 @@ class Config:
     
     # Базы данных
     database_path: str = "./clients.db"
+    ip_log_flush_interval: float = 30.0  # Интервал сброса буфера IP-подключений (сек)
+    ip_log_max_pending: int = 500  # Сброс буфера IP-подключений при достижении размера
+    client_sweep_batch_size: int = 500  # Размер пакета чтения/записи клиентов при проверке лимитов
+    bulk_create_max: int = 500  # Максимум клиентов за одно массовое создание
     
     # Резервные копии
     backup_dir: str = "./backups"
     
     # API настройки
     ip_api_url: str = "http://ip-api.com/json"
-    ip_api_rate_limit: int = 45 
+    ip_api_batch_url: str = "http://ip-api.com/batch"  # Пакетный эндпоинт (до 100 адресов в запросе)
+    ip_api_rate_limit: int = 45  # Запросов в минуту к ip_api_url до первого ответа (дальше - по X-Rl/X-Ttl)
+    ip_api_batch_rate_limit: int = 15  # То же для ip_api_batch_url
+    ip_api_max_connections: int = 4  # Одновременных соединений с IP-API (остальные запросы ждут)
+    ip_api_keepalive_timeout: float = 30.0  # Сколько держать простаивающее соединение открытым (сек)
+    ip_api_dns_cache_ttl: int = 300  # Кэш DNS-имени IP-API (сек)
+    ip_api_timeout: float = 10.0  # Таймаут запроса к IP-API (сек)
+    geo_view_timeout: float = 10.0  # Ожидание геолокации на экране IP клиента (сек), дальше - без нее
+    geo_cache_ttl: float = 7 * 24 * 3600  # Время жизни геолокации IP в кэше (сек)
+    geo_negative_ttl: float = 3600.0  # Время жизни неудачного ответа IP-API (сек)
+    geo_cache_memory_entries: int = 4096  # Записей геолокации в памяти перед таблицей geo_cache
+    geo_mmdb_path: str = ""  # Локальная база городов MaxMind (.mmdb, например GeoLite2-City); пусто - только IP-API
+    geo_asn_mmdb_path: str = ""  # Локальная база провайдеров (GeoLite2-ASN .mmdb), необязательно
+    geo_mmdb_check_interval: float = 60.0  # Проверка обновления файлов базы (сек); обновлять заменой файла
+    
+    # DNS endpoint для vpn://
+    dns_cache_ttl: float = 300.0  # Время жизни успешного разрешения (сек)
+    dns_negative_ttl: float = 30.0  # Время жизни неудачного разрешения (сек)
+    dns_resolve_timeout: float = 5.0  # Таймаут разрешения имени (сек)
+    
+    # Кэш QR-кодов и vpn:// строк
+    artifact_cache_max_bytes: int = 32 * 1024 * 1024  # Лимит кэша в памяти
+    artifact_spill_dir: str = ""  # Каталог для вытесненных записей (пусто - без диска; файлы содержат ключи клиентов)
+    artifact_spill_max_bytes: int = 256 * 1024 * 1024  # Лимит кэша на диске
+    
+    # QR-коды конфигураций
+    qr_backend: str = "bitmap"  # styled (скругленные модули, медленно) или bitmap (однобитный PNG)
+    qr_box_size: int = 10  # Пикселей на модуль
+    
+    # Пулы для CPU-емкой работы вне цикла событий
+    image_workers: int = 2  # Рендеринг QR-кодов
+    crypto_workers: int = 1  # Генерация ключей
+    archive_workers: int = 1  # Сжатие vpn:// и резервные копии (всегда потоки)
+    worker_queue_limit: int = 32  # Задач в очереди пула сверх числа исполнителей (дальше - ожидание)
+    worker_use_processes: bool = False  # Процессы вместо потоков для image и crypto
+    
+    # Исходящие запросы к Telegram (лимиты flood control)
+    tg_global_rate: float = 30.0  # Сообщений в секунду на всего бота
+    tg_chat_rate: float = 1.0  # Сообщений в секунду в личный чат
+    tg_chat_burst: float = 3.0  # Допустимый всплеск в личном чате
+    tg_group_rate: float = 20 / 60  # Сообщений в секунду в группу
+    tg_max_retries: int = 3  # Повторов после ответа 429 (retry_after)
+    
+    # Получение обновлений: polling (по умолчанию) или webhook
+    webhook_url: str = ""  # Публичный HTTPS URL webhook (пусто - polling)
+    webhook_path: str = "/webhook"  # Путь, на котором встроенный сервер принимает обновления
+    webhook_host: str = "127.0.0.1"  # Адрес встроенного сервера (за reverse proxy с TLS)
+    webhook_port: int = 8080  # Порт встроенного сервера
+    webhook_secret: str = ""  # Секретный токен webhook (пусто - случайный при каждом запуске)
+    webhook_max_connections: int = 40  # Одновременных соединений Telegram к webhook (1-100)
+    webhook_drain_timeout: float = 30.0  # Ожидание обработки принятых обновлений при остановке (сек)
+    update_concurrency: int = 16  # Одновременно обрабатываемых обновлений (webhook и polling)
+    
+    # Состояния диалогов (FSM) и последние сообщения в SQLite
+    fsm_state_ttl: float = 24 * 3600  # Диалог без изменений дольше этого считается брошенным (сек)
+    last_message_ttl: float = 48 * 3600  # Срок хранения ID последнего сообщения пользователю (сек)
+    session_flush_interval: float = 2.0  # Интервал пакетной записи изменений в БД (сек)
+    
+    # Метрики обработки обновлений
+    slow_update_ms: float = 1000.0  # Обновления дольше этого пишутся в лог с разбивкой по БД и subprocess
+    metrics_port: int = 0  # Порт эндпоинта /metrics для Prometheus (0 - отключен)
+    metrics_host: str = "127.0.0.1"  # Адрес эндпоинта метрик
+    metrics_peer_page_size: int = 1000  # Пиров на странице метрик (?page=N)
     
     def __post_init__(self):
         """Инициализация после создания объекта"""
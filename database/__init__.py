@@ -2,12 +2,16 @@
 Модуль для работы с базой данных
 """
 
-from .database import Database, Client, init_db, get_db
+from .database import Database, Client, ClientSearchResult, init_db, get_db
+from .ip_connections import IPConnectionWriter, get_ip_connection_writer
 
 __all__ = [
     'Database',
     'BotSettings',
     'Client',
+    'ClientSearchResult',
     'init_db',
-    'get_db'
+    'get_db',
+    'IPConnectionWriter',
+    'get_ip_connection_writer'
 ]
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Применение миграций схемы к файлу БД вне бота (например, перед обновлением на проде).
+
+Запуск: python -m database [путь_к_clients.db]
+"""
+import asyncio
+import logging
+import sys
+import time
+
+import aiosqlite
+
+from .migrations import _table_names, get_schema_version, run_migrations
+
+
+def print_progress(version: int, stage: str, done: int, total: int) -> None:
+    """Вывод прогресса пакетного переписывания данных"""
+    print(f"  [{version}] {stage}: {done}/{total}")
+
+
+async def main(db_path: str) -> None:
+    async with aiosqlite.connect(db_path, timeout=30.0) as db:
+        await db.execute("PRAGMA journal_mode = WAL")
+        before = await get_schema_version(db) if "schema_version" in await _table_names(db) else 0
+        after = await run_migrations(db, on_progress=print_progress)
+
+        print(f"{db_path}: версия схемы {before} -> {after}")
+        cursor = await db.execute(
+            "SELECT version, description, applied_at, duration_ms FROM schema_version ORDER BY version"
+        )
+        for version, description, applied_at, duration_ms in await cursor.fetchall():
+            applied = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(applied_at))
+            print(f"  {version}: {description} ({duration_ms} мс, {applied})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "clients.db"))
@@ -1,13 +1,38 @@
 import aiosqlite
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Set, Tuple, Sequence, AsyncIterator, Callable
+from dataclasses import dataclass, field
 from contextlib import asynccontextmanager
 
+from .migrations import run_migrations
+
+# Порядок колонок clients в SELECT - на него опирается позиционный декодер _row_to_client
+CLIENT_COLUMNS = (
+    'id', 'name', 'public_key', 'private_key', 'preshared_key', 'ip_address',
+    'ipv6_address', 'has_ipv6', 'endpoint', 'created_at', 'expires_at', 'traffic_limit',
+    'traffic_used', 'is_active', 'is_blocked', 'last_ip', 'daily_ips'
+)
+CLIENT_SELECT = "SELECT " + ", ".join(CLIENT_COLUMNS) + " FROM clients"
+
+# Поиск клиентов: минимальная длина подстроки для индекса trigram, предел
+# кандидатов в каждой группе совпадений и верхняя граница диапазона при поиске
+# по префиксу (максимальный символ Unicode)
+SEARCH_TRIGRAM_MIN = 3
+SEARCH_MAX_RESULTS = 500
+SEARCH_PREFIX_END = '\U0010ffff'
+
+# Колонки clients, которые можно изменять через update_client
+CLIENT_UPDATABLE_COLUMNS = (
+    'name', 'public_key', 'private_key', 'preshared_key', 'ip_address',
+    'ipv6_address', 'has_ipv6', 'endpoint', 'expires_at', 'traffic_limit',
+    'traffic_used', 'is_active', 'is_blocked', 'last_ip', 'daily_ips'
+)
+
 @dataclass
 class Client:
-    """Модель клиента"""
+    """Модель клиента с отслеживанием измененных полей"""
     id: Optional[int] = None
     name: str = ""
     public_key: str = ""
@@ -25,6 +50,31 @@ class Client:
     is_blocked: bool = False
     last_ip: str = ""
     daily_ips: str = ""
+    _dirty: Set[str] = field(default_factory=set, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Новый объект еще не синхронизирован с БД - считаем измененными все поля
+        self._dirty.update(CLIENT_UPDATABLE_COLUMNS)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in CLIENT_UPDATABLE_COLUMNS:
+            dirty = self.__dict__.get('_dirty')
+            if dirty is not None and self.__dict__.get(name, value) != value:
+                dirty.add(name)
+        object.__setattr__(self, name, value)
+
+    @property
+    def dirty_fields(self) -> Tuple[str, ...]:
+        """Измененные с момента загрузки/сохранения поля в порядке колонок"""
+        return tuple(c for c in CLIENT_UPDATABLE_COLUMNS if c in self._dirty)
+
+    def mark_clean(self) -> None:
+        """Отметить объект как синхронизированный с БД"""
+        self._dirty.clear()
+
+    def mark_dirty(self, *fields: str) -> None:
+        """Принудительно отметить поля (все, если не указаны) как измененные"""
+        self._dirty.update(fields or CLIENT_UPDATABLE_COLUMNS)
 
 @dataclass
 class BotSettings:
@@ -47,6 +97,26 @@ class ClientIPConnection:
     last_seen: Optional[datetime] = None
     date: str = ""
 
+@dataclass
+class ClientSearchResult:
+    """Страница результатов поиска клиентов"""
+    clients: List[Client]
+    total: int
+    # Совпадений больше SEARCH_MAX_RESULTS - total усечен
+    truncated: bool = False
+
+def to_epoch(value: Optional[datetime]) -> Optional[int]:
+    """datetime (локальное время) -> unix epoch для хранения в БД"""
+    return int(value.timestamp()) if value is not None else None
+
+def from_epoch(value: Optional[int]) -> Optional[datetime]:
+    """unix epoch из БД -> datetime (локальное время)"""
+    return datetime.fromtimestamp(value) if value is not None else None
+
+# Локальные ссылки для декодера строк clients (горячий путь)
+_new_client = object.__new__
+_fromtimestamp = datetime.fromtimestamp
+
 class DatabaseConnectionPool:
     """Connection pool для SQLite с оптимизациями производительности"""
     
@@ -57,11 +127,12 @@ class DatabaseConnectionPool:
         self._available: List[aiosqlite.Connection] = []
         self.logger = logging.getLogger(__name__)
         self._initialized = False
+        # Учет обращений: (время работы с соединением, ожидание соединения) в секундах
+        self.on_release: Optional[Callable[[float, float], None]] = None
 
     async def _create_connection(self) -> aiosqlite.Connection:
         """Создание оптимизированного соединения с БД"""
         conn = await aiosqlite.connect(self.db_path, timeout=30.0)
-        conn.row_factory = aiosqlite.Row
         
         # Критические оптимизации производительности
         await conn.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging для конкурентного доступа
@@ -92,22 +163,31 @@ class DatabaseConnectionPool:
     @asynccontextmanager
     async def acquire(self):
         """Получение соединения из пула"""
+        requested = time.perf_counter()
         if not self._initialized:
             await self.initialize()
             
         if not self._available:
             # Если пул исчерпан, создаем временное соединение
             conn = await self._create_connection()
+            acquired = time.perf_counter()
             try:
                 yield conn
             finally:
                 await conn.close()
+                self._released(requested, acquired)
         else:
             conn = self._available.pop()
+            acquired = time.perf_counter()
             try:
                 yield conn
             finally:
                 self._available.append(conn)
+                self._released(requested, acquired)
+
+    def _released(self, requested: float, acquired: float) -> None:
+        if self.on_release is not None:
+            self.on_release(time.perf_counter() - acquired, acquired - requested)
 
     async def close(self):
         """Закрытие всех соединений"""
@@ -125,72 +205,19 @@ class Database:
         self.db_path = db_path
         self.pool = DatabaseConnectionPool(db_path, pool_size)
         self.logger = logging.getLogger(__name__)
+        # Индекс trigram по имени клиента (нет, если SQLite не поддерживает trigram)
+        self.has_name_fts = False
 
     async def init_db(self):
-        """Инициализация базы данных с индексами"""
+        """Инициализация базы данных: применение миграций схемы"""
         await self.pool.initialize()
         
         async with self.pool.acquire() as db:
-            # Создание таблиц
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS clients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    public_key TEXT NOT NULL,
-                    private_key TEXT NOT NULL,
-                    preshared_key TEXT DEFAULT '',
-                    ip_address TEXT NOT NULL UNIQUE,
-                    ipv6_address TEXT DEFAULT '',
-                    has_ipv6 BOOLEAN DEFAULT 0,
-                    endpoint TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    traffic_limit INTEGER,
-                    traffic_used INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    is_blocked BOOLEAN DEFAULT 0,
-                    last_ip TEXT DEFAULT '',
-                    daily_ips TEXT DEFAULT ''
-                )
-            """)
-
-            # Индексы для ускорения запросов
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_name ON clients(name)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_public_key ON clients(public_key)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_is_active ON clients(is_active)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_is_blocked ON clients(is_blocked)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_expires_at ON clients(expires_at)")
-
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS client_ip_connections (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    client_id INTEGER NOT NULL,
-                    ip_address TEXT NOT NULL,
-                    connection_count INTEGER DEFAULT 1,
-                    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    date TEXT NOT NULL,
-                    UNIQUE(client_id, ip_address, date),
-                    FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
-                )
-            """)
-
-            # Индексы для client_ip_connections
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_ip_conn_client_date ON client_ip_connections(client_id, date)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_ip_conn_date ON client_ip_connections(date)")
-
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bot_settings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    setting_key TEXT NOT NULL UNIQUE,
-                    setting_value TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_settings_key ON bot_settings(setting_key)")
+            version = await run_migrations(db)
+            cursor = await db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clients_fts'"
+            )
+            self.has_name_fts = await cursor.fetchone() is not None
 
             await db.execute("""
                 INSERT OR IGNORE INTO bot_settings (setting_key, setting_value, description)
@@ -200,7 +227,7 @@ class Database:
             """)
 
             await db.commit()
-            self.logger.info("База данных инициализирована с индексами")
+            self.logger.info(f"База данных инициализирована, версия схемы: {version}")
 
     async def get_setting(self, setting_key: str) -> Optional[str]:
         """Получение значения настройки (с кешированием через индекс)"""
@@ -227,27 +254,23 @@ class Database:
     async def get_all_settings(self) -> List[BotSettings]:
         """Получение всех настроек"""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("SELECT * FROM bot_settings ORDER BY setting_key")
+            cursor = await db.execute(
+                "SELECT id, setting_key, setting_value, description, created_at, updated_at "
+                "FROM bot_settings ORDER BY setting_key"
+            )
             rows = await cursor.fetchall()
             return [self._row_to_setting(row) for row in rows]
 
-    def _row_to_setting(self, row: aiosqlite.Row) -> BotSettings:
+    def _row_to_setting(self, row: tuple) -> BotSettings:
         """Преобразование строки БД в объект BotSettings"""
-        created_at = None
-        updated_at = None
-
-        if row["created_at"]:
-            created_at = datetime.fromisoformat(row["created_at"])
-        if row["updated_at"]:
-            updated_at = datetime.fromisoformat(row["updated_at"])
-
+        id_, setting_key, setting_value, description, created_at, updated_at = row
         return BotSettings(
-            id=row["id"],
-            setting_key=row["setting_key"],
-            setting_value=row["setting_value"],
-            description=row["description"],
-            created_at=created_at,
-            updated_at=updated_at
+            id=id_,
+            setting_key=setting_key,
+            setting_value=setting_value,
+            description=description,
+            created_at=datetime.fromisoformat(created_at) if created_at else None,
+            updated_at=datetime.fromisoformat(updated_at) if updated_at else None
         )
 
     async def add_client(self, client: Client) -> int:
@@ -261,11 +284,13 @@ class Database:
             """, (
                 client.name, client.public_key, client.private_key,
                 client.preshared_key, client.ip_address, client.ipv6_address,
-                client.has_ipv6, client.endpoint, client.expires_at,
+                client.has_ipv6, client.endpoint, to_epoch(client.expires_at),
                 client.traffic_limit, client.is_active, client.is_blocked,
                 client.last_ip, client.daily_ips
             ))
             await db.commit()
+            client.id = cursor.lastrowid
+            client.mark_clean()
             return cursor.lastrowid
 
     async def add_clients_batch(self, clients: List[Client]) -> List[int]:
@@ -283,12 +308,15 @@ class Database:
                     """, (
                         client.name, client.public_key, client.private_key,
                         client.preshared_key, client.ip_address, client.ipv6_address,
-                        client.has_ipv6, client.endpoint, client.expires_at,
+                        client.has_ipv6, client.endpoint, to_epoch(client.expires_at),
                         client.traffic_limit, client.is_active, client.is_blocked,
                         client.last_ip, client.daily_ips
                     ))
                     client_ids.append(cursor.lastrowid)
                 await db.commit()
+                for client, client_id in zip(clients, client_ids):
+                    client.id = client_id
+                    client.mark_clean()
             except Exception as e:
                 await db.execute("ROLLBACK")
                 self.logger.error(f"Ошибка batch добавления: {e}")
@@ -298,7 +326,7 @@ class Database:
     async def get_client(self, client_id: int) -> Optional[Client]:
         """Получение клиента по ID (использует индекс PRIMARY KEY)"""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("SELECT * FROM clients WHERE id = ?", (client_id,))
+            cursor = await db.execute(f"{CLIENT_SELECT} WHERE id = ?", (client_id,))
             row = await cursor.fetchone()
             if row:
                 return self._row_to_client(row)
@@ -307,16 +335,29 @@ class Database:
     async def get_client_by_name(self, name: str) -> Optional[Client]:
         """Получение клиента по имени (использует индекс idx_clients_name)"""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("SELECT * FROM clients WHERE name = ?", (name,))
+            cursor = await db.execute(f"{CLIENT_SELECT} WHERE name = ?", (name,))
             row = await cursor.fetchone()
             if row:
                 return self._row_to_client(row)
             return None
 
+    async def get_existing_names(self, names: Sequence[str]) -> Set[str]:
+        """Какие из имен уже заняты (проверка перед массовым созданием)"""
+        existing: Set[str] = set()
+        names = list(names)
+        async with self.pool.acquire() as db:
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                cursor = await db.execute(
+                    f"SELECT name FROM clients WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                existing.update(row[0] for row in await cursor.fetchall())
+        return existing
+
     async def get_client_by_public_key(self, public_key: str) -> Optional[Client]:
         """Получение клиента по public_key (использует индекс idx_clients_public_key)"""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("SELECT * FROM clients WHERE public_key = ?", (public_key,))
+            cursor = await db.execute(f"{CLIENT_SELECT} WHERE public_key = ?", (public_key,))
             row = await cursor.fetchone()
             if row:
                 return self._row_to_client(row)
@@ -325,15 +366,51 @@ class Database:
     async def get_all_clients(self) -> List[Client]:
         """Получение всех клиентов"""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("SELECT * FROM clients ORDER BY name COLLATE NOCASE ASC")
+            cursor = await db.execute(f"{CLIENT_SELECT} ORDER BY name COLLATE NOCASE ASC")
             rows = await cursor.fetchall()
             return [self._row_to_client(row) for row in rows]
 
+    async def iter_clients(
+        self,
+        batch_size: int = 500,
+        columns: Optional[Sequence[str]] = None
+    ) -> AsyncIterator[Any]:
+        """
+        Потоковый обход всех клиентов (порядок по id) пакетами fetchmany.
+
+        Без columns выдает объекты Client, с columns - кортежи выбранных колонок
+        (проекция без построения Client). В памяти одновременно находится
+        не больше batch_size строк.
+        """
+        if columns:
+            unknown = set(columns) - set(CLIENT_COLUMNS)
+            if unknown:
+                raise ValueError(f"Неизвестные колонки clients: {', '.join(sorted(unknown))}")
+            sql = f"SELECT {', '.join(columns)} FROM clients ORDER BY id"
+        else:
+            sql = f"{CLIENT_SELECT} ORDER BY id"
+
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(sql)
+            try:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if columns:
+                        for row in rows:
+                            yield row
+                    else:
+                        for row in rows:
+                            yield self._row_to_client(row)
+            finally:
+                await cursor.close()
+
     async def get_clients_paginated(self, offset: int = 0, limit: int = 10) -> List[Client]:
         """Получение клиентов с пагинацией для больших выборок"""
         async with self.pool.acquire() as db:
             cursor = await db.execute(
-                "SELECT * FROM clients ORDER BY name COLLATE NOCASE ASC LIMIT ? OFFSET ?",
+                f"{CLIENT_SELECT} ORDER BY name COLLATE NOCASE ASC LIMIT ? OFFSET ?",
                 (limit, offset)
             )
             rows = await cursor.fetchall()
@@ -346,53 +423,170 @@ class Database:
             row = await cursor.fetchone()
             return row[0] if row else 0
 
-    async def update_client(self, client: Client) -> bool:
-        """Обновление клиента"""
+    async def get_clients_summary(self) -> Dict[str, int]:
+        """Счетчики и суммы трафика по всем клиентам одним агрегатным запросом"""
         async with self.pool.acquire() as db:
             cursor = await db.execute("""
-                UPDATE clients SET name = ?, endpoint = ?, expires_at = ?,
-                                 traffic_limit = ?, traffic_used = ?,
-                                 is_active = ?, is_blocked = ?,
-                                 last_ip = ?, daily_ips = ?,
-                                 ipv6_address = ?, has_ipv6 = ?
-                WHERE id = ?
-            """, (
-                client.name, client.endpoint, client.expires_at,
-                client.traffic_limit, client.traffic_used,
-                client.is_active, client.is_blocked,
-                client.last_ip, client.daily_ips,
-                client.ipv6_address, client.has_ipv6, client.id
-            ))
+                SELECT COUNT(*),
+                       COUNT(CASE WHEN is_active AND NOT is_blocked THEN 1 END),
+                       COUNT(CASE WHEN is_blocked THEN 1 END),
+                       COALESCE(SUM(traffic_used), 0),
+                       COALESCE(SUM(CASE WHEN typeof(traffic_limit) = 'integer' AND traffic_limit > 0
+                                         THEN traffic_limit END), 0),
+                       COUNT(CASE WHEN typeof(traffic_limit) = 'integer' AND traffic_limit > 0 THEN 1 END)
+                FROM clients
+            """)
+            row = await cursor.fetchone()
+            total, active, blocked, traffic_used, traffic_limit, with_limit = row
+            return {
+                'total': total,
+                'active': active,
+                'blocked': blocked,
+                'traffic_used': traffic_used,
+                'traffic_limit': traffic_limit,
+                'clients_with_limit': with_limit,
+            }
+
+    async def search_clients(self, term: str, limit: int = 10, offset: int = 0) -> ClientSearchResult:
+        """
+        Поиск клиентов по имени (точное, префикс, подстрока) и префиксу IPv4/IPv6/публичного ключа.
+
+        Порядок: точное совпадение имени, префикс имени, подстрока имени, адреса,
+        публичный ключ; внутри группы - по длине и алфавиту имени. Каждая группа
+        ограничена SEARCH_MAX_RESULTS кандидатами, поэтому частые подстроки
+        не приводят к сортировке всей таблицы.
+        """
+        term = term.strip()
+        if not term:
+            return ClientSearchResult([], 0, False)
+
+        like = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        upper = term + SEARCH_PREFIX_END
+        cap = SEARCH_MAX_RESULTS + 1
+
+        if len(term) >= SEARCH_TRIGRAM_MIN and self.has_name_fts:
+            # Индекс trigram работает только для подстрок от 3 символов
+            substring = "SELECT rowid, 2 FROM clients_fts WHERE clients_fts MATCH ? LIMIT ?"
+            substring_param = '"' + term.replace('"', '""') + '"'
+        else:
+            substring = "SELECT id, 2 FROM clients WHERE name LIKE ? ESCAPE '\\' LIMIT ?"
+            substring_param = '%' + like + '%'
+
+        hits = f"""
+            WITH hits (id, tier) AS (
+                SELECT id, 0 FROM clients WHERE name = ? COLLATE NOCASE
+                UNION ALL SELECT * FROM (
+                    SELECT id, 1 FROM clients WHERE name LIKE ? ESCAPE '\\' LIMIT ?)
+                UNION ALL SELECT * FROM ({substring})
+                UNION ALL SELECT * FROM (
+                    SELECT id, 3 FROM clients WHERE ip_address >= ? AND ip_address < ? LIMIT ?)
+                UNION ALL SELECT * FROM (
+                    SELECT id, 3 FROM clients WHERE ipv6_address >= ? AND ipv6_address < ? LIMIT ?)
+                UNION ALL SELECT * FROM (
+                    SELECT id, 4 FROM clients WHERE public_key >= ? AND public_key < ? LIMIT ?)
+            ),
+            ranked AS (SELECT id, MIN(tier) AS tier FROM hits GROUP BY id)
+        """
+        params = (
+            term,
+            like + '%', cap,
+            substring_param, cap,
+            term, upper, cap,
+            term.lower(), upper.lower(), cap,
+            term, upper, cap,
+        )
+        columns = ", ".join(f"clients.{column}" for column in CLIENT_COLUMNS)
+
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                f"""
+                {hits}
+                SELECT {columns}, COUNT(*) OVER () FROM ranked JOIN clients ON clients.id = ranked.id
+                ORDER BY ranked.tier, length(clients.name), clients.name COLLATE NOCASE
+                LIMIT ? OFFSET ?
+                """,
+                params + (limit, min(offset, SEARCH_MAX_RESULTS))
+            )
+            rows = await cursor.fetchall()
+            if rows:
+                total = rows[0][-1]
+                clients = [self._row_to_client(row[:-1]) for row in rows]
+            elif offset:
+                # Страница за пределами результатов - нужен только общий счетчик
+                cursor = await db.execute(f"{hits} SELECT COUNT(*) FROM ranked", params)
+                total = (await cursor.fetchone())[0]
+                clients = []
+            else:
+                total = 0
+                clients = []
+
+        truncated = total > SEARCH_MAX_RESULTS
+        if truncated:
+            total = SEARCH_MAX_RESULTS
+            clients = clients[:max(0, SEARCH_MAX_RESULTS - offset)]
+        return ClientSearchResult(clients, total, truncated)
+
+    @staticmethod
+    def _build_client_update(columns: Tuple[str, ...]) -> str:
+        """UPDATE только по измененным колонкам"""
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        return f"UPDATE clients SET {assignments} WHERE id = ?"
+
+    @staticmethod
+    def _client_update_params(client: Client, columns: Tuple[str, ...]) -> tuple:
+        """Параметры для UPDATE в порядке колонок + id клиента"""
+        return tuple(
+            to_epoch(client.expires_at) if column == 'expires_at' else getattr(client, column)
+            for column in columns
+        ) + (client.id,)
+
+    async def update_client(self, client: Client) -> bool:
+        """Обновление клиента (пишутся только измененные поля)"""
+        columns = client.dirty_fields
+        if not columns:
+            return True
+
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                self._build_client_update(columns),
+                self._client_update_params(client, columns)
+            )
             await db.commit()
-            return cursor.rowcount > 0
+            if cursor.rowcount > 0:
+                client.mark_clean()
+                return True
+            return False
 
     async def update_clients_batch(self, clients: List[Client]) -> int:
-        """Batch-обновление клиентов"""
+        """Batch-обновление клиентов, сгруппированных по набору измененных колонок"""
+        groups: Dict[Tuple[str, ...], List[Client]] = {}
+        for client in clients:
+            columns = client.dirty_fields
+            if columns:
+                groups.setdefault(columns, []).append(client)
+
+        if not groups:
+            return 0
+
         async with self.pool.acquire() as db:
             updated_count = 0
             await db.execute("BEGIN")
             try:
-                for client in clients:
-                    cursor = await db.execute("""
-                        UPDATE clients SET name = ?, endpoint = ?, expires_at = ?,
-                                         traffic_limit = ?, traffic_used = ?,
-                                         is_active = ?, is_blocked = ?,
-                                         last_ip = ?, daily_ips = ?,
-                                         ipv6_address = ?, has_ipv6 = ?
-                        WHERE id = ?
-                    """, (
-                        client.name, client.endpoint, client.expires_at,
-                        client.traffic_limit, client.traffic_used,
-                        client.is_active, client.is_blocked,
-                        client.last_ip, client.daily_ips,
-                        client.ipv6_address, client.has_ipv6, client.id
-                    ))
+                for columns, group in groups.items():
+                    cursor = await db.executemany(
+                        self._build_client_update(columns),
+                        [self._client_update_params(client, columns) for client in group]
+                    )
                     updated_count += cursor.rowcount
                 await db.commit()
             except Exception as e:
                 await db.execute("ROLLBACK")
                 self.logger.error(f"Ошибка batch обновления: {e}")
                 raise
+
+            for group in groups.values():
+                for client in group:
+                    client.mark_clean()
             return updated_count
 
     async def delete_client(self, client_id: int) -> bool:
@@ -402,12 +596,60 @@ class Database:
             await db.commit()
             return cursor.rowcount > 0
 
+    async def delete_clients_batch(self, client_ids: Sequence[int]) -> int:
+        """Удаление нескольких клиентов одной транзакцией"""
+        client_ids = list(client_ids)
+        async with self.pool.acquire() as db:
+            deleted_count = 0
+            await db.execute("BEGIN")
+            try:
+                for start in range(0, len(client_ids), 500):
+                    chunk = client_ids[start:start + 500]
+                    cursor = await db.execute(
+                        f"DELETE FROM clients WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+                    deleted_count += cursor.rowcount
+                await db.commit()
+            except Exception as e:
+                await db.execute("ROLLBACK")
+                self.logger.error(f"Ошибка batch удаления: {e}")
+                raise
+            return deleted_count
+
+    async def replace_all_clients(self, clients: List[Client]) -> int:
+        """Замена всех клиентов одной транзакцией (восстановление из резервной копии)"""
+        async with self.pool.acquire() as db:
+            await db.execute("BEGIN")
+            try:
+                await db.execute("DELETE FROM clients")
+                await db.executemany("""
+                    INSERT INTO clients (name, public_key, private_key, preshared_key, ip_address,
+                                       ipv6_address, has_ipv6, endpoint, expires_at, traffic_limit,
+                                       traffic_used, is_active, is_blocked, last_ip, daily_ips)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (
+                        client.name, client.public_key, client.private_key,
+                        client.preshared_key, client.ip_address, client.ipv6_address,
+                        client.has_ipv6, client.endpoint, to_epoch(client.expires_at),
+                        client.traffic_limit, client.traffic_used, client.is_active,
+                        client.is_blocked, client.last_ip, client.daily_ips
+                    )
+                    for client in clients
+                ])
+                await db.commit()
+            except Exception as e:
+                await db.execute("ROLLBACK")
+                self.logger.error(f"Ошибка замены клиентов: {e}")
+                raise
+            return len(clients)
+
     async def get_expired_clients(self) -> List[Client]:
         """Получение просроченных клиентов (использует индекс idx_clients_expires_at)"""
-        now = datetime.now()
+        now = to_epoch(datetime.now())
         async with self.pool.acquire() as db:
             cursor = await db.execute(
-                "SELECT * FROM clients WHERE expires_at IS NOT NULL AND expires_at < ?",
+                f"{CLIENT_SELECT} WHERE expires_at IS NOT NULL AND expires_at < ?",
                 (now,)
             )
             rows = await cursor.fetchall()
@@ -417,31 +659,67 @@ class Database:
         """Получение клиентов с превышенным трафиком"""
         async with self.pool.acquire() as db:
             cursor = await db.execute(
-                "SELECT * FROM clients WHERE traffic_limit IS NOT NULL AND traffic_used >= traffic_limit"
+                f"{CLIENT_SELECT} WHERE traffic_limit IS NOT NULL AND traffic_used >= traffic_limit"
             )
             rows = await cursor.fetchall()
             return [self._row_to_client(row) for row in rows]
 
-    async def add_client_ip_connection(self, client_id: int, ip_address: str) -> None:
-        """Добавление или обновление записи о подключении клиента по IP"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        now = datetime.now()
-        
+    async def get_clients_filtered(self, expires_before: Optional[datetime] = None,
+                                   traffic_percent: Optional[float] = None,
+                                   name_prefix: Optional[str] = None,
+                                   is_blocked: Optional[bool] = None) -> List[Client]:
+        """Клиенты, удовлетворяющие всем заданным условиям (для массовых операций)"""
+        conditions = []
+        params: List[Any] = []
+        if expires_before is not None:
+            conditions.append("expires_at IS NOT NULL AND expires_at < ?")
+            params.append(to_epoch(expires_before))
+        if traffic_percent is not None:
+            conditions.append("traffic_limit IS NOT NULL AND traffic_limit > 0 AND traffic_used * 100.0 >= traffic_limit * ?")
+            params.append(traffic_percent)
+        if name_prefix:
+            # Диапазон по префиксу использует индекс idx_clients_name
+            conditions.append("name >= ? AND name < ?")
+            params.extend((name_prefix, name_prefix + SEARCH_PREFIX_END))
+        if is_blocked is not None:
+            conditions.append("is_blocked = ?")
+            params.append(is_blocked)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
         async with self.pool.acquire() as db:
-            cursor = await db.execute("""
-                UPDATE client_ip_connections
-                SET connection_count = connection_count + 1, last_seen = ?
-                WHERE client_id = ? AND ip_address = ? AND date = ?
-            """, (now, client_id, ip_address, today))
-            
-            if cursor.rowcount == 0:
-                await db.execute("""
-                    INSERT INTO client_ip_connections
-                    (client_id, ip_address, connection_count, first_seen, last_seen, date)
-                    VALUES (?, ?, 1, ?, ?, ?)
-                """, (client_id, ip_address, now, now, today))
-            
-            await db.commit()
+            cursor = await db.execute(f"{CLIENT_SELECT}{where} ORDER BY name", params)
+            rows = await cursor.fetchall()
+            return [self._row_to_client(row) for row in rows]
+
+    async def write_ip_connections(self, connections: List[tuple], last_ips: List[tuple]) -> None:
+        """
+        Групповая запись IP-подключений одной транзакцией.
+
+        connections: (ip_address, count_for_new_row, first_seen, last_seen, date, public_key, sessions)
+        last_ips: (last_ip, public_key, last_ip)
+        """
+        async with self.pool.acquire() as db:
+            await db.execute("BEGIN")
+            try:
+                if connections:
+                    await db.executemany("""
+                        INSERT INTO client_ip_connections
+                        (client_id, ip_address, connection_count, first_seen, last_seen, date)
+                        SELECT id, ?, ?, ?, ?, ? FROM clients WHERE public_key = ?
+                        ON CONFLICT(client_id, ip_address, date) DO UPDATE SET
+                            connection_count = connection_count + ?,
+                            last_seen = MAX(last_seen, excluded.last_seen)
+                    """, connections)
+                if last_ips:
+                    await db.executemany(
+                        "UPDATE clients SET last_ip = ? WHERE public_key = ? AND last_ip IS NOT ?",
+                        last_ips
+                    )
+                await db.commit()
+            except Exception as e:
+                await db.execute("ROLLBACK")
+                self.logger.error(f"Ошибка групповой записи IP-подключений: {e}")
+                raise
 
     async def get_client_daily_ips(self, client_id: int, date: str = None) -> List[Dict]:
         """Получение IP подключений клиента за день (использует индекс idx_ip_conn_client_date)"""
@@ -458,11 +736,156 @@ class Database:
             rows = await cursor.fetchall()
             
             return [{
-                'ip_address': row['ip_address'],
-                'connection_count': row['connection_count'],
-                'first_seen': datetime.fromisoformat(row['first_seen']),
-                'last_seen': datetime.fromisoformat(row['last_seen'])
-            } for row in rows]
+                'ip_address': ip_address,
+                'connection_count': connection_count,
+                'first_seen': from_epoch(first_seen),
+                'last_seen': from_epoch(last_seen)
+            } for ip_address, connection_count, first_seen, last_seen in rows]
+
+    async def get_daily_ips(self, date: str = None) -> List[Tuple[int, str]]:
+        """IP подключений всех клиентов за день: (client_id, ip_address) (использует индекс idx_ip_conn_date)"""
+        if date is None:
+            date = datetime.now().strftime('%Y-%m-%d')
+        
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                "SELECT client_id, ip_address FROM client_ip_connections WHERE date = ?",
+                (date,)
+            )
+            return await cursor.fetchall()
+
+    async def get_telegram_file_id(self, content_hash: str) -> Optional[str]:
+        """file_id ранее загруженного в Telegram файла с таким содержимым"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                "SELECT file_id FROM telegram_files WHERE content_hash = ?",
+                (content_hash,)
+            )
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def set_telegram_file_id(self, content_hash: str, file_id: str, kind: str,
+                                   client_id: Optional[int] = None) -> None:
+        """
+        Запомнить file_id загруженного файла. Для клиента хранится только
+        актуальный файл каждого вида: записи с прежним содержимым удаляются.
+        """
+        async with self.pool.acquire() as db:
+            if client_id is not None:
+                await db.execute(
+                    "DELETE FROM telegram_files WHERE client_id = ? AND kind = ? AND content_hash != ?",
+                    (client_id, kind, content_hash)
+                )
+            await db.execute("""
+                INSERT INTO telegram_files (content_hash, file_id, kind, client_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET file_id = excluded.file_id
+            """, (content_hash, file_id, kind, client_id))
+            await db.commit()
+
+    async def delete_telegram_file_id(self, content_hash: str) -> None:
+        """Забыть file_id (Telegram больше не принимает его)"""
+        async with self.pool.acquire() as db:
+            await db.execute("DELETE FROM telegram_files WHERE content_hash = ?", (content_hash,))
+            await db.commit()
+
+    async def get_fsm_record(self, storage_key: str) -> Optional[Tuple[Optional[str], str, int]]:
+        """Состояние FSM по ключу: (state, data в JSON, updated_at) или None"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                "SELECT state, data, updated_at FROM fsm_storage WHERE storage_key = ?",
+                (storage_key,)
+            )
+            return await cursor.fetchone()
+
+    async def write_fsm_records(self, upserts: List[tuple], deletes: List[str]) -> None:
+        """
+        Групповая запись состояний FSM одной транзакцией.
+
+        upserts: (storage_key, state, data, updated_at); deletes: storage_key
+        """
+        async with self.pool.acquire() as db:
+            await db.execute("BEGIN")
+            try:
+                if upserts:
+                    await db.executemany("""
+                        INSERT INTO fsm_storage (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(storage_key) DO UPDATE SET
+                            state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                    """, upserts)
+                if deletes:
+                    await db.executemany(
+                        "DELETE FROM fsm_storage WHERE storage_key = ?",
+                        [(storage_key,) for storage_key in deletes]
+                    )
+                await db.commit()
+            except Exception:
+                await db.execute("ROLLBACK")
+                raise
+
+    async def delete_fsm_records_before(self, cutoff: int) -> int:
+        """Удаление состояний FSM, не менявшихся с cutoff (epoch)"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (cutoff,))
+            await db.commit()
+            return cursor.rowcount
+
+    async def get_last_messages(self, since: int) -> List[Tuple[int, int, int]]:
+        """Последние сообщения бота пользователям: (user_id, message_id, updated_at) не старше since"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute(
+                "SELECT user_id, message_id, updated_at FROM user_last_message WHERE updated_at >= ?",
+                (since,)
+            )
+            return await cursor.fetchall()
+
+    async def write_last_messages(self, rows: List[Tuple[int, int, int]]) -> None:
+        """Групповая запись последних сообщений: (user_id, message_id, updated_at)"""
+        async with self.pool.acquire() as db:
+            await db.executemany("""
+                INSERT INTO user_last_message (user_id, message_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    message_id = excluded.message_id, updated_at = excluded.updated_at
+            """, rows)
+            await db.commit()
+
+    async def delete_last_messages_before(self, cutoff: int) -> int:
+        """Удаление записей о последних сообщениях старше cutoff (epoch)"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute("DELETE FROM user_last_message WHERE updated_at < ?", (cutoff,))
+            await db.commit()
+            return cursor.rowcount
+
+    async def get_geo_records(self, ips: Sequence[str], now: int) -> List[Tuple[str, Optional[str], int]]:
+        """Действующие записи кэша геолокации: (ip, data в JSON или None, expires_at)"""
+        ips = list(ips)
+        rows: List[Tuple[str, Optional[str], int]] = []
+        async with self.pool.acquire() as db:
+            for start in range(0, len(ips), 500):
+                chunk = ips[start:start + 500]
+                cursor = await db.execute(
+                    f"SELECT ip, data, expires_at FROM geo_cache "
+                    f"WHERE ip IN ({', '.join('?' * len(chunk))}) AND expires_at > ?",
+                    (*chunk, now)
+                )
+                rows.extend(await cursor.fetchall())
+        return rows
+
+    async def write_geo_records(self, rows: List[Tuple[str, Optional[str], int]]) -> None:
+        """Групповая запись кэша геолокации: (ip, data в JSON или None, expires_at)"""
+        async with self.pool.acquire() as db:
+            await db.executemany("""
+                INSERT INTO geo_cache (ip, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(ip) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            """, rows)
+            await db.commit()
+
+    async def delete_geo_records_before(self, cutoff: int) -> int:
+        """Удаление записей кэша геолокации, истекших к cutoff (epoch)"""
+        async with self.pool.acquire() as db:
+            cursor = await db.execute("DELETE FROM geo_cache WHERE expires_at <= ?", (cutoff,))
+            await db.commit()
+            return cursor.rowcount
 
     async def cleanup_old_ip_connections(self, days_to_keep: int = 7) -> None:
         """Очистка старых записей IP подключений (использует индекс idx_ip_conn_date)"""
@@ -480,48 +903,39 @@ class Database:
             await db.commit()
             self.logger.info("База данных оптимизирована")
 
-    def _row_to_client(self, row: aiosqlite.Row) -> Client:
-        """Преобразование строки БД в объект Client"""
-        expires_at = None
-        if row["expires_at"]:
-            expires_at = datetime.fromisoformat(row["expires_at"])
-
-        created_at = None
-        if row["created_at"]:
-            created_at = datetime.fromisoformat(row["created_at"])
-
-        last_ip = ""
-        daily_ips = ""
-        ipv6_address = ""
-        has_ipv6 = False
-
-        try:
-            last_ip = row["last_ip"] or ""
-            daily_ips = row["daily_ips"] or ""
-            ipv6_address = row["ipv6_address"] or ""
-            has_ipv6 = bool(row["has_ipv6"])
-        except (IndexError, KeyError):
-            pass
-
-        return Client(
-            id=row["id"],
-            name=row["name"],
-            public_key=row["public_key"],
-            private_key=row["private_key"],
-            preshared_key=row["preshared_key"],
-            ip_address=row["ip_address"],
-            ipv6_address=ipv6_address,
-            has_ipv6=has_ipv6,
-            endpoint=row["endpoint"],
-            created_at=created_at,
-            expires_at=expires_at,
-            traffic_limit=row["traffic_limit"],
-            traffic_used=row["traffic_used"],
-            is_active=bool(row["is_active"]),
-            is_blocked=bool(row["is_blocked"]),
-            last_ip=last_ip,
-            daily_ips=daily_ips
+    def _row_to_client(self, row: tuple) -> Client:
+        """
+        Позиционный декодер строки clients (порядок колонок - CLIENT_COLUMNS).
+
+        Объект собирается напрямую, минуя __init__/__setattr__ dataclass:
+        это горячий путь для полных проходов по таблице.
+        """
+        (id_, name, public_key, private_key, preshared_key, ip_address,
+         ipv6_address, has_ipv6, endpoint, created_at, expires_at, traffic_limit,
+         traffic_used, is_active, is_blocked, last_ip, daily_ips) = row
+
+        client = _new_client(Client)
+        client.__dict__.update(
+            id=id_,
+            name=name,
+            public_key=public_key,
+            private_key=private_key,
+            preshared_key=preshared_key,
+            ip_address=ip_address,
+            ipv6_address=ipv6_address or "",
+            has_ipv6=bool(has_ipv6),
+            endpoint=endpoint,
+            created_at=_fromtimestamp(created_at) if created_at is not None else None,
+            expires_at=_fromtimestamp(expires_at) if expires_at is not None else None,
+            traffic_limit=traffic_limit,
+            traffic_used=traffic_used,
+            is_active=bool(is_active),
+            is_blocked=bool(is_blocked),
+            last_ip=last_ip or "",
+            daily_ips=daily_ips or "",
+            _dirty=set()
         )
+        return client
 
     async def close(self):
         """Закрытие пула соединений"""
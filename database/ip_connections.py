@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from .database import Database, get_db, to_epoch
+
+# WireGuard перестает считать сессию живой через 180 секунд без handshake (REJECT_AFTER_TIME)
+SESSION_TIMEOUT = 180
+
+
+@dataclass
+class PendingConnection:
+    """Накопленные в памяти наблюдения за IP клиента за день"""
+    sessions: int
+    first_seen: datetime
+    last_seen: datetime
+    # Первое наблюдение продолжает уже идущую сессию (учитывается только в новой записи)
+    continued: bool = False
+
+
+@dataclass
+class PeerSession:
+    """Последнее наблюдаемое состояние peer для определения начала сессии"""
+    endpoint_ip: str
+    is_fresh: bool
+
+
+class IPConnectionWriter:
+    """
+    Буферизированная запись IP-подключений клиентов.
+
+    Наблюдения из awg show агрегируются в памяти и сбрасываются в БД одной
+    транзакцией (UPSERT) по таймеру или при достижении порога размера буфера.
+    connection_count считает начала сессий (смена endpoint или появление
+    свежего handshake после простоя), а не количество опросов.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 30.0, max_pending: int = 500):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.logger = logging.getLogger(__name__)
+
+        self._pending: Dict[Tuple[str, str, str], PendingConnection] = {}
+        self._pending_last_ip: Dict[str, str] = {}
+        self._sessions: Dict[str, PeerSession] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, flush_interval: Optional[float] = None, max_pending: Optional[int] = None):
+        """Запуск фоновой задачи периодического сброса буфера"""
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+            self.logger.info(f"Запись IP-подключений: сброс каждые {self.flush_interval}s")
+
+    async def close(self):
+        """Остановка фоновой задачи с финальным сбросом буфера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def observe(self, public_key: str, endpoint_ip: str, handshake_age: Optional[int]) -> None:
+        """Зафиксировать наблюдение peer из статистики интерфейса"""
+        if not endpoint_ip:
+            return
+
+        is_fresh = handshake_age is not None and handshake_age <= SESSION_TIMEOUT
+        previous = self._sessions.get(public_key)
+        self._sessions[public_key] = PeerSession(endpoint_ip, is_fresh)
+
+        if previous is None or previous.endpoint_ip != endpoint_ip:
+            self._pending_last_ip[public_key] = endpoint_ip
+
+        if not is_fresh:
+            # awg show помнит последний endpoint и после отключения - это не активность
+            return
+
+        # Первое наблюдение после запуска не считаем новой сессией: она могла начаться раньше
+        new_session = previous is not None and (
+            previous.endpoint_ip != endpoint_ip or not previous.is_fresh
+        )
+
+        now = datetime.now()
+        key = (public_key, endpoint_ip, now.strftime('%Y-%m-%d'))
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = PendingConnection(int(new_session), now, now, continued=not new_session)
+        else:
+            pending.sessions += int(new_session)
+            pending.last_seen = now
+
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Сбросить накопленные наблюдения в БД одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending and not self._pending_last_ip:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            pending_last_ip, self._pending_last_ip = self._pending_last_ip, {}
+
+            try:
+                await self.db.write_ip_connections(
+                    [
+                        (
+                            ip, item.sessions + int(item.continued), to_epoch(item.first_seen),
+                            to_epoch(item.last_seen), date, public_key, item.sessions
+                        )
+                        for (public_key, ip, date), item in pending.items()
+                    ],
+                    [(ip, public_key, ip) for public_key, ip in pending_last_ip.items()]
+                )
+            except Exception as e:
+                self.logger.error(f"Ошибка при записи IP-подключений: {e}")
+                self._restore(pending, pending_last_ip)
+                return 0
+
+            self.logger.debug(f"Записано IP-подключений: {len(pending)}, обновлено last_ip: {len(pending_last_ip)}")
+            return len(pending)
+
+    def _restore(self, pending: Dict[Tuple[str, str, str], PendingConnection], pending_last_ip: Dict[str, str]):
+        """Вернуть несохраненные наблюдения в буфер для следующей попытки"""
+        for key, item in pending.items():
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = item
+            else:
+                current.sessions += item.sessions
+                current.first_seen = min(current.first_seen, item.first_seen)
+                current.continued = current.continued or item.continued
+        for public_key, ip in pending_last_ip.items():
+            self._pending_last_ip.setdefault(public_key, ip)
+
+    async def _flush_loop(self):
+        """Периодический сброс буфера"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+# Глобальный экземпляр, общий для всех AWGManager
+ip_connection_writer = IPConnectionWriter(get_db())
+
+
+def get_ip_connection_writer() -> IPConnectionWriter:
+    """Получение экземпляра буферизированной записи IP-подключений"""
+    return ip_connection_writer
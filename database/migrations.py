@@ -0,0 +1,433 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Размер пакета при переписывании данных больших таблиц
+MIGRATION_BATCH_SIZE = 5000
+
+# Колбэк прогресса: (версия, этап, обработано, всего)
+ProgressCallback = Callable[[int, str, int, int], None]
+
+
+class MigrationError(Exception):
+    """Ошибка применения миграции (шаг откатан, версия схемы не изменилась)"""
+
+
+@dataclass
+class MigrationContext:
+    """Состояние выполняемого шага миграции, передается в функцию шага"""
+    db: aiosqlite.Connection
+    version: int
+    batch_size: int = MIGRATION_BATCH_SIZE
+    on_progress: Optional[ProgressCallback] = None
+    rows_rewritten: int = field(default=0, init=False)
+
+    def report(self, stage: str, done: int, total: int) -> None:
+        """Сообщить о прогрессе этапа шага"""
+        percent = done * 100 // total if total else 100
+        logger.info(f"Миграция {self.version}: {stage} {done}/{total} ({percent}%)")
+        if self.on_progress:
+            self.on_progress(self.version, stage, done, total)
+
+    async def copy_rows(self, source: str, target: str, columns: Sequence[str],
+                        select_exprs: Optional[Sequence[str]] = None) -> int:
+        """
+        Пакетное копирование source -> target диапазонами id.
+
+        select_exprs - выражения над строкой source для каждой колонки target
+        (по умолчанию колонки копируются как есть). Все пакеты выполняются
+        в транзакции шага, разбиение ограничивает объем одного запроса и дает
+        прогресс для больших таблиц.
+        """
+        select_exprs = select_exprs or columns
+        cursor = await self.db.execute(f"SELECT MIN(id), MAX(id), COUNT(*) FROM {source}")
+        low, high, total = await cursor.fetchone()
+        if not total:
+            self.report(f"{source} -> {target}", 0, 0)
+            return 0
+
+        sql = (
+            f"INSERT INTO {target} ({', '.join(columns)}) "
+            f"SELECT {', '.join(select_exprs)} FROM {source} WHERE id >= ? AND id < ?"
+        )
+        copied = 0
+        for start in range(low, high + 1, self.batch_size):
+            cursor = await self.db.execute(sql, (start, start + self.batch_size))
+            copied += cursor.rowcount
+            self.report(f"{source} -> {target}", copied, total)
+
+        self.rows_rewritten += copied
+        return copied
+
+
+@dataclass
+class Migration:
+    """Шаг миграции схемы clients.db"""
+    version: int
+    description: str
+    apply: Callable[[MigrationContext], Awaitable[None]]
+
+
+async def _table_columns(db: aiosqlite.Connection, table: str) -> List[str]:
+    """Список колонок таблицы"""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in await cursor.fetchall()]
+
+
+async def _table_names(db: aiosqlite.Connection) -> List[str]:
+    """Список таблиц БД"""
+    cursor = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return [row[0] for row in await cursor.fetchall()]
+
+
+async def _migration_baseline(ctx: MigrationContext) -> None:
+    """Исходная схема (TEXT-даты) + колонки, которых нет в старых БД"""
+    db = ctx.db
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            public_key TEXT NOT NULL,
+            private_key TEXT NOT NULL,
+            preshared_key TEXT DEFAULT '',
+            ip_address TEXT NOT NULL UNIQUE,
+            ipv6_address TEXT DEFAULT '',
+            has_ipv6 BOOLEAN DEFAULT 0,
+            endpoint TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            traffic_limit INTEGER,
+            traffic_used INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            is_blocked BOOLEAN DEFAULT 0,
+            last_ip TEXT DEFAULT '',
+            daily_ips TEXT DEFAULT ''
+        )
+    """)
+
+    columns = await _table_columns(db, "clients")
+    for column, definition in (
+        ("preshared_key", "TEXT DEFAULT ''"),
+        ("ipv6_address", "TEXT DEFAULT ''"),
+        ("has_ipv6", "BOOLEAN DEFAULT 0"),
+        ("last_ip", "TEXT DEFAULT ''"),
+        ("daily_ips", "TEXT DEFAULT ''"),
+    ):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE clients ADD COLUMN {column} {definition}")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS client_ip_connections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            ip_address TEXT NOT NULL,
+            connection_count INTEGER DEFAULT 1,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            date TEXT NOT NULL,
+            UNIQUE(client_id, ip_address, date),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    """)
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS bot_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            setting_key TEXT NOT NULL UNIQUE,
+            setting_value TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_settings_key ON bot_settings(setting_key)")
+
+
+async def _migration_epoch_timestamps(ctx: MigrationContext) -> None:
+    """
+    Перевод дат clients и client_ip_connections в INTEGER (unix epoch).
+
+    expires_at, first_seen и last_seen записывались из Python (локальное время),
+    created_at - через DEFAULT CURRENT_TIMESTAMP (UTC).
+    """
+    db = ctx.db
+    await db.execute("""
+        CREATE TABLE clients_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            public_key TEXT NOT NULL,
+            private_key TEXT NOT NULL,
+            preshared_key TEXT DEFAULT '',
+            ip_address TEXT NOT NULL UNIQUE,
+            ipv6_address TEXT DEFAULT '',
+            has_ipv6 BOOLEAN DEFAULT 0,
+            endpoint TEXT,
+            created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            expires_at INTEGER,
+            traffic_limit INTEGER,
+            traffic_used INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            is_blocked BOOLEAN DEFAULT 0,
+            last_ip TEXT DEFAULT '',
+            daily_ips TEXT DEFAULT ''
+        )
+    """)
+    columns = [
+        "id", "name", "public_key", "private_key", "preshared_key", "ip_address",
+        "ipv6_address", "has_ipv6", "endpoint", "created_at", "expires_at",
+        "traffic_limit", "traffic_used", "is_active", "is_blocked", "last_ip", "daily_ips"
+    ]
+    exprs = list(columns)
+    exprs[columns.index("created_at")] = "CAST(strftime('%s', created_at) AS INTEGER)"
+    exprs[columns.index("expires_at")] = "CAST(strftime('%s', expires_at, 'utc') AS INTEGER)"
+    await ctx.copy_rows("clients", "clients_new", columns, exprs)
+    await db.execute("DROP TABLE clients")
+    await db.execute("ALTER TABLE clients_new RENAME TO clients")
+
+    await db.execute("CREATE INDEX idx_clients_name ON clients(name)")
+    await db.execute("CREATE INDEX idx_clients_public_key ON clients(public_key)")
+    await db.execute("CREATE INDEX idx_clients_is_active ON clients(is_active)")
+    await db.execute("CREATE INDEX idx_clients_is_blocked ON clients(is_blocked)")
+    await db.execute("CREATE INDEX idx_clients_expires_at ON clients(expires_at)")
+
+    await db.execute("""
+        CREATE TABLE client_ip_connections_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            ip_address TEXT NOT NULL,
+            connection_count INTEGER DEFAULT 1,
+            first_seen INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            last_seen INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            date TEXT NOT NULL,
+            UNIQUE(client_id, ip_address, date),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    """)
+    await ctx.copy_rows(
+        "client_ip_connections", "client_ip_connections_new",
+        ["id", "client_id", "ip_address", "connection_count", "first_seen", "last_seen", "date"],
+        [
+            "id", "client_id", "ip_address", "connection_count",
+            "CAST(strftime('%s', first_seen, 'utc') AS INTEGER)",
+            "CAST(strftime('%s', last_seen, 'utc') AS INTEGER)",
+            "date"
+        ]
+    )
+    await db.execute("DROP TABLE client_ip_connections")
+    await db.execute("ALTER TABLE client_ip_connections_new RENAME TO client_ip_connections")
+
+    await db.execute("CREATE INDEX idx_ip_conn_client_date ON client_ip_connections(client_id, date)")
+    await db.execute("CREATE INDEX idx_ip_conn_date ON client_ip_connections(date)")
+
+
+async def supports_trigram(db: aiosqlite.Connection) -> bool:
+    """Есть ли в системной SQLite FTS5 с токенизатором trigram (нужна SQLite 3.34+)"""
+    try:
+        await db.execute("CREATE VIRTUAL TABLE temp.trigram_probe USING fts5(x, tokenize='trigram')")
+    except aiosqlite.OperationalError:
+        return False
+    await db.execute("DROP TABLE temp.trigram_probe")
+    return True
+
+
+async def _migration_client_search(ctx: MigrationContext) -> None:
+    """
+    Индексы поиска клиентов: FTS5 trigram по имени (подстрока, без учета регистра),
+    NOCASE-индекс имени (точное совпадение и LIKE 'префикс%') и индекс по
+    ipv6_address для поиска по префиксу адреса.
+
+    Без trigram (SQLite старше 3.34 или без FTS5) индекс подстрок не создается:
+    поиск по подстроке идет через LIKE.
+    """
+    db = ctx.db
+    await db.execute("CREATE INDEX idx_clients_name_nocase ON clients(name COLLATE NOCASE)")
+    await db.execute("CREATE INDEX idx_clients_ipv6_address ON clients(ipv6_address)")
+
+    if not await supports_trigram(db):
+        logger.warning(
+            f"SQLite {aiosqlite.sqlite_version} не поддерживает FTS5 trigram (нужна 3.34+): "
+            f"поиск клиентов по подстроке имени будет работать без индекса"
+        )
+        return
+
+    await db.execute("""
+        CREATE VIRTUAL TABLE clients_fts USING fts5(
+            name, content='clients', content_rowid='id', tokenize='trigram'
+        )
+    """)
+
+    # Внешний контент: индекс синхронизируется триггерами на clients
+    await db.execute("""
+        CREATE TRIGGER clients_fts_insert AFTER INSERT ON clients BEGIN
+            INSERT INTO clients_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER clients_fts_delete AFTER DELETE ON clients BEGIN
+            INSERT INTO clients_fts (clients_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER clients_fts_update AFTER UPDATE OF name ON clients BEGIN
+            INSERT INTO clients_fts (clients_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO clients_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    """)
+
+    cursor = await db.execute("SELECT COUNT(*) FROM clients")
+    total = (await cursor.fetchone())[0]
+    await db.execute("INSERT INTO clients_fts (clients_fts) VALUES ('rebuild')")
+    ctx.report("clients_fts rebuild", total, total)
+
+
+async def _migration_telegram_files(ctx: MigrationContext) -> None:
+    """Соответствие хеша содержимого артефакта и file_id, полученного от Telegram"""
+    await ctx.db.execute("""
+        CREATE TABLE telegram_files (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            client_id INTEGER,
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            FOREIGN KEY (client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    """)
+    await ctx.db.execute("CREATE INDEX idx_telegram_files_client ON telegram_files(client_id, kind)")
+
+
+async def _migration_sessions(ctx: MigrationContext) -> None:
+    """Состояния FSM диалогов и последние сообщения бота администраторам (переживают перезапуск)"""
+    await ctx.db.execute("""
+        CREATE TABLE fsm_storage (
+            storage_key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    await ctx.db.execute("CREATE INDEX idx_fsm_storage_updated ON fsm_storage(updated_at)")
+    await ctx.db.execute("""
+        CREATE TABLE user_last_message (
+            user_id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+
+
+async def _migration_geo_cache(ctx: MigrationContext) -> None:
+    """Кэш геолокации IP-адресов (data NULL - неудачный ответ, кэшируется на меньший срок)"""
+    await ctx.db.execute("""
+        CREATE TABLE geo_cache (
+            ip TEXT PRIMARY KEY,
+            data TEXT,
+            expires_at INTEGER NOT NULL
+        )
+    """)
+    await ctx.db.execute("CREATE INDEX idx_geo_cache_expires ON geo_cache(expires_at)")
+
+
+# Упорядоченный список миграций. Новые шаги добавляются только в конец.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Исходная схема", _migration_baseline),
+    Migration(2, "Даты в формате unix epoch", _migration_epoch_timestamps),
+    Migration(3, "Индексы поиска клиентов", _migration_client_search),
+    Migration(4, "file_id загруженных в Telegram файлов", _migration_telegram_files),
+    Migration(5, "Состояния FSM и последние сообщения", _migration_sessions),
+    Migration(6, "Кэш геолокации IP", _migration_geo_cache),
+]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Текущая версия схемы (0 - миграции не применялись)"""
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+    row = await cursor.fetchone()
+    return row[0] or 0
+
+
+async def _ensure_version_table(db: aiosqlite.Connection) -> None:
+    """Создание таблицы версий схемы"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            duration_ms INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    if "duration_ms" not in await _table_columns(db, "schema_version"):
+        await db.execute("ALTER TABLE schema_version ADD COLUMN duration_ms INTEGER NOT NULL DEFAULT 0")
+    await db.commit()
+
+
+async def _apply_migration(db: aiosqlite.Connection, migration: Migration, batch_size: int,
+                           on_progress: Optional[ProgressCallback]) -> None:
+    """Применение одного шага в отдельной транзакции вместе с записью версии"""
+    ctx = MigrationContext(db, migration.version, batch_size, on_progress)
+    logger.info(f"Применение миграции {migration.version}: {migration.description}")
+    started = time.perf_counter()
+
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await migration.apply(ctx)
+
+        cursor = await db.execute("PRAGMA foreign_key_check")
+        violations = await cursor.fetchall()
+        if violations:
+            raise MigrationError(f"нарушения внешних ключей: {len(violations)}")
+
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        await db.execute(
+            "INSERT INTO schema_version (version, description, duration_ms) VALUES (?, ?, ?)",
+            (migration.version, migration.description, duration_ms)
+        )
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Миграция {migration.version} откатана: {e}")
+        if isinstance(e, MigrationError):
+            raise
+        raise MigrationError(f"Миграция {migration.version} ({migration.description}): {e}") from e
+
+    logger.info(
+        f"Миграция {migration.version} применена за {duration_ms} мс, "
+        f"переписано строк: {ctx.rows_rewritten}"
+    )
+
+
+async def run_migrations(db: aiosqlite.Connection, batch_size: int = MIGRATION_BATCH_SIZE,
+                         on_progress: Optional[ProgressCallback] = None) -> int:
+    """
+    Применение недостающих миграций. Возвращает итоговую версию схемы.
+
+    Каждый шаг выполняется в своей транзакции: при ошибке шаг откатывается,
+    уже примененные шаги остаются, и следующий запуск продолжит с него.
+    """
+    await _ensure_version_table(db)
+    current = await get_schema_version(db)
+    pending = [m for m in MIGRATIONS if m.version > current]
+    if not pending:
+        return current
+
+    logger.info(f"Версия схемы {current}, к применению миграций: {len(pending)}")
+    started = time.perf_counter()
+
+    # Пересборка таблиц требует отключенных внешних ключей (иначе DROP TABLE запустит CASCADE).
+    # PRAGMA foreign_keys не действует внутри транзакции, поэтому переключается снаружи шагов.
+    await db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for migration in pending:
+            await _apply_migration(db, migration, batch_size, on_progress)
+            current = migration.version
+    finally:
+        await db.execute("PRAGMA foreign_keys = ON")
+
+    logger.info(f"Схема обновлена до версии {current} за {time.perf_counter() - started:.2f}s")
+    return current
+
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Set, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from .database import Database, get_db
+
+# Маркер datetime в JSON данных FSM (например, expires_at при создании клиента)
+DATETIME_MARKER = "__datetime__"
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {DATETIME_MARKER: value.isoformat()}
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в состоянии FSM")
+
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and DATETIME_MARKER in obj:
+        return datetime.fromisoformat(obj[DATETIME_MARKER])
+    return obj
+
+
+def dump_fsm_data(data: Mapping[str, Any]) -> str:
+    """Данные FSM в JSON (datetime сохраняется с маркером типа)"""
+    return json.dumps(data, ensure_ascii=False, default=_encode_value)
+
+
+def load_fsm_data(raw: str) -> Dict[str, Any]:
+    """Данные FSM из JSON"""
+    return json.loads(raw, object_hook=_decode_object)
+
+
+class CoalescingWriter(ABC):
+    """
+    Основа для хранилищ с отложенной записью: изменения копятся в памяти и
+    сбрасываются в БД пакетом раз в flush_interval; тем же таймером раз в
+    evict_interval удаляются устаревшие записи.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 2.0, evict_interval: float = 600.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.evict_interval = evict_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_evict = 0.0
+
+    def start(self, flush_interval: Optional[float] = None):
+        """Запуск фоновой задачи сброса изменений"""
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if self._task is None or self._task.done():
+            self._last_evict = time.monotonic()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Остановка фоновой задачи с финальным сбросом изменений"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    @abstractmethod
+    async def flush(self) -> int:
+        """Запись накопленных изменений в БД; возвращает число записанных"""
+
+    @abstractmethod
+    async def evict(self) -> int:
+        """Удаление устаревших записей; возвращает число удаленных"""
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_evict >= self.evict_interval:
+                    self._last_evict = time.monotonic()
+                    await self.evict()
+            except Exception as e:
+                self.logger.error(f"Ошибка фоновой записи {type(self).__name__}: {e}")
+
+
+@dataclass
+class FSMSession:
+    """Состояние и данные диалога в кэше"""
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(CoalescingWriter, BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_storage.
+
+    Чтения обслуживаются из кэша в памяти: запись загружается из БД при
+    первом обращении к ключу (отсутствие записи тоже кэшируется).
+    Изменения помечают ключ, и все помеченные ключи пишутся одной
+    транзакцией по таймеру - несколько set_state/update_data одного
+    обработчика дают одну запись. Очищенное состояние удаляет строку.
+
+    Диалог, не менявшийся дольше ttl, считается брошенным: он читается как
+    пустой, вытесняется из кэша и удаляется из БД.
+    """
+
+    def __init__(self, db: Database, ttl: float = 24 * 3600, flush_interval: float = 2.0,
+                 evict_interval: float = 600.0):
+        super().__init__(db, flush_interval, evict_interval)
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True,
+                                             with_destiny=True)
+        self._sessions: Dict[str, FSMSession] = {}
+        self._dirty: Set[str] = set()
+
+    async def _session(self, key: StorageKey) -> Tuple[str, FSMSession]:
+        storage_key = self.key_builder.build(key)
+        session = self._sessions.get(storage_key)
+        if session is None:
+            row = await self.db.get_fsm_record(storage_key)
+            # Пока шел запрос, ключ мог быть загружен или изменен другим обработчиком
+            session = self._sessions.get(storage_key)
+            if session is None:
+                if row is None:
+                    session = FSMSession(updated_at=time.time())
+                else:
+                    state, data, updated_at = row
+                    session = FSMSession(state, load_fsm_data(data), updated_at)
+                self._sessions[storage_key] = session
+
+        if not session.empty and time.time() - session.updated_at > self.ttl:
+            # Брошенный диалог: строка будет удалена при сбросе
+            session.state, session.data = None, {}
+            self._touch(storage_key, session)
+        return storage_key, session
+
+    def _touch(self, storage_key: str, session: FSMSession) -> None:
+        session.updated_at = time.time()
+        self._dirty.add(storage_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, session = await self._session(key)
+        session.state = state.state if isinstance(state, State) else state
+        self._touch(storage_key, session)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, session = await self._session(key)
+        return session.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        storage_key, session = await self._session(key)
+        session.data = data.copy()
+        self._touch(storage_key, session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, session = await self._session(key)
+        return session.data.copy()
+
+    async def flush(self) -> int:
+        """Запись измененных состояний одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+
+            upserts, deletes = [], []
+            for storage_key in dirty:
+                session = self._sessions.get(storage_key)
+                if session is None or session.empty:
+                    deletes.append(storage_key)
+                    continue
+                try:
+                    data = dump_fsm_data(session.data)
+                except (TypeError, ValueError) as e:
+                    self.logger.error(f"Состояние {storage_key} не сохранено: {e}")
+                    continue
+                upserts.append((storage_key, session.state, data, int(session.updated_at)))
+
+            try:
+                await self.db.write_fsm_records(upserts, deletes)
+            except Exception as e:
+                self.logger.error(f"Ошибка при записи состояний FSM: {e}")
+                self._dirty |= dirty
+                return 0
+            return len(upserts) + len(deletes)
+
+    async def evict(self) -> int:
+        """Удаление брошенных диалогов из кэша и БД"""
+        cutoff = time.time() - self.ttl
+        stale = [
+            storage_key for storage_key, session in self._sessions.items()
+            if session.updated_at < cutoff and storage_key not in self._dirty
+        ]
+        for storage_key in stale:
+            del self._sessions[storage_key]
+        deleted = await self.db.delete_fsm_records_before(int(cutoff))
+        if deleted:
+            self.logger.info(f"Удалено брошенных диалогов: {deleted}")
+        return deleted
+
+
+class LastMessageTracker(CoalescingWriter):
+    """
+    Последнее сообщение бота каждому пользователю (его редактируют при вводе
+    в диалогах и удаляют перед отправкой фото).
+
+    Работает как словарь user_id -> message_id: чтение и запись идут в
+    памяти, новые значения пишутся в таблицу user_last_message пакетом по
+    таймеру (повторные записи одного пользователя схлопываются). Записи
+    старше ttl не возвращаются и удаляются: Telegram не дает боту удалять
+    сообщения старше 48 часов, а старые пользователи не копятся в памяти.
+    """
+
+    def __init__(self, db: Database, ttl: float = 48 * 3600, flush_interval: float = 2.0,
+                 evict_interval: float = 600.0):
+        super().__init__(db, flush_interval, evict_interval)
+        self.ttl = ttl
+        self._messages: Dict[int, Tuple[int, float]] = {}
+        self._dirty: Set[int] = set()
+
+    async def load(self, ttl: Optional[float] = None) -> int:
+        """Загрузка актуальных записей из БД при запуске"""
+        if ttl is not None:
+            self.ttl = ttl
+        rows = await self.db.get_last_messages(int(time.time() - self.ttl))
+        for user_id, message_id, updated_at in rows:
+            self._messages.setdefault(user_id, (message_id, updated_at))
+        return len(rows)
+
+    def get(self, user_id: int, default: Optional[int] = None) -> Optional[int]:
+        entry = self._messages.get(user_id)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return default
+        return entry[0]
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id: int) -> int:
+        message_id = self.get(user_id)
+        if message_id is None:
+            raise KeyError(user_id)
+        return message_id
+
+    def __setitem__(self, user_id: int, message_id: int) -> None:
+        self._messages[user_id] = (message_id, time.time())
+        self._dirty.add(user_id)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    async def flush(self) -> int:
+        """Запись новых значений одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for user_id in dirty:
+                message_id, updated_at = self._messages[user_id]
+                rows.append((user_id, message_id, int(updated_at)))
+            try:
+                await self.db.write_last_messages(rows)
+            except Exception as e:
+                self.logger.error(f"Ошибка при записи последних сообщений: {e}")
+                self._dirty |= dirty
+                return 0
+            return len(rows)
+
+    async def evict(self) -> int:
+        """Удаление устаревших записей из памяти и БД"""
+        cutoff = time.time() - self.ttl
+        for user_id in [user_id for user_id, (_, updated_at) in self._messages.items()
+                        if updated_at < cutoff and user_id not in self._dirty]:
+            del self._messages[user_id]
+        return await self.db.delete_last_messages_before(int(cutoff))
+
+
+# Глобальный экземпляр для обработчиков (user_last_message)
+last_message_tracker = LastMessageTracker(get_db())
+
+
+def get_last_message_tracker() -> LastMessageTracker:
+    """Получение экземпляра учета последних сообщений"""
+    return last_message_tracker
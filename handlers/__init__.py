@@ -3,5 +3,7 @@
 """
 
 from .admin_handlers import admin_router
+from .bulk_handlers import bulk_router
+from .callback_dispatch import callback_router
 
-__all__ = ["admin_router"]
+__all__ = ["admin_router", "bulk_router", "callback_router"]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import ipaddress
 from datetime import datetime, timedelta
@@ -5,7 +6,7 @@ from typing import Optional
 import json
 import re
 
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
@@ -14,13 +15,22 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import Config
 from database.database import get_db, Client
+from database.session_storage import get_last_message_tracker
 from services.awg_manager import AWGManager
-from services.ip_service import IPService
+from services.ip_service import get_ip_service
 from services.backup_service import BackupService
 from services.settings_service import SettingsService
 from keyboards.main_keyboards import *
-from utils.qr_generator import generate_qr_code
-from utils.vpn_converter import conf_to_vpn_url
+from utils.vpn_converter import get_endpoint_resolver
+from utils.workers import get_worker_pools_stats
+from middlewares.outbound import get_outbound_scheduler
+from middlewares.render import get_render_fingerprints, last_render
+from utils.artifact_cache import artifact_key, get_artifact_cache, get_client_qr_png, get_client_vpn_url, qr_artifact_key
+from utils.telegram_files import get_telegram_file_cache
+from utils.geo_cache import get_geo_cache
+from utils.callback_data import get_callback_registry, pack_callback
+from utils.instrumentation import get_instrumentation
+from utils.view_loader import fill_progressively, load_view
 from utils.formatters import format_client_info, format_client_config, format_traffic_size
 
 admin_router = Router()
@@ -28,14 +38,16 @@ admin_router = Router()
 # Инициализация сервисов
 config = Config()
 awg_manager = AWGManager(config)
-ip_service = IPService(config)
+ip_service = get_ip_service(config)
 backup_service = BackupService(config)
 db = get_db()
 settings_service = SettingsService()
+telegram_file_cache = get_telegram_file_cache()
+callbacks = get_callback_registry()
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для хранения ID последнего сообщения каждого пользователя
-user_last_message = {}
+# ID последнего сообщения бота каждому пользователю (сохраняется в БД, с TTL)
+user_last_message = get_last_message_tracker()
 
 class ClientStates(StatesGroup):
     """Состояния для создания клиента"""
@@ -59,7 +71,7 @@ class SettingsStates(StatesGroup):
     waiting_dns = State()
     waiting_endpoint = State()
 
-@admin_router.callback_query(F.data == "settings_menu")
+@callbacks.route("settings_menu")
 async def show_settings_menu(callback: CallbackQuery):
     """Показать меню параметров"""
     await edit_or_send_message(
@@ -70,7 +82,7 @@ async def show_settings_menu(callback: CallbackQuery):
     )
     await callback.answer()
 
-@admin_router.callback_query(F.data == "settings_show")
+@callbacks.route("settings_show")
 async def show_settings_info(callback: CallbackQuery):
     """Показать текущие настройки"""
     dns = await settings_service.get_default_dns()
@@ -87,7 +99,7 @@ async def show_settings_info(callback: CallbackQuery):
     )
     await callback.answer()
 
-@admin_router.callback_query(F.data == "settings_dns")
+@callbacks.route("settings_dns")
 async def start_dns_setup(callback: CallbackQuery, state: FSMContext):
     """Начать настройку DNS"""
     current_dns = await settings_service.get_default_dns()
@@ -149,7 +161,7 @@ async def process_dns_setup(message: Message, state: FSMContext):
             except:
                 pass
 
-@admin_router.callback_query(F.data == "settings_endpoint")
+@callbacks.route("settings_endpoint")
 async def show_endpoint_settings(callback: CallbackQuery):
     """Показать настройки endpoint"""
     current_endpoint = await settings_service.get_default_endpoint()
@@ -165,7 +177,7 @@ async def show_endpoint_settings(callback: CallbackQuery):
     )
     await callback.answer()
 
-@admin_router.callback_query(F.data == "set_default_endpoint")
+@callbacks.route("set_default_endpoint")
 async def start_endpoint_setup(callback: CallbackQuery, state: FSMContext):
     """Начать настройку endpoint по умолчанию"""
     current_endpoint = await settings_service.get_default_endpoint()
@@ -233,7 +245,7 @@ async def process_endpoint_setup(message: Message, state: FSMContext):
             except:
                 pass
 
-@admin_router.callback_query(F.data == "clear_default_endpoint")
+@callbacks.route("clear_default_endpoint")
 async def clear_endpoint_confirm(callback: CallbackQuery):
     """Подтверждение очистки endpoint по умолчанию"""
     current_endpoint = await settings_service.get_default_endpoint()
@@ -266,7 +278,7 @@ async def clear_endpoint_confirm(callback: CallbackQuery):
         )
     await callback.answer()
 
-@admin_router.callback_query(F.data == "confirm_clear_endpoint")
+@callbacks.route("confirm_clear_endpoint")
 async def confirm_clear_endpoint(callback: CallbackQuery):
     """Подтвердить очистку endpoint"""
     success = await settings_service.set_default_endpoint("")
@@ -400,7 +412,7 @@ async def cmd_start(message: Message):
     )
 
 # Главное меню
-@admin_router.callback_query(F.data == "main_menu")
+@callbacks.route("main_menu")
 async def show_main_menu(callback: CallbackQuery):
     """Показать главное меню"""
     await edit_or_send_message(
@@ -412,25 +424,23 @@ async def show_main_menu(callback: CallbackQuery):
     await callback.answer()
 
 # Меню клиентов
-@admin_router.callback_query(F.data == "clients_menu")
+@callbacks.route("clients_menu")
 async def show_clients_menu(callback: CallbackQuery):
     """Показать меню управления клиентами"""
-    clients = await db.get_all_clients()
-    active_count = len([c for c in clients if c.is_active and not c.is_blocked])
-    blocked_count = len([c for c in clients if c.is_blocked])
+    summary = await db.get_clients_summary()
     
     await edit_or_send_message(
         callback,
         f"👥 Управление клиентами\n\n"
-        f"📊 Всего клиентов: {len(clients)}\n"
-        f"🟢 Активных: {active_count}\n"
-        f"🔴 Заблокированных: {blocked_count}",
+        f"📊 Всего клиентов: {summary['total']}\n"
+        f"🟢 Активных: {summary['active']}\n"
+        f"🔴 Заблокированных: {summary['blocked']}",
         reply_markup=get_clients_menu()
     )
     await callback.answer()
 
 # Добавление клиента - шаг 1: ввод имени
-@admin_router.callback_query(F.data == "add_client")
+@callbacks.route("add_client")
 async def start_add_client(callback: CallbackQuery, state: FSMContext):
     """Начать процесс добавления клиента"""
     # Проверяем есть ли endpoint по умолчанию
@@ -544,7 +554,7 @@ async def process_client_name(message: Message, state: FSMContext):
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                         [InlineKeyboardButton(text="✅ Да", callback_data="ipv6yes")],
                         [InlineKeyboardButton(text="❌ Нет", callback_data="ipv6no")],
-                        [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_addclient")]
+                        [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_add_client")]
                     ])
                 )
             except Exception:
@@ -582,7 +592,8 @@ async def process_client_name(message: Message, state: FSMContext):
     
     await state.set_state(ClientStates.waiting_endpoint)
 
-@admin_router.callback_query(F.data.in_({"ipv6yes", "ipv6no"}), StateFilter(ClientStates.waiting_ipv6_choice))
+@callbacks.route("ipv6yes", state=ClientStates.waiting_ipv6_choice)
+@callbacks.route("ipv6no", state=ClientStates.waiting_ipv6_choice)
 async def process_ipv6_choice(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора IPv6"""
     has_ipv6 = callback.data == "ipv6yes"
@@ -612,7 +623,7 @@ async def process_ipv6_choice(callback: CallbackQuery, state: FSMContext):
             f"✅ Имя: {name}\n"
             f"Введите Endpoint (IP-адрес или домен сервера):",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_addclient")]
+                [InlineKeyboardButton(text="🔙 Отмена", callback_data="cancel_add_client")]
             ])
         )
         await state.set_state(ClientStates.waiting_endpoint)
@@ -663,11 +674,34 @@ async def process_client_endpoint(message: Message, state: FSMContext):
         except:
             pass
 
+def time_limit_to_expiry(time_limit: str) -> Optional[datetime]:
+    """Дата окончания по коду срока из клавиатуры (1h, 7d, 2w, 3m, 1y или unlimited)"""
+    if time_limit == "unlimited":
+        return None
+    
+    now = datetime.now()
+    value = int(time_limit[:-1])
+    # Часы
+    if time_limit.endswith('h'):
+        return now + timedelta(hours=value)
+    # Дни
+    if time_limit.endswith('d'):
+        return now + timedelta(days=value)
+    # Недели
+    if time_limit.endswith('w'):
+        return now + timedelta(weeks=value)
+    # Месяцы
+    if time_limit.endswith('m'):
+        return now + timedelta(days=value * 30)
+    # Годы
+    if time_limit.endswith('y'):
+        return now + timedelta(days=value * 365)
+    return None
+
 # Обработка выбора временного ограничения с улучшенной логикой
-@admin_router.callback_query(F.data.startswith("time_limit:"))
-async def process_time_limit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("time_limit", time_limit=str)
+async def process_time_limit(callback: CallbackQuery, time_limit: str, state: FSMContext):
     """Обработка выбора временного ограничения"""
-    time_limit = callback.data.split(":", 1)[1]
     
     if time_limit == "custom":
         await edit_or_send_message(
@@ -679,30 +713,7 @@ async def process_time_limit(callback: CallbackQuery, state: FSMContext):
         return
     
     # Вычисляем дату окончания
-    expires_at = None
-    if time_limit != "unlimited":
-        now = datetime.now()
-        
-        # Часы
-        if time_limit.endswith('h'):
-            hours = int(time_limit[:-1])
-            expires_at = now + timedelta(hours=hours)
-        # Дни
-        elif time_limit.endswith('d'):
-            days = int(time_limit[:-1])
-            expires_at = now + timedelta(days=days)
-        # Недели  
-        elif time_limit.endswith('w'):
-            weeks = int(time_limit[:-1])
-            expires_at = now + timedelta(weeks=weeks)
-        # Месяцы
-        elif time_limit.endswith('m'):
-            months = int(time_limit[:-1])
-            expires_at = now + timedelta(days=months * 30)
-        # Годы
-        elif time_limit.endswith('y'):
-            years = int(time_limit[:-1])
-            expires_at = now + timedelta(days=years * 365)
+    expires_at = time_limit_to_expiry(time_limit)
     
     await state.update_data(expires_at=expires_at)
     
@@ -717,10 +728,9 @@ async def process_time_limit(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка выбора единиц времени для custom времени
-@admin_router.callback_query(F.data.startswith("custom_time_unit:"))
-async def process_custom_time_unit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("custom_time_unit", time_unit=("hours", "days", "weeks", "months", "years"))
+async def process_custom_time_unit(callback: CallbackQuery, time_unit: str, state: FSMContext):
     """Обработка выбора единиц времени"""
-    time_unit = callback.data.split(":", 1)[1]
     await state.update_data(custom_time_unit=time_unit)
     
     unit_names = {
@@ -742,7 +752,7 @@ async def process_custom_time_unit(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Возврат к выбору времени
-@admin_router.callback_query(F.data == "back_to_time_selection")
+@callbacks.route("back_to_time_selection")
 async def back_to_time_selection(callback: CallbackQuery):
     """Возврат к выбору временного ограничения"""
     await edit_or_send_message(
@@ -819,10 +829,9 @@ async def process_custom_time_value(message: Message, state: FSMContext):
                 pass
 
 # Обработка выбора ограничения трафика  
-@admin_router.callback_query(F.data.startswith("traffic_limit:"))
-async def process_traffic_limit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("traffic_limit", traffic_limit=str)
+async def process_traffic_limit(callback: CallbackQuery, traffic_limit: str, state: FSMContext):
     """Обработка выбора ограничения трафика"""
-    traffic_limit = callback.data.split(":", 1)[1]
     
     # Конвертируем в байты
     traffic_limit_bytes = None
@@ -840,7 +849,7 @@ async def process_traffic_limit(callback: CallbackQuery, state: FSMContext):
 
     try:
         # Генерируем ключи
-        private_key, public_key, preshared_key = awg_manager.generate_keypair_with_preshared()
+        private_key, public_key, preshared_key = await awg_manager.generate_keypair_with_preshared_async()
         
         ip_address = await awg_manager.get_next_available_ip()
 
@@ -932,7 +941,7 @@ async def process_traffic_limit(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Отмена добавления клиента
-@admin_router.callback_query(F.data == "cancel_add_client")
+@callbacks.route("cancel_add_client")
 async def cancel_add_client(callback: CallbackQuery, state: FSMContext):
     """Отмена добавления клиента"""
     await state.clear()
@@ -944,16 +953,13 @@ async def cancel_add_client(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Список клиентов с улучшенной пагинацией
-@admin_router.callback_query(F.data == "list_clients")
-@admin_router.callback_query(F.data.startswith("clients_page:"))
-async def show_clients_list(callback: CallbackQuery):
+@callbacks.route("list_clients")
+@callbacks.route("clients_page", page=int)
+async def show_clients_list(callback: CallbackQuery, page: int = 0):
     """Показать список клиентов с пагинацией"""
-    page = 0
-    if callback.data.startswith("clients_page:"):
-        page = int(callback.data.split(":", 1)[1])
 
-    clients = await db.get_all_clients()
-    if not clients:
+    total = await db.get_clients_count()
+    if not total:
         await edit_or_send_message(
             callback,
             "📋 Список клиентов\n\n"
@@ -963,11 +969,8 @@ async def show_clients_list(callback: CallbackQuery):
         await callback.answer()
         return
 
-    # Получаем статистику AWG для определения активности клиентов
-    stats = await awg_manager.get_interface_stats()
-
     per_page = 10
-    total_pages = (len(clients) - 1) // per_page + 1
+    total_pages = (total - 1) // per_page + 1
 
     # Проверяем корректность страницы
     if page < 0:
@@ -975,22 +978,30 @@ async def show_clients_list(callback: CallbackQuery):
     elif page >= total_pages:
         page = total_pages - 1
 
+    # Из БД читается только текущая страница; статистика AWG - для активности клиентов
+    clients = await db.get_clients_paginated(page * per_page, per_page)
+    stats = await awg_manager.get_interface_stats()
+
     await edit_or_send_message(
         callback,
         f"📋 Список клиентов\n\n"
         f"Страница {page + 1} из {total_pages}\n"
-        f"Всего клиентов: {len(clients)}\n\n"
+        f"Всего клиентов: {total}\n\n"
         f"🟢 до 7 дн · 🟡 7-14 дн · 🟠 >14 дн · ⚪ нет · 🔴 блок",
-        reply_markup=get_client_list_keyboard(clients, page, per_page, stats)
+        reply_markup=get_client_list_keyboard(clients, page, per_page, stats, total=total)
     )
     await callback.answer()
 
 # Детали клиента - с поддержкой перехода от QR-кода и обновлением трафика
-@admin_router.callback_query(F.data.startswith("client_details:"))
-async def show_client_details(callback: CallbackQuery):
+@callbacks.route("client_details", client_id=int)
+async def show_client_details(callback: CallbackQuery, client_id: int):
     """Показать детали клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
-    client = await db.get_client(client_id)
+    # Клиент из БД и статистика интерфейса (subprocess) не зависят друг от друга
+    view = await load_view({
+        'client': db.get_client(client_id),
+        'stats': awg_manager.get_interface_stats(),
+    }, timeouts={'client': 5.0, 'stats': 5.0})
+    client = view.get('client')
     
     if not client:
         await edit_or_send_message(
@@ -1001,55 +1012,59 @@ async def show_client_details(callback: CallbackQuery):
         await callback.answer()
         return
     
-    # Получаем статистику
-    stats = await awg_manager.get_interface_stats()
-    client_stats = stats.get(client.public_key, {})
+    client_stats = view.get('stats', {}).get(client.public_key, {})
     
-    # Обновляем трафик клиента из статистики
+    # Обновляем трафик клиента из статистики (объект клиента обновляется вместе с БД)
     await update_client_traffic_usage(client, client_stats)
     
-    # Получаем обновленного клиента из БД
-    client = await db.get_client(client_id)
-    
     info_text = format_client_info(client, client_stats)
     
     user_id = callback.from_user.id
     
-    # Если предыдущее сообщение было с фото (QR-код), удаляем его и отправляем новое
-    try:
-        if callback.message and callback.message.photo:
-            await callback.bot.delete_message(
-                chat_id=user_id,
-                message_id=callback.message.message_id
-            )
+    async def show_details():
+        # Если предыдущее сообщение было с фото (QR-код), удаляем его и отправляем новое
+        try:
+            if callback.message and callback.message.photo:
+                await callback.bot.delete_message(
+                    chat_id=user_id,
+                    message_id=callback.message.message_id
+                )
+                new_message = await callback.bot.send_message(
+                    chat_id=user_id,
+                    text=info_text,
+                    reply_markup=get_client_details_keyboard(client_id)
+                )
+                user_last_message[user_id] = new_message.message_id
+            else:
+                await edit_or_send_message(
+                    callback,
+                    info_text,
+                    reply_markup=get_client_details_keyboard(client_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка при обработке перехода от QR: {e}")
             new_message = await callback.bot.send_message(
                 chat_id=user_id,
                 text=info_text,
                 reply_markup=get_client_details_keyboard(client_id)
             )
             user_last_message[user_id] = new_message.message_id
-        else:
-            await edit_or_send_message(
-                callback,
-                info_text,
-                reply_markup=get_client_details_keyboard(client_id)
-            )
-    except Exception as e:
-        logger.error(f"Ошибка при обработке перехода от QR: {e}")
-        new_message = await callback.bot.send_message(
-            chat_id=user_id,
-            text=info_text,
-            reply_markup=get_client_details_keyboard(client_id)
-        )
-        user_last_message[user_id] = new_message.message_id
     
-    await callback.answer()
+    async def answer():
+        await callback.answer()
+    
+    # Ответ на нажатие не ждет отрисовки экрана; его ошибка (например, устаревший
+    # запрос) не должна прерывать отрисовку
+    shown, answered = await asyncio.gather(show_details(), answer(), return_exceptions=True)
+    if isinstance(answered, Exception):
+        logger.warning(f"Не удалось ответить на нажатие client_details: {answered}")
+    if isinstance(shown, BaseException):
+        raise shown
 
 # Редактирование клиента
-@admin_router.callback_query(F.data.startswith("edit_client:"))
-async def show_edit_client_menu(callback: CallbackQuery):
+@callbacks.route("edit_client", client_id=int)
+async def show_edit_client_menu(callback: CallbackQuery, client_id: int):
     """Показать меню редактирования клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1065,10 +1080,9 @@ async def show_edit_client_menu(callback: CallbackQuery):
     await callback.answer()
 
 # Блокировка/разблокировка клиента
-@admin_router.callback_query(F.data.startswith("toggle_block:"))
-async def toggle_client_block(callback: CallbackQuery):
+@callbacks.route("toggle_block", client_id=int)
+async def toggle_client_block(callback: CallbackQuery, client_id: int):
     """Заблокировать/разблокировать клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1105,10 +1119,9 @@ async def toggle_client_block(callback: CallbackQuery):
         await callback.answer(f"❌ Ошибка при изменении статуса клиента", show_alert=True)
 
 # Конфигурация клиента - с отправкой .conf файла
-@admin_router.callback_query(F.data.startswith("client_config:"))
-async def send_client_config(callback: CallbackQuery):
+@callbacks.route("client_config", client_id=int)
+async def send_client_config(callback: CallbackQuery, client_id: int):
     """Отправить конфигурацию клиента с файлом .conf"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1118,15 +1131,12 @@ async def send_client_config(callback: CallbackQuery):
     user_id = callback.from_user.id
     
     try:
-        from utils.vpn_converter import conf_to_vpn_url
-        from aiogram.types import BufferedInputFile
-        
         # Генерируем конфигурацию
         config_text = await awg_manager.create_client_config(client)
         
         # Генерируем vpn:// URL
         try:
-            vpn_url = conf_to_vpn_url(config_text)
+            vpn_url = await get_client_vpn_url(client.id, config_text)
         except Exception as e:
             logger.error(f"Ошибка при конвертации в vpn://: {e}")
             vpn_url = "Ошибка генерации vpn:// строки"
@@ -1156,23 +1166,26 @@ async def send_client_config(callback: CallbackQuery):
         # Обновляем ID последнего сообщения
         user_last_message[user_id] = sent_message.message_id
         
-        # Создаем .conf файл
+        # Отправляем .conf файл (повторно - по file_id без загрузки)
         conf_filename = f"{client.name}.conf"
-        conf_file = BufferedInputFile(
-            file=config_text.encode('utf-8'),
-            filename=conf_filename
-        )
         
-        # Отправляем файл конфигурации
-        await callback.bot.send_document(
-            chat_id=user_id,
-            document=conf_file,
+        async def render_conf() -> bytes:
+            return config_text.encode('utf-8')
+        
+        await telegram_file_cache.send_document(
+            callback.bot,
+            user_id,
+            artifact_key("conf", f"{conf_filename}\n{config_text}"),
+            render_conf,
+            conf_filename,
+            kind="conf",
+            client_id=client.id,
             caption=f"📄 Конфигурационный файл для {client.name}\n\n"
                    f"Импортируйте этот файл в приложение AmneziaWG",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
                 InlineKeyboardButton(
                     text="🔙 Назад к клиенту",
-                    callback_data=f"back_from_config:{client_id}"
+                    callback_data=pack_callback("back_from_config", client_id)
                 )
             ]])
         )
@@ -1185,10 +1198,9 @@ async def send_client_config(callback: CallbackQuery):
 
 
 # Возврат из конфигурации к карточке клиента
-@admin_router.callback_query(F.data.startswith("back_from_config:"))
-async def back_from_config(callback: CallbackQuery):
+@callbacks.route("back_from_config", client_id=int)
+async def back_from_config(callback: CallbackQuery, client_id: int):
     """Вернуться к карточке клиента из конфигурации"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1231,10 +1243,9 @@ async def back_from_config(callback: CallbackQuery):
     await callback.answer()
 
 # QR-код конфигурации - с динамическим обновлением и кнопкой возврата
-@admin_router.callback_query(F.data.startswith("client_qr:"))
-async def send_client_qr(callback: CallbackQuery):
+@callbacks.route("client_qr", client_id=int)
+async def send_client_qr(callback: CallbackQuery, client_id: int):
     """Отправить QR-код конфигурации клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1243,7 +1254,9 @@ async def send_client_qr(callback: CallbackQuery):
     
     try:
         config_text = await awg_manager.create_client_config(client)
-        qr_image = generate_qr_code(config_text)
+        
+        async def render_qr() -> bytes:
+            return await get_client_qr_png(client.id, config_text)
         
         user_id = callback.from_user.id
         
@@ -1256,13 +1269,19 @@ async def send_client_qr(callback: CallbackQuery):
             except:
                 pass
         
-        new_message = await callback.bot.send_photo(
-            chat_id=user_id,
-            photo=qr_image,
+        # Уже загруженный QR отправляется по file_id без рендеринга и загрузки
+        new_message = await telegram_file_cache.send_photo(
+            callback.bot,
+            user_id,
+            qr_artifact_key(config_text),
+            render_qr,
+            "config_qr.png",
+            kind="qr",
+            client_id=client.id,
             caption=f"📱 QR-код для клиента {client.name}\n\n"
                    "Отсканируйте этот код в приложении AmneziaWG",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 Назад к клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 Назад к клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
         user_last_message[user_id] = new_message.message_id
@@ -1274,104 +1293,138 @@ async def send_client_qr(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при создании QR-кода", show_alert=True)
 
 # Обработка возврата после QR-кода
-@admin_router.callback_query(F.data.startswith("back_from_qr:"))
-async def back_from_qr(callback: CallbackQuery):
+@callbacks.route("back_from_qr", client_id=int)
+async def back_from_qr(callback: CallbackQuery, client_id: int):
     """Возврат к деталям клиента после показа QR-кода"""
-    client_id = int(callback.data.split(":", 1)[1])
     
     # Перенаправляем к обработчику деталей клиента
-    callback.data = f"client_details:{client_id}"
-    await show_client_details(callback)
+    await show_client_details(callback, client_id)
 
 # Информация об IP клиента с трекингом из awg show
-@admin_router.callback_query(F.data.startswith("client_ip_info:"))
-async def show_client_ip_info(callback: CallbackQuery):
+@callbacks.route("client_ip_info", client_id=int)
+async def show_client_ip_info(callback: CallbackQuery, client_id: int):
     """Показать информацию об IP соединениях клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
         await callback.answer("❌ Клиент не найден", show_alert=True)
         return
     
-    await callback.answer("🔍 Получаю информацию о соединениях...")
-    
-    stats = await awg_manager.get_interface_stats()
-    
-    today_connections = await db.get_client_daily_ips(client_id)
+    async def load_today_connections():
+        # Сбрасываем буфер, чтобы увидеть уже накопленные подключения
+        await awg_manager.ip_writer.flush()
+        return await db.get_client_daily_ips(client_id)
     
-    info_text = f"🌍 IP соединения клиента {client.name}\n\n"
+    # Статистика, история и ответ на нажатие - параллельно, каждое со своим таймаутом
+    view = await load_view({
+        'stats': awg_manager.get_interface_stats(),
+        'connections': load_today_connections(),
+        'answer': callback.answer("🔍 Получаю информацию о соединениях..."),
+    }, timeouts={'stats': 5.0, 'connections': 5.0, 'answer': 3.0})
+    stats = view.get('stats', {})
+    today_connections = view.get('connections', [])
     
     current_endpoint = None
     client_stats = stats.get(client.public_key, {})
     if 'endpoint' in client_stats and client_stats['endpoint']:
         current_endpoint = client_stats['endpoint'].split(':')[0]
+    
+    unique_ips = []
+    seen_ips = set()
+    for connection in today_connections:
+        ip = connection['ip_address']
+        if (current_endpoint and ip == current_endpoint) or ip in seen_ips:
+            continue
+        seen_ips.add(ip)
+        unique_ips.append(connection)
+    
+    # Показываем до 7 уникальных IP
+    shown_ips = ([current_endpoint] if current_endpoint else []) + [c['ip_address'] for c in unique_ips[:7]]
+    today = datetime.now().strftime('%d.%m.%Y')
+    
+    def render(geo: dict) -> str:
+        info_text = f"🌍 IP соединения клиента {client.name}\n\n"
         
-        current_ip_info = await ip_service.get_ip_info(current_endpoint)
-        if current_ip_info:
+        if current_endpoint:
             info_text += f"🔴 Сейчас подключен с IP: {current_endpoint}\n"
-            info_text += f"   📍 {current_ip_info['country']}, {current_ip_info['city']}\n"
-            info_text += f"   🌐 {current_ip_info['isp']}\n\n"
-        else:
-            info_text += f"🔴 Сейчас подключен с IP: {current_endpoint}\n\n"
-    
-    if not today_connections:
-        if not current_endpoint:
-            info_text += f"📅 За сегодня ({datetime.now().strftime('%d.%m.%Y')}) подключений не было"
+            current_ip_info = geo.get(current_endpoint)
+            if current_ip_info:
+                info_text += f"   📍 {current_ip_info['country']}, {current_ip_info['city']}\n"
+                info_text += f"   🌐 {current_ip_info['isp']}\n"
+            info_text += "\n"
+        
+        if not today_connections:
+            if not current_endpoint:
+                info_text += f"📅 За сегодня ({today}) подключений не было"
+            else:
+                info_text += f"📅 За сегодня ({today}) других подключений не было"
         else:
-            info_text += f"📅 За сегодня ({datetime.now().strftime('%d.%m.%Y')}) других подключений не было"
-    else:
-        info_text += f"📅 История подключений за сегодня ({datetime.now().strftime('%d.%m.%Y')}):\n\n"
+            info_text += f"📅 История подключений за сегодня ({today}):\n\n"
+            
+            if not unique_ips:
+                info_text += "Других уникальных IP подключений за сегодня не было"
+            else:
+                for i, connection in enumerate(unique_ips[:7], 1):
+                    ip = connection['ip_address']
+                    count = connection['connection_count']
+                    last_time = connection['last_seen'].strftime('%H:%M')
+                    
+                    ip_info = geo.get(ip)
+                    
+                    if ip_info:
+                        info_text += f"{i}. 🌐 {ip}\n" \
+                                   f"   📍 {ip_info['country']}, {ip_info['city']}\n" \
+                                   f"   🏢 {ip_info['isp']}\n" \
+                                   f"   🔢 Сессий: {count}\n" \
+                                   f"   🕒 Последний раз: {last_time}\n\n"
+                    else:
+                        info_text += f"{i}. 🌐 {ip}\n" \
+                                   f"   🔢 Сессий: {count}\n" \
+                                   f"   🕒 Последний раз: {last_time}\n\n"
+                
+                remaining = len(unique_ips) - 7
+                if remaining > 0:
+                    info_text += f"... и еще {remaining} уникальных IP"
         
-        unique_ips = []
-        seen_ips = set()
+        if len(geo) < len(shown_ips):
+            info_text += "\n\n⏳ Определяю местоположение..."
+        return info_text
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🔄 Обновить", callback_data=pack_callback("client_ip_info", client_id)),
+        InlineKeyboardButton(text="🔙 Назад", callback_data=pack_callback("client_details", client_id))
+    ]])
+    
+    # Первый экран - сразу, без геолокации; она дописывается правками по мере ответов
+    first_screen = render({})
+    await edit_or_send_message(callback, first_screen, reply_markup=keyboard)
+    if shown_ips and callback.message:
+        fingerprints = get_render_fingerprints()
+        message_key = (callback.message.chat.id, callback.message.message_id)
+        shown = last_render.get()
         
-        for connection in today_connections:
-            ip = connection['ip_address']
-            if (current_endpoint and ip == current_endpoint) or ip in seen_ips:
-                continue
-            seen_ips.add(ip)
-            unique_ips.append(connection)
+        def still_shown() -> bool:
+            # Пока шла геолокация, администратор мог открыть другой экран в этом сообщении
+            return shown is not None and shown.key == message_key and fingerprints.is_current(shown)
         
-        if not unique_ips:
-            info_text += "Других уникальных IP подключений за сегодня не было"
-        else:
-            for i, connection in enumerate(unique_ips[:7], 1):  # Показываем до 7 уникальных IP
-                ip = connection['ip_address']
-                count = connection['connection_count']
-                last_time = connection['last_seen'].strftime('%H:%M')
-                
-                ip_info = await ip_service.get_ip_info(ip)
-                
-                if ip_info:
-                    info_text += f"{i}. 🌐 {ip}\n" \
-                               f"   📍 {ip_info['country']}, {ip_info['city']}\n" \
-                               f"   🏢 {ip_info['isp']}\n" \
-                               f"   🔢 Подключений: {count}\n" \
-                               f"   🕒 Последний раз: {last_time}\n\n"
-                else:
-                    info_text += f"{i}. 🌐 {ip}\n" \
-                               f"   🔢 Подключений: {count}\n" \
-                               f"   🕒 Последний раз: {last_time}\n\n"
-            
-            remaining = len(unique_ips) - 7
-            if remaining > 0:
-                info_text += f"... и еще {remaining} уникальных IP"
-    
-    await edit_or_send_message(
-        callback,
-        info_text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🔄 Обновить", callback_data=f"client_ip_info:{client_id}"),
-            InlineKeyboardButton(text="🔙 Назад", callback_data=f"client_details:{client_id}")
-        ]])
-    )
+        async def apply(text: str) -> None:
+            nonlocal shown
+            await edit_or_send_message(callback, text, reply_markup=keyboard)
+            shown = last_render.get()
+        
+        await fill_progressively(
+            {ip: ip_service.get_ip_info(ip) for ip in shown_ips},
+            render,
+            apply,
+            shown=first_screen,
+            timeout=config.geo_view_timeout,
+            active=still_shown
+        )
 
 # Статистика клиента
-@admin_router.callback_query(F.data.startswith("client_stats:"))
-async def show_client_stats(callback: CallbackQuery):
+@callbacks.route("client_stats", client_id=int)
+async def show_client_stats(callback: CallbackQuery, client_id: int):
     """Показать статистику клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1400,17 +1453,16 @@ async def show_client_stats(callback: CallbackQuery):
         callback,
         stats_text,
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🔄 Обновить", callback_data=f"client_stats:{client_id}"),
-            InlineKeyboardButton(text="🔙 Назад", callback_data=f"client_details:{client_id}")
+            InlineKeyboardButton(text="🔄 Обновить", callback_data=pack_callback("client_stats", client_id)),
+            InlineKeyboardButton(text="🔙 Назад", callback_data=pack_callback("client_details", client_id))
         ]])
     )
     await callback.answer()
 
 # Удаление клиента
-@admin_router.callback_query(F.data.startswith("delete_client:"))
-async def confirm_delete_client(callback: CallbackQuery):
+@callbacks.route("delete_client", client_id=int)
+async def confirm_delete_client(callback: CallbackQuery, client_id: int):
     """Подтвердить удаление клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1427,10 +1479,9 @@ async def confirm_delete_client(callback: CallbackQuery):
     await callback.answer()
 
 # Подтверждение удаления клиента
-@admin_router.callback_query(F.data.startswith("confirm:delete_client:"))
-async def delete_client_confirmed(callback: CallbackQuery):
+@callbacks.route("confirm", target=("delete_client",), client_id=int)
+async def delete_client_confirmed(callback: CallbackQuery, client_id: int):
     """Удалить клиента после подтверждения"""
-    client_id = int(callback.data.split(":", 2)[2])
     client = await db.get_client(client_id)
 
     if not client:
@@ -1443,11 +1494,12 @@ async def delete_client_confirmed(callback: CallbackQuery):
         success = await db.delete_client(client_id)
 
         if success:
+            get_artifact_cache().invalidate_owner(client_id)
             await callback.answer("✅ Клиент удален")
 
             # Возвращаем в список клиентов
-            clients = await db.get_all_clients()
-            if not clients:
+            total = await db.get_clients_count()
+            if not total:
                 await edit_or_send_message(
                     callback,
                     f"✅ Клиент {client.name} успешно удален\n\n"
@@ -1455,16 +1507,17 @@ async def delete_client_confirmed(callback: CallbackQuery):
                     reply_markup=get_clients_menu()
                 )
             else:
+                clients = await db.get_clients_paginated(0, 10)
                 stats = await awg_manager.get_interface_stats()
-                total_pages = (len(clients) - 1) // 10 + 1
+                total_pages = (total - 1) // 10 + 1
                 await edit_or_send_message(
                     callback,
                     f"✅ Клиент {client.name} удален\n\n"
                     f"📋 Список клиентов\n"
                     f"Страница 1 из {total_pages}\n"
-                    f"Всего клиентов: {len(clients)}\n\n"
+                    f"Всего клиентов: {total}\n\n"
                     f"🟢 до 7 дн · 🟡 7-14 дн · 🟠 >14 дн · ⚪ нет · 🔴 блок",
-                    reply_markup=get_client_list_keyboard(clients, 0, 10, stats)
+                    reply_markup=get_client_list_keyboard(clients, 0, 10, stats, total=total)
                 )
         else:
             await callback.answer("❌ Ошибка при удалении клиента", show_alert=True)
@@ -1474,7 +1527,7 @@ async def delete_client_confirmed(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при удалении клиента", show_alert=True)
 
 # Отмена действия
-@admin_router.callback_query(F.data.startswith("cancel:"))
+@callbacks.route("cancel", target=str)
 async def cancel_action(callback: CallbackQuery):
     """Отмена действия"""
     await edit_or_send_message(
@@ -1484,35 +1537,23 @@ async def cancel_action(callback: CallbackQuery):
     )
     await callback.answer()
 
-@admin_router.callback_query(F.data == "stats_menu")
+@callbacks.route("stats_menu")
 async def show_stats_menu(callback: CallbackQuery):
     """Отображение статистики сервера"""
-    clients = await db.get_all_clients()
-    active_clients = [c for c in clients if c.is_active and not c.is_blocked]
-    blocked_clients = [c for c in clients if c.is_blocked]
+    # Счетчики и общий трафик считаются в SQL, без загрузки клиентов
+    summary = await db.get_clients_summary()
+    total_clients = summary['total']
+    total_traffic_used = summary['traffic_used']
+    total_traffic_limit = summary['traffic_limit']
+    clients_with_limit = summary['clients_with_limit']
     
     stats = await awg_manager.get_interface_stats()
     online_clients = len([key for key in stats.keys() if "latest handshake" in stats[key]])
     
-    # Вычисление общего трафика всех клиентов
-    total_traffic_used = 0
-    total_traffic_limit = 0
-    clients_with_limit = 0
-    
-    for client in clients:
-        # Суммируем использованный трафик
-        if client.traffic_used:
-            total_traffic_used += client.traffic_used
-        
-        # Суммируем лимиты трафика (только для клиентов с установленным лимитом)
-        if client.traffic_limit and client.traffic_limit != "unlimited":
-            total_traffic_limit += client.traffic_limit
-            clients_with_limit += 1
-    
     try:
         network = ipaddress.IPv4Network(config.server_subnet)
         total_ips = network.num_addresses - 2
-        available_ips = total_ips - len(clients)
+        available_ips = total_ips - total_clients
     except:
         total_ips = available_ips = "—"
     
@@ -1526,12 +1567,12 @@ async def show_stats_menu(callback: CallbackQuery):
         f"📊 Статистика сервера\n\n"
         f"🕐 Время: {current_time}\n\n"
         f"👥 Клиенты:\n"
-        f"├ 📋 Всего: {len(clients)}\n"
-        f"├ ✅ Активных: {len(active_clients)}\n"
-        f"├ 🔴 Заблокированных: {len(blocked_clients)}\n"
+        f"├ 📋 Всего: {total_clients}\n"
+        f"├ ✅ Активных: {summary['active']}\n"
+        f"├ 🔴 Заблокированных: {summary['blocked']}\n"
         f"└ 🟢 Онлайн: {online_clients}\n\n"
         f"🌐 IP-адреса:\n"
-        f"├ 👤 Занято: {len(clients)} / {total_ips}\n"
+        f"├ 👤 Занято: {total_clients} / {total_ips}\n"
         f"└ ✨ Доступно: {available_ips}\n\n"
         f"📈 Трафик сервера:\n"
         f"├ 📤 Использовано: {traffic_used_formatted}\n"
@@ -1539,19 +1580,143 @@ async def show_stats_menu(callback: CallbackQuery):
         f"   💡 ({clients_with_limit} клиент{'ов' if clients_with_limit != 1 else ''})"
     )
 
+    dns_stats = get_endpoint_resolver().get_stats()
+    if dns_stats['lookups']:
+        stats_text += (
+            f"\n\n🔎 DNS endpoint:\n"
+            f"├ 🎯 Попаданий в кэш: {dns_stats['hit_rate']:.0%} из {dns_stats['lookups']}\n"
+            f"└ ⏱ Разрешение: ср. {dns_stats['avg_latency_ms']:.1f} мс, макс. {dns_stats['max_latency_ms']:.1f} мс"
+        )
+
+    geo_stats = get_geo_cache().get_stats()
+    offline = ip_service.offline
+    if offline is not None and offline.lookups:
+        offline_stats = offline.get_stats()
+        stats_text += (
+            f"\n\n📦 Локальная база геолокации:\n"
+            f"├ 🎯 Найдено: {offline_stats['hits']} из {offline_stats['lookups']}\n"
+            f"└ 🔄 Загрузок файла: {offline_stats['reloads']}"
+        )
+    if geo_stats['lookups']:
+        stats_text += (
+            f"\n\n🌍 Геолокация IP:\n"
+            f"├ 🎯 Из кэша: {geo_stats['hit_rate']:.0%} из {geo_stats['lookups']} "
+            f"(память {geo_stats['memory_hits']}, БД {geo_stats['db_hits']})\n"
+            f"├ 🚫 Без запроса: неудачных {geo_stats['negative_hits']}, частных {geo_stats['private']}\n"
+            f"└ 📡 Промахов (запрос к IP-API): {geo_stats['misses']}"
+        )
+
+    pool_lines = [
+        f"{name}: {pool['completed']} задач, ср. {pool['avg_run_ms']:.1f} мс, "
+        f"очередь {pool['queue_depth']} (макс. {pool['max_queue_depth']})"
+        for name, pool in get_worker_pools_stats().items() if pool['completed']
+    ]
+    if pool_lines:
+        stats_text += "\n\n⚙️ Пулы воркеров:\n" + "\n".join(
+            f"{'└' if i == len(pool_lines) - 1 else '├'} {line}" for i, line in enumerate(pool_lines)
+        )
+
+    outbound_stats = get_outbound_scheduler().get_stats()
+    if outbound_stats['sent']:
+        stats_text += (
+            f"\n\n📨 Исходящие:\n"
+            f"├ 📤 Отправлено: {outbound_stats['sent']}, в очереди: {outbound_stats['queued']}\n"
+            f"├ 🧹 Схлопнуто правок: {outbound_stats['collapsed']}, повторов после 429: {outbound_stats['retried']}\n"
+            f"└ ⏱ Ожидание: ср. {outbound_stats['avg_wait_ms']:.1f} мс, макс. {outbound_stats['max_wait_ms']:.1f} мс"
+        )
+
+    render_stats = get_render_fingerprints().get_stats()
+    if render_stats['skipped'] or render_stats['markup_edits']:
+        stats_text += (
+            f"\n\n✏️ Правки сообщений:\n"
+            f"├ ⏭ Пропущено без изменений: {render_stats['skipped']}\n"
+            f"└ ⌨️ Только клавиатура: {render_stats['markup_edits']}, полных: {render_stats['text_edits']}"
+        )
+
+    route_stats = get_instrumentation().get_stats(top=3)
+    if route_stats['updates']:
+        stats_text += (
+            f"\n\n🐢 Обработка обновлений:\n"
+            f"├ 📥 Всего: {route_stats['updates']}, ошибок: {route_stats['errors']}, медленных: {route_stats['slow']}\n"
+            f"├ 🗄 Обращений к БД: {route_stats['db_queries']} (ср. {route_stats['db_avg_ms']:.1f} мс), "
+            f"subprocess: {route_stats['subprocesses']}\n"
+            f"└ Самые медленные (p95):"
+        )
+        for i, route in enumerate(route_stats['slowest']):
+            stats_text += (
+                f"\n   {'└' if i == len(route_stats['slowest']) - 1 else '├'} {route['route']}: "
+                f"{route['p95_ms']:.0f} мс ×{route['count']}, "
+                f"БД {route['db_per_update']:.1f}, subprocess {route['subprocess_per_update']:.1f} на обновление"
+            )
+
     await edit_or_send_message(
         callback,
         stats_text,
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔄 Обновить", callback_data="stats_menu")],
+            [InlineKeyboardButton(text="🌍 География подключений", callback_data="geo_report")],
             [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
         ])
     )
     
     await callback.answer()
 
+# География подключений всех клиентов
+@callbacks.route("geo_report")
+async def show_geo_report(callback: CallbackQuery):
+    """Страны подключений всех клиентов за сегодня (геолокация всех IP одним проходом)"""
+    await callback.answer("🌍 Определяю местоположение...")
+    
+    # Сбрасываем буфер, чтобы учесть уже накопленные подключения
+    await awg_manager.ip_writer.flush()
+    connections = await db.get_daily_ips()
+    unique_ips = list(dict.fromkeys(ip for _, ip in connections))
+    
+    # Локальная база отвечает сразу, остальное - из кэша и пакетами IP-API
+    view = await load_view(
+        {'geo': ip_service.get_ip_info_batch(unique_ips)},
+        timeouts={'geo': config.geo_view_timeout}
+    )
+    geo = view.get('geo', {})
+    
+    countries = {}
+    for client_id, ip in connections:
+        ip_info = geo.get(ip)
+        if ip_info:
+            clients, ips = countries.setdefault(ip_info['country'], (set(), set()))
+            clients.add(client_id)
+            ips.add(ip)
+    located = sum(1 for ip in unique_ips if ip in geo)
+    
+    today = datetime.now().strftime('%d.%m.%Y')
+    report_text = (
+        f"🌍 География подключений за {today}\n\n"
+        f"👥 Клиентов с подключениями: {len({client_id for client_id, _ in connections})}\n"
+        f"🌐 Уникальных IP: {len(unique_ips)}, определено: {located}\n"
+    )
+    if countries:
+        report_text += "\n"
+        ranked = sorted(countries.items(), key=lambda item: (-len(item[1][0]), item[0]))
+        for i, (country, (clients, ips)) in enumerate(ranked[:15], 1):
+            report_text += f"{i}. {country} - клиентов: {len(clients)}, IP: {len(ips)}\n"
+        if len(ranked) > 15:
+            report_text += f"... и еще {len(ranked) - 15} стран\n"
+    elif not connections:
+        report_text += "\n📅 За сегодня подключений не было"
+    if view.partial:
+        report_text += f"\n⚠️ Геолокация не получена за {config.geo_view_timeout:.0f} с, повторите позже"
+    
+    await edit_or_send_message(
+        callback,
+        report_text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔄 Обновить", callback_data="geo_report")],
+            [InlineKeyboardButton(text="🔙 Статистика", callback_data="stats_menu")]
+        ])
+    )
+
 # Меню резервных копий
-@admin_router.callback_query(F.data == "backup_menu")
+@callbacks.route("backup_menu")
 async def show_backup_menu(callback: CallbackQuery):
     """Показать меню резервных копий"""
     backups = await backup_service.list_backups()
@@ -1565,13 +1730,13 @@ async def show_backup_menu(callback: CallbackQuery):
     await callback.answer()
 
 # Поиск клиента
-@admin_router.callback_query(F.data == "search_client")
+@callbacks.route("search_client")
 async def start_search_client(callback: CallbackQuery, state: FSMContext):
     """Начать поиск клиента"""
     await edit_or_send_message(
         callback,
         "🔍 Поиск клиента\n\n"
-        "Введите имя клиента для поиска:",
+        "Введите часть имени, начало IP/IPv6-адреса или публичного ключа:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
             InlineKeyboardButton(text="🔙 Отмена", callback_data="clients_menu")
         ]])
@@ -1583,7 +1748,7 @@ async def start_search_client(callback: CallbackQuery, state: FSMContext):
 @admin_router.message(StateFilter(ClientStates.waiting_client_search))
 async def process_search_client(message: Message, state: FSMContext):
     """Обработка поиска клиента"""
-    search_term = message.text.strip().lower()
+    search_term = message.text.strip()
     user_id = message.from_user.id
     
     try:
@@ -1607,46 +1772,75 @@ async def process_search_client(message: Message, state: FSMContext):
                 pass
         return
     
-    all_clients = await db.get_all_clients()
-    found_clients = [c for c in all_clients if search_term in c.name.lower()]
+    # Запрос сохраняется в данных FSM для перелистывания страниц результатов
+    await state.set_state(None)
+    await state.update_data(search_term=search_term)
 
-    await state.clear()
+    if user_id in user_last_message:
+        text, markup = await build_search_results(search_term, 0)
+        try:
+            await message.bot.edit_message_text(
+                chat_id=user_id,
+                message_id=user_last_message[user_id],
+                text=text,
+                reply_markup=markup
+            )
+        except:
+            pass
 
-    if not found_clients:
-        if user_id in user_last_message:
-            try:
-                await message.bot.edit_message_text(
-                    chat_id=user_id,
-                    message_id=user_last_message[user_id],
-                    text=f"🔍 Поиск клиента\n\n"
-                         f"❌ Клиенты с именем '{search_term}' не найдены",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 Меню клиентов", callback_data="clients_menu")
-                    ]])
-                )
-            except:
-                pass
-    else:
-        # Получаем статистику AWG для определения активности клиентов
-        stats = await awg_manager.get_interface_stats()
-        if user_id in user_last_message:
-            try:
-                await message.bot.edit_message_text(
-                    chat_id=user_id,
-                    message_id=user_last_message[user_id],
-                    text=f"🔍 Результаты поиска\n\n"
-                         f"Найдено клиентов: {len(found_clients)}\n\n"
-                         f"🟢 до 7 дн · 🟡 7-14 дн · 🟠 >14 дн · ⚪ нет · 🔴 блок",
-                    reply_markup=get_client_list_keyboard(found_clients, 0, 10, stats)
-                )
-            except:
-                pass
+# Страницы результатов поиска
+@callbacks.route("search_page", page=int)
+async def show_search_page(callback: CallbackQuery, page: int, state: FSMContext):
+    """Перелистывание результатов поиска клиентов"""
+    search_term = (await state.get_data()).get("search_term")
+
+    if not search_term:
+        await callback.answer("❌ Поиск устарел, повторите запрос", show_alert=True)
+        return
+
+    text, markup = await build_search_results(search_term, page)
+    await edit_or_send_message(callback, text, reply_markup=markup)
+    await callback.answer()
+
+async def build_search_results(search_term: str, page: int, per_page: int = 10):
+    """Текст и клавиатура страницы результатов поиска"""
+    page = max(page, 0)
+    result = await db.search_clients(search_term, limit=per_page, offset=page * per_page)
+
+    if not result.total:
+        return (
+            f"🔍 Поиск клиента\n\n"
+            f"❌ Клиенты по запросу '{search_term}' не найдены",
+            InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="🔙 Меню клиентов", callback_data="clients_menu")
+            ]])
+        )
+
+    total_pages = (result.total - 1) // per_page + 1
+    if page >= total_pages:
+        page = total_pages - 1
+        result = await db.search_clients(search_term, limit=per_page, offset=page * per_page)
+
+    found = f"{result.total}+" if result.truncated else str(result.total)
+    hint = "\nУточните запрос, чтобы увидеть остальные совпадения\n" if result.truncated else ""
+
+    # Получаем статистику AWG для определения активности клиентов
+    stats = await awg_manager.get_interface_stats()
+    return (
+        f"🔍 Результаты поиска: '{search_term}'\n\n"
+        f"Страница {page + 1} из {total_pages}\n"
+        f"Найдено клиентов: {found}\n{hint}\n"
+        f"🟢 до 7 дн · 🟡 7-14 дн · 🟠 >14 дн · ⚪ нет · 🔴 блок",
+        get_client_list_keyboard(
+            result.clients, page, per_page, stats,
+            total=result.total, page_callback="search_page"
+        )
+    )
 
 # Редактирование имени клиента
-@admin_router.callback_query(F.data.startswith("edit_name:"))
-async def edit_client_name(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_name", client_id=int)
+async def edit_client_name(callback: CallbackQuery, client_id: int, state: FSMContext):
     """Редактирование имени клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1660,7 +1854,7 @@ async def edit_client_name(callback: CallbackQuery, state: FSMContext):
         f"Текущее имя: {client.name}\n\n"
         f"Введите новое имя (латинские буквы, цифры, символы - _ .):",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+            InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
         ]])
     )
     await state.set_state(EditClientStates.waiting_new_name)
@@ -1692,7 +1886,7 @@ async def process_new_client_name(message: Message, state: FSMContext):
                          "❌ Имя должно содержать от 2 до 32 символов\n\n"
                          "Введите корректное имя:",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+                        InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
                     ]])
                 )
             except:
@@ -1709,7 +1903,7 @@ async def process_new_client_name(message: Message, state: FSMContext):
                          "❌ Имя может содержать только латинские буквы, цифры и символы - _ .\n\n"
                          "Введите корректное имя:",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+                        InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
                     ]])
                 )
             except:
@@ -1728,7 +1922,7 @@ async def process_new_client_name(message: Message, state: FSMContext):
                          "❌ Клиент с таким именем уже существует\n\n"
                          "Введите другое имя:",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+                        InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
                     ]])
                 )
             except:
@@ -1752,7 +1946,7 @@ async def process_new_client_name(message: Message, state: FSMContext):
                          f"Старое имя: {old_name}\n"
                          f"Новое имя: {new_name}",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                     ]])
                 )
             except:
@@ -1765,17 +1959,16 @@ async def process_new_client_name(message: Message, state: FSMContext):
                     message_id=user_last_message[user_id],
                     text="❌ Ошибка при изменении имени клиента",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                     ]])
                 )
             except:
                 pass
 
 # Редактирование endpoint
-@admin_router.callback_query(F.data.startswith("edit_endpoint:"))
-async def edit_client_endpoint(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_endpoint", client_id=int)
+async def edit_client_endpoint(callback: CallbackQuery, client_id: int, state: FSMContext):
     """Редактирование endpoint клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1789,7 +1982,7 @@ async def edit_client_endpoint(callback: CallbackQuery, state: FSMContext):
         f"Текущий Endpoint: {client.endpoint}\n\n"
         f"Введите новый IP-адрес или домен сервера:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+            InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
         ]])
     )
     await state.set_state(EditClientStates.waiting_new_endpoint)
@@ -1821,7 +2014,7 @@ async def process_new_client_endpoint(message: Message, state: FSMContext):
                          "❌ Endpoint не может быть пустым\n\n"
                          "Введите IP-адрес или домен сервера:",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+                        InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
                     ]])
                 )
             except:
@@ -1831,6 +2024,7 @@ async def process_new_client_endpoint(message: Message, state: FSMContext):
     old_endpoint = client.endpoint
     client.endpoint = new_endpoint
     success = await db.update_client(client)
+    get_artifact_cache().invalidate_owner(client_id)
     
     await state.clear()
     
@@ -1845,7 +2039,7 @@ async def process_new_client_endpoint(message: Message, state: FSMContext):
                          f"Новый Endpoint: {new_endpoint}\n\n"
                          f"⚠️ Клиенту потребуется новая конфигурация!",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                     ]])
                 )
             except:
@@ -1858,17 +2052,16 @@ async def process_new_client_endpoint(message: Message, state: FSMContext):
                     message_id=user_last_message[user_id],
                     text="❌ Ошибка при изменении Endpoint клиента",
                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                        InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                     ]])
                 )
             except:
                 pass
 
 # Редактирование срока действия клиента
-@admin_router.callback_query(F.data.startswith("edit_expiry:"))
-async def edit_client_expiry(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_expiry", client_id=int)
+async def edit_client_expiry(callback: CallbackQuery, client_id: int, state: FSMContext):
     """Редактирование срока действия клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -1890,12 +2083,9 @@ async def edit_client_expiry(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка выбора нового срока действия
-@admin_router.callback_query(F.data.startswith("edit_time_limit:"))
-async def process_edit_time_limit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_time_limit", client_id=int, time_limit=str)
+async def process_edit_time_limit(callback: CallbackQuery, client_id: int, time_limit: str, state: FSMContext):
     """Обработка выбора нового срока действия"""
-    parts = callback.data.split(":", 2)
-    client_id = int(parts[1])
-    time_limit = parts[2]
     
     client = await db.get_client(client_id)
     if not client:
@@ -1947,7 +2137,7 @@ async def process_edit_time_limit(callback: CallbackQuery, state: FSMContext):
             f"Старый срок: {old_expiry}\n"
             f"Новый срок: {new_expiry}",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
     else:
@@ -1955,19 +2145,16 @@ async def process_edit_time_limit(callback: CallbackQuery, state: FSMContext):
             callback,
             "❌ Ошибка при изменении срока действия",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
     
     await callback.answer()
 
 # Обработка выбора единиц времени для редактирования
-@admin_router.callback_query(F.data.startswith("edit_custom_time_unit:"))
-async def process_edit_custom_time_unit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_custom_time_unit", client_id=int, time_unit=("hours", "days", "weeks", "months", "years"))
+async def process_edit_custom_time_unit(callback: CallbackQuery, client_id: int, time_unit: str, state: FSMContext):
     """Обработка выбора единиц времени для редактирования"""
-    parts = callback.data.split(":", 2)
-    client_id = int(parts[1])
-    time_unit = parts[2]
     
     await state.update_data(edit_client_id=client_id, custom_time_unit=time_unit)
     
@@ -1983,7 +2170,7 @@ async def process_edit_custom_time_unit(callback: CallbackQuery, state: FSMConte
         callback,
         f"⏰ Введите количество {unit_names.get(time_unit, time_unit)}:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}")
+            InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id))
         ]])
     )
     
@@ -2058,7 +2245,7 @@ async def process_edit_custom_time_value(message: Message, state: FSMContext):
                              f"Старый срок: {old_expiry}\n"
                              f"Новый срок: {expires_at.strftime('%d.%m.%Y %H:%M')}",
                         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                            InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                            InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                         ]])
                     )
                 except:
@@ -2071,7 +2258,7 @@ async def process_edit_custom_time_value(message: Message, state: FSMContext):
                         message_id=user_last_message[user_id],
                         text="❌ Ошибка при изменении срока действия",
                         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                            InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                            InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                         ]])
                     )
                 except:
@@ -2093,10 +2280,9 @@ async def process_edit_custom_time_value(message: Message, state: FSMContext):
                 pass
 
 # Редактирование лимита трафика
-@admin_router.callback_query(F.data.startswith("edit_traffic_limit:"))
-async def edit_client_traffic(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_traffic_limit", client_id=int)
+async def edit_client_traffic(callback: CallbackQuery, client_id: int, state: FSMContext):
     """Редактирование лимита трафика клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -2121,12 +2307,9 @@ async def edit_client_traffic(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка выбора нового лимита трафика
-@admin_router.callback_query(F.data.startswith("edit_traffic_value:"))
-async def process_edit_traffic_limit(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_traffic_value", client_id=int, traffic_limit=str)
+async def process_edit_traffic_limit(callback: CallbackQuery, client_id: int, traffic_limit: str, state: FSMContext):
     """Обработка выбора нового лимита трафика"""
-    parts = callback.data.split(":", 2)
-    client_id = int(parts[1])
-    traffic_limit = parts[2]
     
     client = await db.get_client(client_id)
     if not client:
@@ -2160,7 +2343,7 @@ async def process_edit_traffic_limit(callback: CallbackQuery, state: FSMContext)
             f"Старый лимит: {old_traffic}\n"
             f"Новый лимит: {new_traffic}",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
     else:
@@ -2168,17 +2351,16 @@ async def process_edit_traffic_limit(callback: CallbackQuery, state: FSMContext)
             callback,
             "❌ Ошибка при изменении лимита трафика",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
     
     await callback.answer()
 
 # Перегенерация ключей
-@admin_router.callback_query(F.data.startswith("regenerate_keys:"))
-async def confirm_regenerate_keys(callback: CallbackQuery):
+@callbacks.route("regenerate_keys", client_id=int)
+async def confirm_regenerate_keys(callback: CallbackQuery, client_id: int):
     """Подтверждение перегенерации ключей"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -2195,17 +2377,16 @@ async def confirm_regenerate_keys(callback: CallbackQuery):
         f"• Потребуется выдать новую конфигурацию\n\n"
         f"Продолжить?",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_regenerate:{client_id}"),
-            InlineKeyboardButton(text="❌ Нет", callback_data=f"edit_client:{client_id}")
+            InlineKeyboardButton(text="✅ Да", callback_data=pack_callback("confirm_regenerate", client_id)),
+            InlineKeyboardButton(text="❌ Нет", callback_data=pack_callback("edit_client", client_id))
         ]])
     )
     await callback.answer()
 
 # Подтверждение перегенерации ключей
-@admin_router.callback_query(F.data.startswith("confirm_regenerate:"))
-async def regenerate_client_keys(callback: CallbackQuery):
+@callbacks.route("confirm_regenerate", client_id=int)
+async def regenerate_client_keys(callback: CallbackQuery, client_id: int):
     """Перегенерация ключей клиента"""
-    client_id = int(callback.data.split(":", 1)[1])
     client = await db.get_client(client_id)
     
     if not client:
@@ -2217,11 +2398,12 @@ async def regenerate_client_keys(callback: CallbackQuery):
     try:
         await awg_manager.remove_peer_from_server(client.public_key)
         
-        new_private_key, new_public_key = awg_manager.generate_keypair()
+        new_private_key, new_public_key = await awg_manager.generate_keypair_async()
         
         client.private_key = new_private_key
         client.public_key = new_public_key
         success = await db.update_client(client)
+        get_artifact_cache().invalidate_owner(client_id)
         
         if success:
             if not client.is_blocked:
@@ -2235,10 +2417,10 @@ async def regenerate_client_keys(callback: CallbackQuery):
                 f"⚠️ Старая конфигурация больше не работает!\n"
                 f"Выдайте клиенту новую конфигурацию.",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(text="📱 QR-код", callback_data=f"client_qr:{client_id}"),
-                    InlineKeyboardButton(text="📄 Конфигурация", callback_data=f"client_config:{client_id}")
+                    InlineKeyboardButton(text="📱 QR-код", callback_data=pack_callback("client_qr", client_id)),
+                    InlineKeyboardButton(text="📄 Конфигурация", callback_data=pack_callback("client_config", client_id))
                 ], [
-                    InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                    InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                 ]])
             )
         else:
@@ -2246,7 +2428,7 @@ async def regenerate_client_keys(callback: CallbackQuery):
                 callback,
                 "❌ Ошибка при сохранении новых ключей",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                    InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
                 ]])
             )
     except Exception as e:
@@ -2255,12 +2437,12 @@ async def regenerate_client_keys(callback: CallbackQuery):
             callback,
             "❌ Произошла ошибка при перегенерации ключей",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(text="🔙 К клиенту", callback_data=f"client_details:{client_id}")
+                InlineKeyboardButton(text="🔙 К клиенту", callback_data=pack_callback("client_details", client_id))
             ]])
         )
 
 # Создание резервной копии
-@admin_router.callback_query(F.data == "create_backup")
+@callbacks.route("create_backup")
 async def create_backup(callback: CallbackQuery):
     """Создание резервной копии"""
     await callback.answer("💾 Создаю резервную копию...")
@@ -2290,7 +2472,7 @@ async def create_backup(callback: CallbackQuery):
         )
 
 # Список резервных копий
-@admin_router.callback_query(F.data == "list_backups")
+@callbacks.route("list_backups")
 async def list_backups(callback: CallbackQuery):
     """Показать список резервных копий"""
     backups = await backup_service.list_backups() 
@@ -2312,10 +2494,9 @@ async def list_backups(callback: CallbackQuery):
     await callback.answer()
 
 # Детали резервной копии
-@admin_router.callback_query(F.data.startswith("backup_details:"))
-async def show_backup_details(callback: CallbackQuery):
+@callbacks.route("backup_details", backup_filename=str)
+async def show_backup_details(callback: CallbackQuery, backup_filename: str):
     """Показать детали резервной копии"""
-    backup_filename = callback.data.split(":", 1)[1]
     backups = await backup_service.list_backups()
     
     backup_info = None
@@ -2347,10 +2528,9 @@ async def show_backup_details(callback: CallbackQuery):
     await callback.answer()
 
 # Восстановление резервной копии
-@admin_router.callback_query(F.data.startswith("restore_backup:"))
-async def restore_backup_confirm(callback: CallbackQuery):
+@callbacks.route("restore_backup", backup_filename=str)
+async def restore_backup_confirm(callback: CallbackQuery, backup_filename: str):
     """Подтверждение восстановления резервной копии"""
-    backup_filename = callback.data.split(":", 1)[1]
     
     await edit_or_send_message(
         callback,
@@ -2363,17 +2543,16 @@ async def restore_backup_confirm(callback: CallbackQuery):
         f"• Настройки сервера будут заменены\n\n"
         f"Продолжить?",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_restore:{backup_filename}"),
-            InlineKeyboardButton(text="❌ Нет", callback_data=f"backup_details:{backup_filename}")
+            InlineKeyboardButton(text="✅ Да", callback_data=pack_callback("confirm_restore", backup_filename)),
+            InlineKeyboardButton(text="❌ Нет", callback_data=pack_callback("backup_details", backup_filename))
         ]])
     )
     await callback.answer()
 
 # Подтверждение восстановления
-@admin_router.callback_query(F.data.startswith("confirm_restore:"))
-async def confirm_restore_backup(callback: CallbackQuery):
+@callbacks.route("confirm_restore", backup_filename=str)
+async def confirm_restore_backup(callback: CallbackQuery, backup_filename: str):
     """Выполнить восстановление резервной копии"""
-    backup_filename = callback.data.split(":", 1)[1]
     
     await callback.answer("🔄 Восстанавливаю резервную копию...")
     
@@ -2403,10 +2582,9 @@ async def confirm_restore_backup(callback: CallbackQuery):
         )
 
 # Удаление резервной копии
-@admin_router.callback_query(F.data.startswith("delete_backup:"))
-async def delete_backup_confirm(callback: CallbackQuery):
+@callbacks.route("delete_backup", backup_filename=str)
+async def delete_backup_confirm(callback: CallbackQuery, backup_filename: str):
     """Подтверждение удаления резервной копии"""
-    backup_filename = callback.data.split(":", 1)[1]
     
     await edit_or_send_message(
         callback,
@@ -2415,17 +2593,16 @@ async def delete_backup_confirm(callback: CallbackQuery):
         f"{backup_filename}\n\n"
         f"⚠️ Это действие нельзя отменить!",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_delete_backup:{backup_filename}"),
-            InlineKeyboardButton(text="❌ Нет", callback_data=f"backup_details:{backup_filename}")
+            InlineKeyboardButton(text="✅ Да", callback_data=pack_callback("confirm_delete_backup", backup_filename)),
+            InlineKeyboardButton(text="❌ Нет", callback_data=pack_callback("backup_details", backup_filename))
         ]])
     )
     await callback.answer()
 
 # Подтверждение удаления резервной копии
-@admin_router.callback_query(F.data.startswith("confirm_delete_backup:"))
-async def confirm_delete_backup(callback: CallbackQuery):
+@callbacks.route("confirm_delete_backup", backup_filename=str)
+async def confirm_delete_backup(callback: CallbackQuery, backup_filename: str):
     """Выполнить удаление резервной копии"""
-    backup_filename = callback.data.split(":", 1)[1]
     
     try:
         success = await backup_service.delete_backup(backup_filename)
@@ -2452,7 +2629,7 @@ async def confirm_delete_backup(callback: CallbackQuery):
     await callback.answer()
 
 # Обработчик для неактивных кнопок
-@admin_router.callback_query(F.data == "noop")
+@callbacks.route("noop")
 async def noop_handler(callback: CallbackQuery):
     """Обработчик для неактивных кнопок"""
     await callback.answer()
\ No newline at end of file
@@ -0,0 +1,400 @@
+import html
+import logging
+
+from aiogram import Router
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from middlewares.outbound import outbound_lane, PRIORITY_BACKGROUND
+from services.bulk_service import BulkService, parse_client_filter
+from utils.callback_data import get_callback_registry, pack_callback
+from keyboards.main_keyboards import (
+    get_clients_menu, get_bulk_time_limit_keyboard, get_bulk_traffic_limit_keyboard,
+    get_bulk_action_keyboard
+)
+from .admin_handlers import (
+    awg_manager, config, settings_service, user_last_message,
+    edit_or_send_message, time_limit_to_expiry
+)
+
+bulk_router = Router()
+
+bulk_service = BulkService(config, awg_manager)
+callbacks = get_callback_registry()
+logger = logging.getLogger(__name__)
+
+
+class BulkCreateStates(StatesGroup):
+    """Состояния массового создания клиентов"""
+    waiting_spec = State()
+    waiting_ipv6_choice = State()
+    waiting_time_limit = State()
+    waiting_traffic_limit = State()
+
+
+class BulkActionStates(StatesGroup):
+    """Состояния массовых действий над клиентами"""
+    waiting_filter = State()
+    waiting_action = State()
+    waiting_confirm = State()
+
+
+# Названия массовых действий для подтверждения и отчета
+BULK_ACTION_NAMES = {
+    "block": "🔒 блокировка",
+    "unblock": "🔓 разблокировка",
+    "extend:7d": "⏱ продление на 7 дней",
+    "extend:30d": "⏱ продление на 30 дней",
+    "extend:90d": "⏱ продление на 90 дней",
+    "extend:365d": "⏱ продление на 1 год",
+    "delete": "🗑 удаление",
+}
+
+BULK_FILTER_HELP = (
+    "Условия через пробел (выполняться должны все):\n"
+    "<code>expired</code> - срок уже истек\n"
+    "<code>expires&lt;01.12.2026</code> - срок истекает до даты\n"
+    "<code>traffic&gt;80%</code> - израсходовано не меньше 80% лимита\n"
+    "<code>idle&gt;30d</code> - нет подключений больше 30 дней\n"
+    "<code>name:event</code> - имя начинается с event\n"
+    "<code>blocked</code> / <code>active</code> - заблокированные / незаблокированные\n"
+    "<code>all</code> - все клиенты\n\n"
+    "Например: <code>name:event idle&gt;14d</code>"
+)
+
+
+def get_bulk_cancel_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура отмены массового создания"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client"))
+    ]])
+
+
+@callbacks.route("bulk_add_clients")
+async def start_bulk_create(callback: CallbackQuery, state: FSMContext):
+    """Начать массовое создание клиентов"""
+    default_endpoint = await settings_service.get_default_endpoint()
+    if not default_endpoint:
+        await edit_or_send_message(
+            callback,
+            "📦 Массовое создание клиентов\n\n"
+            "❌ Сначала задайте endpoint по умолчанию в параметрах бота",
+            reply_markup=get_clients_menu()
+        )
+        await callback.answer()
+        return
+
+    await state.clear()
+    await state.update_data(endpoint=default_endpoint)
+    await edit_or_send_message(
+        callback,
+        f"📦 Массовое создание клиентов\n\n"
+        f"📡 Endpoint: {default_endpoint} (из настроек)\n\n"
+        f"Введите префикс имени и количество через пробел, например:\n"
+        f"<code>event 300</code>\n\n"
+        f"Клиенты получат имена event-001 ... event-300 (не больше {config.bulk_create_max} за раз).",
+        reply_markup=get_bulk_cancel_keyboard()
+    )
+    await state.set_state(BulkCreateStates.waiting_spec)
+    await callback.answer()
+
+
+@bulk_router.message(StateFilter(BulkCreateStates.waiting_spec))
+async def process_bulk_spec(message: Message, state: FSMContext):
+    """Обработка префикса и количества"""
+    user_id = message.from_user.id
+
+    try:
+        await message.delete()
+    except:
+        pass
+
+    error = None
+    parts = (message.text or "").split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        error = "❌ Ожидается префикс и количество через пробел"
+    else:
+        prefix, count = parts[0], int(parts[1])
+        names = BulkService.make_names(prefix, count) if 0 < count <= config.bulk_create_max else []
+        if not names:
+            error = f"❌ Количество должно быть от 1 до {config.bulk_create_max}"
+        elif len(prefix) < 2 or len(names[-1]) > 32:
+            error = "❌ Имена клиентов должны содержать от 2 до 32 символов"
+        elif not prefix.replace('-', '').replace('_', '').replace('.', '').isalnum():
+            error = "❌ Префикс может содержать только латинские буквы, цифры и символы - _ ."
+
+    if error:
+        if user_id in user_last_message:
+            try:
+                await message.bot.edit_message_text(
+                    chat_id=user_id,
+                    message_id=user_last_message[user_id],
+                    text=f"📦 Массовое создание клиентов\n\n{error}\n\n"
+                         f"Введите префикс имени и количество, например: <code>event 300</code>",
+                    reply_markup=get_bulk_cancel_keyboard()
+                )
+            except:
+                pass
+        return
+
+    await state.update_data(prefix=prefix, count=count)
+    summary = f"📦 Массовое создание клиентов\n\n✅ {names[0]} ... {names[-1]} ({count})\n\n"
+
+    if config.ipv6_enabled and config.server_ipv6_subnet:
+        text = summary + "Добавить IPv6?"
+        reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Да", callback_data=pack_callback("bulk_ipv6", "yes"))],
+            [InlineKeyboardButton(text="❌ Нет", callback_data=pack_callback("bulk_ipv6", "no"))],
+            [InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client"))]
+        ])
+        await state.set_state(BulkCreateStates.waiting_ipv6_choice)
+    else:
+        text = summary + "Выберите срок действия:"
+        reply_markup = get_bulk_time_limit_keyboard()
+        await state.set_state(BulkCreateStates.waiting_time_limit)
+
+    if user_id in user_last_message:
+        try:
+            await message.bot.edit_message_text(
+                chat_id=user_id,
+                message_id=user_last_message[user_id],
+                text=text,
+                reply_markup=reply_markup
+            )
+        except:
+            pass
+
+
+@callbacks.route("bulk_ipv6", state=BulkCreateStates.waiting_ipv6_choice, choice=("yes", "no"))
+async def process_bulk_ipv6(callback: CallbackQuery, choice: str, state: FSMContext):
+    """Обработка выбора IPv6"""
+    await state.update_data(has_ipv6=choice == "yes")
+    await edit_or_send_message(
+        callback,
+        "📦 Массовое создание клиентов\n\nВыберите срок действия:",
+        reply_markup=get_bulk_time_limit_keyboard()
+    )
+    await state.set_state(BulkCreateStates.waiting_time_limit)
+    await callback.answer()
+
+
+@callbacks.route("bulk_time", state=BulkCreateStates.waiting_time_limit, time_limit=str)
+async def process_bulk_time_limit(callback: CallbackQuery, time_limit: str, state: FSMContext):
+    """Обработка выбора срока действия"""
+    expires_at = time_limit_to_expiry(time_limit)
+    await state.update_data(expires_at=expires_at)
+
+    expires_text = "Без ограничений" if expires_at is None else expires_at.strftime('%d.%m.%Y %H:%M')
+    await edit_or_send_message(
+        callback,
+        f"📦 Массовое создание клиентов\n\n"
+        f"✅ Срок действия: {expires_text}\n\n"
+        f"Выберите ограничение трафика:",
+        reply_markup=get_bulk_traffic_limit_keyboard()
+    )
+    await state.set_state(BulkCreateStates.waiting_traffic_limit)
+    await callback.answer()
+
+
+@callbacks.route("bulk_traffic", state=BulkCreateStates.waiting_traffic_limit, traffic_limit=str)
+async def process_bulk_traffic_limit(callback: CallbackQuery, traffic_limit: str, state: FSMContext):
+    """Создание клиентов после выбора ограничения трафика"""
+    traffic_limit_bytes = None if traffic_limit == "unlimited" else int(traffic_limit) * 1024 * 1024 * 1024
+
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer()
+
+    async def report(text: str):
+        # Весь ход создания отображается в одном сообщении; промежуточные правки
+        # идут фоновой полосой и схлопываются, не задерживая ответы другим админам
+        with outbound_lane(PRIORITY_BACKGROUND):
+            await edit_or_send_message(callback, f"📦 Массовое создание клиентов\n\n{text}")
+
+    try:
+        result = await bulk_service.create_clients(
+            prefix=data["prefix"],
+            count=data["count"],
+            endpoint=data["endpoint"],
+            expires_at=data.get("expires_at"),
+            traffic_limit=traffic_limit_bytes,
+            with_ipv6=data.get("has_ipv6", False),
+            on_progress=report
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при массовом создании клиентов: {e}")
+        await edit_or_send_message(
+            callback,
+            "❌ Произошла ошибка при массовом создании клиентов",
+            reply_markup=get_clients_menu()
+        )
+        return
+
+    if result.error:
+        await edit_or_send_message(
+            callback,
+            f"📦 Массовое создание клиентов\n\n❌ {result.error}",
+            reply_markup=get_clients_menu()
+        )
+        return
+
+    traffic_text = "Без ограничений" if traffic_limit == "unlimited" else f"{traffic_limit} GB"
+    with_ipv6 = sum(1 for client in result.clients if client.has_ipv6)
+    ipv6_info = f"🌐 С IPv6: {with_ipv6}\n" if with_ipv6 else ""
+    await edit_or_send_message(
+        callback,
+        f"📦 Массовое создание клиентов\n\n"
+        f"✅ Создано клиентов: {len(result.clients)}\n"
+        f"👤 {html.escape(result.clients[0].name)} ... {html.escape(result.clients[-1].name)}\n"
+        f"📡 IP: {result.clients[0].ip_address} ... {result.clients[-1].ip_address}\n"
+        f"{ipv6_info}"
+        f"📊 Трафик: {traffic_text}\n\n"
+        f"Архив с конфигурациями и QR-кодами отправлен ниже.",
+        reply_markup=get_clients_menu()
+    )
+    await callback.bot.send_document(
+        chat_id=callback.from_user.id,
+        document=BufferedInputFile(result.archive, filename=result.archive_name),
+        caption=f"📦 Конфигурации и QR-коды ({len(result.clients)} клиентов)"
+    )
+
+
+@callbacks.route("bulk_actions")
+async def start_bulk_actions(callback: CallbackQuery, state: FSMContext):
+    """Начать массовое действие: запрос фильтра"""
+    await state.clear()
+    await edit_or_send_message(
+        callback,
+        f"🧰 Массовые действия\n\n{BULK_FILTER_HELP}",
+        reply_markup=get_bulk_cancel_keyboard()
+    )
+    await state.set_state(BulkActionStates.waiting_filter)
+    await callback.answer()
+
+
+@bulk_router.message(StateFilter(BulkActionStates.waiting_filter))
+async def process_bulk_filter(message: Message, state: FSMContext):
+    """Разбор фильтра и предпросмотр выбранных клиентов"""
+    user_id = message.from_user.id
+    expression = (message.text or "").strip()
+
+    try:
+        await message.delete()
+    except:
+        pass
+
+    try:
+        client_filter = parse_client_filter(expression)
+        clients = await bulk_service.select_clients(client_filter)
+    except ValueError as e:
+        # Текст ошибки повторяет ввод администратора - экранируем для HTML
+        text = f"🧰 Массовые действия\n\n❌ {html.escape(str(e))}\n\n{BULK_FILTER_HELP}"
+        reply_markup = get_bulk_cancel_keyboard()
+    else:
+        if clients:
+            names = html.escape(", ".join(client.name for client in clients[:10]))
+            more = f" и еще {len(clients) - 10}" if len(clients) > 10 else ""
+            text = (
+                f"🧰 Массовые действия\n\n"
+                f"🔎 Фильтр: {html.escape(client_filter.describe())}\n"
+                f"👥 Найдено клиентов: {len(clients)}\n"
+                f"{names}{more}\n\n"
+                f"Выберите действие:"
+            )
+            reply_markup = get_bulk_action_keyboard()
+            await state.update_data(filter=expression)
+            await state.set_state(BulkActionStates.waiting_action)
+        else:
+            text = (
+                f"🧰 Массовые действия\n\n"
+                f"🔎 Фильтр: {html.escape(client_filter.describe())}\n"
+                f"👥 Клиенты не найдены\n\n"
+                f"Введите другой фильтр:"
+            )
+            reply_markup = get_bulk_cancel_keyboard()
+
+    if user_id in user_last_message:
+        try:
+            await message.bot.edit_message_text(
+                chat_id=user_id,
+                message_id=user_last_message[user_id],
+                text=text,
+                reply_markup=reply_markup
+            )
+        except:
+            pass
+
+
+@callbacks.route("bulk_do", state=BulkActionStates.waiting_action, action=str)
+async def choose_bulk_action(callback: CallbackQuery, action: str, state: FSMContext):
+    """Подтверждение массового действия"""
+    if action not in BULK_ACTION_NAMES:
+        await callback.answer("❌ Неизвестное действие", show_alert=True)
+        return
+
+    data = await state.get_data()
+    client_filter = parse_client_filter(data["filter"])
+    # Количество пересчитывается: с момента предпросмотра клиенты могли измениться
+    clients = await bulk_service.select_clients(client_filter)
+
+    await state.update_data(action=action)
+    await state.set_state(BulkActionStates.waiting_confirm)
+    await edit_or_send_message(
+        callback,
+        f"🧰 Массовые действия\n\n"
+        f"🔎 Фильтр: {html.escape(client_filter.describe())}\n"
+        f"Действие: {BULK_ACTION_NAMES[action]}\n\n"
+        f"⚠️ Применить к {len(clients)} клиентам?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Применить", callback_data=pack_callback("bulk_confirm"))],
+            [InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client"))]
+        ])
+    )
+    await callback.answer()
+
+
+@callbacks.route("bulk_confirm", state=BulkActionStates.waiting_confirm)
+async def apply_bulk_action(callback: CallbackQuery, state: FSMContext):
+    """Применение массового действия с ходом выполнения в одном сообщении"""
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer()
+
+    action = data["action"]
+    title = f"🧰 Массовые действия: {BULK_ACTION_NAMES[action]}"
+
+    async def report(text: str):
+        with outbound_lane(PRIORITY_BACKGROUND):
+            await edit_or_send_message(callback, f"{title}\n\n{text}")
+
+    try:
+        await report("🔎 Отбор клиентов...")
+        clients = await bulk_service.select_clients(parse_client_filter(data["filter"]))
+        result = await bulk_service.apply_action(action, clients, on_progress=report)
+    except Exception as e:
+        logger.error(f"Ошибка при массовом действии {action}: {e}")
+        await edit_or_send_message(
+            callback,
+            f"{title}\n\n❌ Произошла ошибка при выполнении действия",
+            reply_markup=get_clients_menu()
+        )
+        return
+
+    if result.error:
+        text = (
+            f"{title}\n\n"
+            f"❌ {result.error}\n"
+            f"👥 Отобрано: {result.matched}\n"
+            f"✏️ Изменено: {result.changed}"
+        )
+    else:
+        text = (
+            f"{title}\n\n"
+            f"✅ Готово\n"
+            f"👥 Отобрано: {result.matched}\n"
+            f"✏️ Изменено: {result.changed}"
+        )
+    await edit_or_send_message(callback, text, reply_markup=get_clients_menu())
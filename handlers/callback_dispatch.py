@@ -0,0 +1,30 @@
+import logging
+from typing import Any, Optional
+
+from aiogram import Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+from utils.callback_data import CallbackRoute
+
+callback_router = Router()
+logger = logging.getLogger(__name__)
+
+
+@callback_router.callback_query()
+async def dispatch_callback(callback: CallbackQuery, callback_route: Optional[CallbackRoute],
+                            state: FSMContext, **data: Any):
+    """Единственный обработчик нажатий: вызов обработчика действия из реестра"""
+    if callback_route is None:
+        # Устаревшая или подделанная кнопка - отказ до любой работы с БД
+        logger.warning(f"Некорректные данные кнопки от {callback.from_user.id}: {callback.data!r}")
+        await callback.answer("⚠️ Кнопка устарела, откройте меню заново")
+        return
+
+    entry = callback_route.entry
+    if entry.state is not None and await state.get_state() != entry.state:
+        # Кнопка из завершенного диалога
+        await callback.answer()
+        return
+
+    return await entry.handler.call(callback, **{**data, 'state': state, **callback_route.args})
@@ -1,8 +1,9 @@
-import re
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from typing import List, Optional, Dict
 from database.database import Client
+from utils.traffic_parser import parse_handshake_seconds
+from utils.callback_data import pack_callback
 
 
 def parse_handshake_to_days(handshake_str: str) -> Optional[float]:
@@ -11,28 +12,8 @@ def parse_handshake_to_days(handshake_str: str) -> Optional[float]:
     Примеры: "2 minutes, 30 seconds ago", "1 hour, 5 minutes ago", "3 days, 2 hours ago"
     Возвращает None если никогда не подключался или ошибка парсинга.
     """
-    if not handshake_str or handshake_str.lower() in ('never', 'никогда', ''):
-        return None
-
-    total_seconds = 0
-
-    # Ищем все числа с единицами времени
-    patterns = [
-        (r'(\d+)\s*(?:second|секунд)', 1),
-        (r'(\d+)\s*(?:minute|минут)', 60),
-        (r'(\d+)\s*(?:hour|час)', 3600),
-        (r'(\d+)\s*(?:day|д[нея])', 86400),
-        (r'(\d+)\s*(?:week|недел)', 604800),
-        (r'(\d+)\s*(?:month|месяц)', 2592000),
-        (r'(\d+)\s*(?:year|год|лет)', 31536000),
-    ]
-
-    for pattern, multiplier in patterns:
-        match = re.search(pattern, handshake_str, re.IGNORECASE)
-        if match:
-            total_seconds += int(match.group(1)) * multiplier
-
-    if total_seconds == 0:
+    total_seconds = parse_handshake_seconds(handshake_str)
+    if total_seconds is None:
         return None
 
     return total_seconds / 86400  # конвертируем в дни
@@ -150,6 +131,14 @@ def get_clients_menu() -> InlineKeyboardMarkup:
         text="🔍 Поиск клиента", 
         callback_data="search_client"
     ))
+    builder.add(InlineKeyboardButton(
+        text="📦 Массовое создание",
+        callback_data="bulk_add_clients"
+    ))
+    builder.add(InlineKeyboardButton(
+        text="🧰 Массовые действия",
+        callback_data="bulk_actions"
+    ))
     builder.add(InlineKeyboardButton(
         text="🔙 Главное меню",
         callback_data="main_menu"
@@ -161,11 +150,16 @@ def get_client_list_keyboard(
     clients: List[Client],
     page: int = 0,
     per_page: int = 10,
-    stats: Optional[Dict[str, Dict]] = None
+    stats: Optional[Dict[str, Dict]] = None,
+    total: Optional[int] = None,
+    page_callback: str = "clients_page"
 ) -> InlineKeyboardMarkup:
     """
     Клавиатура со списком клиентов с улучшенной пагинацией.
 
+    Если передан total, clients - уже выбранная страница из total клиентов
+    (например, результаты поиска), иначе страница вырезается из полного списка.
+
     Эмодзи активности:
     🔴 - заблокирован или неактивен
     🟢 - подключался в последние 7 дней
@@ -176,40 +170,42 @@ def get_client_list_keyboard(
     builder = InlineKeyboardBuilder()
     stats = stats or {}
 
-    start_idx = page * per_page
-    end_idx = start_idx + per_page
-    page_clients = clients[start_idx:end_idx]
+    if total is None:
+        total = len(clients)
+        page_clients = clients[page * per_page:(page + 1) * per_page]
+    else:
+        page_clients = clients
 
     for client in page_clients:
         client_stats = stats.get(client.public_key)
         status_emoji = get_activity_emoji(client, client_stats)
         builder.add(InlineKeyboardButton(
             text=f"{status_emoji} {client.name}",
-            callback_data=f"client_details:{client.id}"
+            callback_data=pack_callback("client_details", client.id)
         ))
 
     # Навигация по страницам
     nav_buttons = []
-    total_pages = (len(clients) - 1) // per_page + 1
+    total_pages = (total - 1) // per_page + 1
 
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(
             text="⏪ Первая",
-            callback_data="clients_page:0"
+            callback_data=pack_callback(page_callback, 0)
         ))
         nav_buttons.append(InlineKeyboardButton(
             text="◀️ Назад",
-            callback_data=f"clients_page:{page-1}"
+            callback_data=pack_callback(page_callback, page-1)
         ))
 
     if page < total_pages - 1:
         nav_buttons.append(InlineKeyboardButton(
             text="Вперед ▶️",
-            callback_data=f"clients_page:{page+1}"
+            callback_data=pack_callback(page_callback, page+1)
         ))
         nav_buttons.append(InlineKeyboardButton(
             text="Последняя ⏩",
-            callback_data=f"clients_page:{total_pages-1}"
+            callback_data=pack_callback(page_callback, total_pages-1)
         ))
 
     if len(nav_buttons) == 2:
@@ -233,31 +229,31 @@ def get_client_details_keyboard(client_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(
         text="📝 Редактировать",
-        callback_data=f"edit_client:{client_id}"
+        callback_data=pack_callback("edit_client", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🔒 Заблокировать/Разблокировать",
-        callback_data=f"toggle_block:{client_id}"
+        callback_data=pack_callback("toggle_block", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📊 Статистика",
-        callback_data=f"client_stats:{client_id}"
+        callback_data=pack_callback("client_stats", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📱 QR-код",
-        callback_data=f"client_qr:{client_id}"
+        callback_data=pack_callback("client_qr", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📄 Конфигурация",
-        callback_data=f"client_config:{client_id}"
+        callback_data=pack_callback("client_config", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🌍 IP Соединения",
-        callback_data=f"client_ip_info:{client_id}"
+        callback_data=pack_callback("client_ip_info", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🗑️ Удалить",
-        callback_data=f"delete_client:{client_id}"
+        callback_data=pack_callback("delete_client", client_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🔙 Список клиентов",
@@ -340,6 +336,48 @@ def get_traffic_limit_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2, 2, 1, 1)
     return builder.as_markup()
 
+def get_bulk_time_limit_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора срока действия при массовом создании"""
+    builder = InlineKeyboardBuilder()
+    
+    builder.add(InlineKeyboardButton(text="📅 1 день", callback_data=pack_callback("bulk_time", "1d")))
+    builder.add(InlineKeyboardButton(text="📅 3 дня", callback_data=pack_callback("bulk_time", "3d")))
+    builder.add(InlineKeyboardButton(text="📅 7 дней", callback_data=pack_callback("bulk_time", "7d")))
+    
+    builder.add(InlineKeyboardButton(text="🗓️ 1 месяц", callback_data=pack_callback("bulk_time", "1m")))
+    builder.add(InlineKeyboardButton(text="📆 3 месяца", callback_data=pack_callback("bulk_time", "3m")))
+    builder.add(InlineKeyboardButton(text="📆 1 год", callback_data=pack_callback("bulk_time", "1y")))
+    
+    builder.add(InlineKeyboardButton(text="♾️ Без ограничений", callback_data=pack_callback("bulk_time", "unlimited")))
+    builder.add(InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client")))
+    
+    builder.adjust(3, 3, 1, 1)
+    return builder.as_markup()
+
+def get_bulk_traffic_limit_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора ограничения трафика при массовом создании"""
+    builder = InlineKeyboardBuilder()
+    for gb in (5, 10, 30, 100):
+        builder.add(InlineKeyboardButton(text=f"📊 {gb} GB", callback_data=pack_callback("bulk_traffic", gb)))
+    builder.add(InlineKeyboardButton(text="♾️ Без ограничений", callback_data=pack_callback("bulk_traffic", "unlimited")))
+    builder.add(InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client")))
+    builder.adjust(2, 2, 1, 1)
+    return builder.as_markup()
+
+def get_bulk_action_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора массового действия над отобранными клиентами"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🔒 Заблокировать", callback_data=pack_callback("bulk_do", "block")))
+    builder.add(InlineKeyboardButton(text="🔓 Разблокировать", callback_data=pack_callback("bulk_do", "unblock")))
+    builder.add(InlineKeyboardButton(text="⏱ +7 дней", callback_data=pack_callback("bulk_do", "extend:7d")))
+    builder.add(InlineKeyboardButton(text="⏱ +30 дней", callback_data=pack_callback("bulk_do", "extend:30d")))
+    builder.add(InlineKeyboardButton(text="⏱ +90 дней", callback_data=pack_callback("bulk_do", "extend:90d")))
+    builder.add(InlineKeyboardButton(text="⏱ +1 год", callback_data=pack_callback("bulk_do", "extend:365d")))
+    builder.add(InlineKeyboardButton(text="🗑 Удалить", callback_data=pack_callback("bulk_do", "delete")))
+    builder.add(InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("cancel_add_client")))
+    builder.adjust(2, 2, 2, 1, 1)
+    return builder.as_markup()
+
 def get_backup_menu() -> InlineKeyboardMarkup:
     """Меню резервных копий"""
     builder = InlineKeyboardBuilder()
@@ -364,7 +402,7 @@ def get_backup_list_keyboard(backups: list) -> InlineKeyboardMarkup:
     for backup in backups[:10]: 
         builder.add(InlineKeyboardButton(
             text=f"📦 {backup['filename']}",
-            callback_data=f"backup_details:{backup['filename']}"
+            callback_data=pack_callback("backup_details", backup['filename'])
         ))
     builder.add(InlineKeyboardButton(
         text="🔙 Меню копий",
@@ -378,11 +416,11 @@ def get_backup_details_keyboard(filename: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(
         text="🔄 Восстановить",
-        callback_data=f"restore_backup:{filename}"
+        callback_data=pack_callback("restore_backup", filename)
     ))
     builder.add(InlineKeyboardButton(
         text="🗑️ Удалить",
-        callback_data=f"delete_backup:{filename}"
+        callback_data=pack_callback("delete_backup", filename)
     ))
     builder.add(InlineKeyboardButton(
         text="🔙 Список копий",
@@ -396,11 +434,11 @@ def get_confirmation_keyboard(action: str, item_id: str) -> InlineKeyboardMarkup
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(
         text="✅ Да",
-        callback_data=f"confirm:{action}:{item_id}"
+        callback_data=pack_callback("confirm", action, item_id)
     ))
     builder.add(InlineKeyboardButton(
         text="❌ Нет",
-        callback_data=f"cancel:{action}"
+        callback_data=pack_callback("cancel", action)
     ))
     builder.adjust(2)
     return builder.as_markup()
@@ -411,32 +449,32 @@ def get_edit_client_keyboard(client_id: int) -> InlineKeyboardMarkup:
     
     builder.add(InlineKeyboardButton(
         text="📝 Изменить имя",
-        callback_data=f"edit_name:{client_id}"
+        callback_data=pack_callback("edit_name", client_id)
     ))
     
     builder.add(InlineKeyboardButton(
         text="📡 Изменить Endpoint",
-        callback_data=f"edit_endpoint:{client_id}"
+        callback_data=pack_callback("edit_endpoint", client_id)
     ))
     
     builder.add(InlineKeyboardButton(
         text="⏰ Изменить срок действия",
-        callback_data=f"edit_expiry:{client_id}"
+        callback_data=pack_callback("edit_expiry", client_id)
     ))
     
     builder.add(InlineKeyboardButton(
         text="📊 Изменить лимит трафика",
-        callback_data=f"edit_traffic_limit:{client_id}"
+        callback_data=pack_callback("edit_traffic_limit", client_id)
     ))
     
     builder.add(InlineKeyboardButton(
         text="🔄 Перегенерировать ключи",
-        callback_data=f"regenerate_keys:{client_id}"
+        callback_data=pack_callback("regenerate_keys", client_id)
     ))
     
     builder.add(InlineKeyboardButton(
         text="🔙 Назад к клиенту",
-        callback_data=f"client_details:{client_id}"
+        callback_data=pack_callback("client_details", client_id)
     ))
     
     builder.adjust(2, 2, 1, 1)
@@ -447,28 +485,28 @@ def get_time_limit_keyboard_for_edit(client_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     # Часы
-    builder.add(InlineKeyboardButton(text="⏱️ 1 час", callback_data=f"edit_time_limit:{client_id}:1h"))
-    builder.add(InlineKeyboardButton(text="⏱️ 6 часов", callback_data=f"edit_time_limit:{client_id}:6h"))
-    builder.add(InlineKeyboardButton(text="⏱️ 12 часов", callback_data=f"edit_time_limit:{client_id}:12h"))
+    builder.add(InlineKeyboardButton(text="⏱️ 1 час", callback_data=pack_callback("edit_time_limit", client_id, "1h")))
+    builder.add(InlineKeyboardButton(text="⏱️ 6 часов", callback_data=pack_callback("edit_time_limit", client_id, "6h")))
+    builder.add(InlineKeyboardButton(text="⏱️ 12 часов", callback_data=pack_callback("edit_time_limit", client_id, "12h")))
     
     # Дни
-    builder.add(InlineKeyboardButton(text="📅 1 день", callback_data=f"edit_time_limit:{client_id}:1d"))
-    builder.add(InlineKeyboardButton(text="📅 3 дня", callback_data=f"edit_time_limit:{client_id}:3d"))
-    builder.add(InlineKeyboardButton(text="📅 7 дней", callback_data=f"edit_time_limit:{client_id}:7d"))
+    builder.add(InlineKeyboardButton(text="📅 1 день", callback_data=pack_callback("edit_time_limit", client_id, "1d")))
+    builder.add(InlineKeyboardButton(text="📅 3 дня", callback_data=pack_callback("edit_time_limit", client_id, "3d")))
+    builder.add(InlineKeyboardButton(text="📅 7 дней", callback_data=pack_callback("edit_time_limit", client_id, "7d")))
     
     # Недели
-    builder.add(InlineKeyboardButton(text="🗓️ 2 недели", callback_data=f"edit_time_limit:{client_id}:2w"))
-    builder.add(InlineKeyboardButton(text="🗓️ 1 месяц", callback_data=f"edit_time_limit:{client_id}:1m"))
+    builder.add(InlineKeyboardButton(text="🗓️ 2 недели", callback_data=pack_callback("edit_time_limit", client_id, "2w")))
+    builder.add(InlineKeyboardButton(text="🗓️ 1 месяц", callback_data=pack_callback("edit_time_limit", client_id, "1m")))
     
     # Месяцы и годы
-    builder.add(InlineKeyboardButton(text="📆 3 месяца", callback_data=f"edit_time_limit:{client_id}:3m"))
-    builder.add(InlineKeyboardButton(text="📆 6 месяцев", callback_data=f"edit_time_limit:{client_id}:6m"))
-    builder.add(InlineKeyboardButton(text="📆 1 год", callback_data=f"edit_time_limit:{client_id}:1y"))
+    builder.add(InlineKeyboardButton(text="📆 3 месяца", callback_data=pack_callback("edit_time_limit", client_id, "3m")))
+    builder.add(InlineKeyboardButton(text="📆 6 месяцев", callback_data=pack_callback("edit_time_limit", client_id, "6m")))
+    builder.add(InlineKeyboardButton(text="📆 1 год", callback_data=pack_callback("edit_time_limit", client_id, "1y")))
     
-    builder.add(InlineKeyboardButton(text="⏰ Свой срок", callback_data=f"edit_time_limit:{client_id}:custom"))
-    builder.add(InlineKeyboardButton(text="♾️ Без ограничений", callback_data=f"edit_time_limit:{client_id}:unlimited"))
+    builder.add(InlineKeyboardButton(text="⏰ Свой срок", callback_data=pack_callback("edit_time_limit", client_id, "custom")))
+    builder.add(InlineKeyboardButton(text="♾️ Без ограничений", callback_data=pack_callback("edit_time_limit", client_id, "unlimited")))
     
-    builder.add(InlineKeyboardButton(text="🔙 Отмена", callback_data=f"edit_client:{client_id}"))
+    builder.add(InlineKeyboardButton(text="🔙 Отмена", callback_data=pack_callback("edit_client", client_id)))
     
     builder.adjust(3, 3, 2, 2, 1, 1, 1)
     return builder.as_markup()
@@ -477,13 +515,13 @@ def get_custom_time_keyboard_for_edit(client_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для выбора единиц времени при редактировании"""
     builder = InlineKeyboardBuilder()
     
-    builder.add(InlineKeyboardButton(text="⏱️ В часах", callback_data=f"edit_custom_time_unit:{client_id}:hours"))
-    builder.add(InlineKeyboardButton(text="📅 В днях", callback_data=f"edit_custom_time_unit:{client_id}:days"))
-    builder.add(InlineKeyboardButton(text="🗓️ В неделях", callback_data=f"edit_custom_time_unit:{client_id}:weeks"))
-    builder.add(InlineKeyboardButton(text="📆 В месяцах", callback_data=f"edit_custom_time_unit:{client_id}:months"))
-    builder.add(InlineKeyboardButton(text="🗓️ В годах", callback_data=f"edit_custom_time_unit:{client_id}:years"))
+    builder.add(InlineKeyboardButton(text="⏱️ В часах", callback_data=pack_callback("edit_custom_time_unit", client_id, "hours")))
+    builder.add(InlineKeyboardButton(text="📅 В днях", callback_data=pack_callback("edit_custom_time_unit", client_id, "days")))
+    builder.add(InlineKeyboardButton(text="🗓️ В неделях", callback_data=pack_callback("edit_custom_time_unit", client_id, "weeks")))
+    builder.add(InlineKeyboardButton(text="📆 В месяцах", callback_data=pack_callback("edit_custom_time_unit", client_id, "months")))
+    builder.add(InlineKeyboardButton(text="🗓️ В годах", callback_data=pack_callback("edit_custom_time_unit", client_id, "years")))
     
-    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data=f"edit_expiry:{client_id}"))
+    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data=pack_callback("edit_expiry", client_id)))
     
     builder.adjust(2, 2, 1, 1)
     return builder.as_markup()
@@ -494,28 +532,28 @@ def get_traffic_limit_keyboard_for_edit(client_id: int) -> InlineKeyboardMarkup:
     
     builder.add(InlineKeyboardButton(
         text="📊 5 GB",
-        callback_data=f"edit_traffic_value:{client_id}:5"
+        callback_data=pack_callback("edit_traffic_value", client_id, "5")
     ))
     builder.add(InlineKeyboardButton(
         text="📊 10 GB",
-        callback_data=f"edit_traffic_value:{client_id}:10"
+        callback_data=pack_callback("edit_traffic_value", client_id, "10")
     ))
     builder.add(InlineKeyboardButton(
         text="📊 30 GB",
-        callback_data=f"edit_traffic_value:{client_id}:30"
+        callback_data=pack_callback("edit_traffic_value", client_id, "30")
     ))
     builder.add(InlineKeyboardButton(
         text="📊 100 GB",
-        callback_data=f"edit_traffic_value:{client_id}:100"
+        callback_data=pack_callback("edit_traffic_value", client_id, "100")
     ))
     builder.add(InlineKeyboardButton(
         text="♾️ Без ограничений",
-        callback_data=f"edit_traffic_value:{client_id}:unlimited"
+        callback_data=pack_callback("edit_traffic_value", client_id, "unlimited")
     ))
     
     builder.add(InlineKeyboardButton(
         text="🔙 Отмена",
-        callback_data=f"edit_client:{client_id}"
+        callback_data=pack_callback("edit_client", client_id)
     ))
     
     builder.adjust(2, 2, 1, 1)
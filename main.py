@@ -1,20 +1,37 @@
 import asyncio
 import logging
 import sys
+import time
 from datetime import datetime
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from config import Config
-from handlers import admin_router
+from handlers import admin_router, bulk_router, callback_router
 from middlewares.auth import AuthMiddleware
+from middlewares.callback_route import CallbackRouteMiddleware
+from middlewares.instrumentation import InstrumentationMiddleware, TelegramLatencyMiddleware
+from middlewares.outbound import get_outbound_scheduler
+from middlewares.render import get_render_fingerprints
 from database.database import init_db, get_db
+from database.ip_connections import get_ip_connection_writer
+from database.session_storage import SQLiteStorage, get_last_message_tracker
 from services.awg_manager import AWGManager
+from services.settings_service import SettingsService
+from services.ip_service import get_ip_service
+from services.metrics_server import MetricsServer
+from services.webhook_server import run_webhook
 from utils.traffic_parser import parse_traffic_size
+from utils.vpn_converter import get_endpoint_resolver
+from utils.artifact_cache import get_artifact_cache
+from utils.geo_cache import get_geo_cache
+from utils.qr_generator import configure_qr_rendering
+from utils.workers import configure_worker_pools, shutdown_worker_pools
+from utils.callback_data import get_callback_registry
+from utils.instrumentation import get_instrumentation
 
-async def update_client_traffic_usage_main(client, stats, awg_manager, db):
-    """Обновление использования трафика клиента из статистики AWG"""
+def apply_client_traffic_usage(client, stats) -> None:
+    """Перенос использованного трафика из статистики AWG в объект клиента (без записи в БД)"""
     if not stats:
         return
 
@@ -24,11 +41,7 @@ async def update_client_traffic_usage_main(client, stats, awg_manager, db):
 
         rx_bytes = parse_traffic_size(rx_str)
         tx_bytes = parse_traffic_size(tx_str)
-        total_bytes = rx_bytes + tx_bytes
-
-        if total_bytes != client.traffic_used:
-            client.traffic_used = total_bytes
-            await db.update_client(client)
+        client.traffic_used = rx_bytes + tx_bytes
 
     except Exception as e:
         logging.error(f"Ошибка при парсинге трафика: {e}")
@@ -48,6 +61,7 @@ async def check_client_limits():
     while True:
         try:
             logger.info("Проверка лимитов клиентов...")
+            sweep_started = time.perf_counter()
 
             # Проверка истекших клиентов
             expired_clients = await db.get_expired_clients()
@@ -62,36 +76,44 @@ async def check_client_limits():
                     else:
                         logger.error(f"Не удалось заблокировать клиента {client.name} на сервере AWG")
 
-            # Обновление статистики трафика
+            # Обновление статистики трафика: клиенты читаются потоково, изменения пишутся пакетами
             stats = await awg_manager.get_interface_stats()
-            all_clients = await db.get_all_clients()
-
-            for client in all_clients:
-                if client.public_key in stats:
-                    client_stats = stats[client.public_key]
-                    old_traffic = client.traffic_used
-
-                    await update_client_traffic_usage_main(client, client_stats, awg_manager, db)
-
-                    updated_client = await db.get_client(client.id)
-                    if updated_client.traffic_used != old_traffic:
-                        logger.debug(f"Трафик клиента {client.name} обновлен: {old_traffic} -> {updated_client.traffic_used}")
-
-                    # Проверка превышения лимита трафика
-                    if (updated_client.traffic_limit and
-                        isinstance(updated_client.traffic_limit, int) and
-                        updated_client.traffic_used >= updated_client.traffic_limit and
-                        not updated_client.is_blocked and updated_client.is_active):
-
-                        # Удаляем peer с сервера AWG
-                        success = await awg_manager.remove_peer_from_server(updated_client.public_key)
-                        if success:
-                            updated_client.is_blocked = True
-                            await db.update_client(updated_client)
-                            logger.info(f"Клиент {updated_client.name} заблокирован: превышен лимит трафика ({updated_client.traffic_used}/{updated_client.traffic_limit})")
-                        else:
-                            logger.error(f"Не удалось заблокировать клиента {updated_client.name} на сервере AWG")
+            changed = []
+
+            async for client in db.iter_clients(batch_size=config.client_sweep_batch_size):
+                client_stats = stats.get(client.public_key)
+                if not client_stats:
+                    continue
+
+                old_traffic = client.traffic_used
+                apply_client_traffic_usage(client, client_stats)
+                if client.traffic_used != old_traffic:
+                    logger.debug(f"Трафик клиента {client.name} обновлен: {old_traffic} -> {client.traffic_used}")
 
+                # Проверка превышения лимита трафика
+                if (client.traffic_limit and
+                    isinstance(client.traffic_limit, int) and
+                    client.traffic_used >= client.traffic_limit and
+                    not client.is_blocked and client.is_active):
+
+                    # Удаляем peer с сервера AWG
+                    success = await awg_manager.remove_peer_from_server(client.public_key)
+                    if success:
+                        client.is_blocked = True
+                        logger.info(f"Клиент {client.name} заблокирован: превышен лимит трафика ({client.traffic_used}/{client.traffic_limit})")
+                    else:
+                        logger.error(f"Не удалось заблокировать клиента {client.name} на сервере AWG")
+
+                if client.dirty_fields:
+                    changed.append(client)
+                    if len(changed) >= config.client_sweep_batch_size:
+                        await db.update_clients_batch(changed)
+                        changed = []
+
+            if changed:
+                await db.update_clients_batch(changed)
+
+            get_instrumentation().record_sweep(time.perf_counter() - sweep_started)
             consecutive_errors = 0
             await asyncio.sleep(300)
 
@@ -99,6 +121,7 @@ async def check_client_limits():
             raise
         except Exception as e:
             consecutive_errors += 1
+            get_instrumentation().record_sweep(time.perf_counter() - sweep_started, error=True)
             logger.error(f"Ошибка в проверке лимитов (попытка {consecutive_errors}/{max_consecutive_errors}): {e}")
 
             if consecutive_errors >= max_consecutive_errors:
@@ -128,12 +151,62 @@ async def main():
         logger.error("BOT_TOKEN не найден в конфигурации")
         sys.exit(1)
     
+    # Метрики обработки обновлений, запросов к БД и subprocess
+    instrumentation = get_instrumentation()
+    instrumentation.configure(slow_update_ms=config.slow_update_ms)
+    
     # Инициализация базы данных с пулом соединений
     await init_db()
     logger.info("База данных инициализирована")
     
     # Получаем экземпляр базы данных для последующего закрытия
     db = get_db()
+    db.pool.on_release = instrumentation.record_db_query
+
+    # Буферизированная запись IP-подключений
+    ip_writer = get_ip_connection_writer()
+    ip_writer.start(
+        flush_interval=config.ip_log_flush_interval,
+        max_pending=config.ip_log_max_pending
+    )
+    
+    # Последние сообщения пользователям: загрузка сохраненных и отложенная запись
+    last_messages = get_last_message_tracker()
+    await last_messages.load(ttl=config.last_message_ttl)
+    last_messages.start(flush_interval=config.session_flush_interval)
+    
+    # Кэш DNS endpoint для vpn:// и предварительное разрешение endpoint по умолчанию
+    resolver = get_endpoint_resolver()
+    resolver.configure(
+        ttl=config.dns_cache_ttl,
+        negative_ttl=config.dns_negative_ttl,
+        timeout=config.dns_resolve_timeout
+    )
+    default_endpoint = await SettingsService().get_default_endpoint()
+    if default_endpoint:
+        await resolver.resolve(default_endpoint.strip())
+    
+    # Кэш геолокации IP: параметры и удаление истекших записей
+    geo_cache = get_geo_cache()
+    geo_cache.configure(
+        ttl=config.geo_cache_ttl,
+        negative_ttl=config.geo_negative_ttl,
+        max_memory_entries=config.geo_cache_memory_entries
+    )
+    await geo_cache.evict()
+    
+    # Локальная база геолокации (если настроена) и проверка ее обновлений
+    get_ip_service(config).start()
+    
+    configure_qr_rendering(config.qr_backend, config.qr_box_size)
+    get_artifact_cache().configure(
+        max_bytes=config.artifact_cache_max_bytes,
+        spill_dir=config.artifact_spill_dir,
+        max_spill_bytes=config.artifact_spill_max_bytes
+    )
+    
+    # Пулы рендеринга, криптографии и архивов
+    configure_worker_pools(config)
     
     awg_manager = AWGManager(config)
     if not await awg_manager.check_awg_available():
@@ -145,12 +218,43 @@ async def main():
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    storage = MemoryStorage()
+    # Пропуск правок без изменений (до очереди, чтобы они не занимали лимиты)
+    bot.session.middleware(get_render_fingerprints())
+    
+    # Очередь исходящих запросов с учетом лимитов Telegram
+    outbound = get_outbound_scheduler()
+    outbound.configure(
+        global_rate=config.tg_global_rate,
+        chat_rate=config.tg_chat_rate,
+        chat_burst=config.tg_chat_burst,
+        group_rate=config.tg_group_rate,
+        max_retries=config.tg_max_retries
+    )
+    bot.session.middleware(outbound)
+    # Задержка самих запросов к Bot API (после очереди)
+    bot.session.middleware(TelegramLatencyMiddleware(instrumentation))
+    
+    # Состояния диалогов в БД: переживают перезапуск, брошенные удаляются по TTL
+    storage = SQLiteStorage(db, ttl=config.fsm_state_ttl)
+    storage.start(flush_interval=config.session_flush_interval)
     dp = Dispatcher(storage=storage)
     
     dp.message.middleware(AuthMiddleware(config.admin_ids))
     dp.callback_query.middleware(AuthMiddleware(config.admin_ids))
+    # Нажатия кнопок разбираются один раз и маршрутизируются по словарю действий
+    dp.callback_query.outer_middleware(CallbackRouteMiddleware(get_callback_registry()))
+    # Метрики по маршрутам (после разбора нажатия - маршрутом служит действие)
+    dp.message.outer_middleware(InstrumentationMiddleware(instrumentation))
+    dp.callback_query.outer_middleware(InstrumentationMiddleware(instrumentation))
     dp.include_router(admin_router)
+    dp.include_router(bulk_router)
+    dp.include_router(callback_router)
+    
+    # Эндпоинт метрик Prometheus (по умолчанию отключен)
+    metrics_server = None
+    if config.metrics_port:
+        metrics_server = MetricsServer(config, instrumentation, peer_page_size=config.metrics_peer_page_size)
+        await metrics_server.start(config.metrics_host, config.metrics_port)
     
     logger.info("Бот запущен")
     
@@ -159,7 +263,12 @@ async def main():
     logger.info("Фоновая задача проверки лимитов запущена")
     
     try:
-        await dp.start_polling(bot)
+        if config.webhook_url:
+            await run_webhook(dp, bot, config)
+        else:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot, tasks_concurrency_limit=config.update_concurrency)
     except (KeyboardInterrupt, SystemExit):
         logger.info("Получен сигнал завершения работы")
     finally:
@@ -172,13 +281,32 @@ async def main():
         except asyncio.CancelledError:
             logger.info("Фоновая задача остановлена")
         
-        # Закрытие сессии бота
+        if metrics_server is not None:
+            await metrics_server.stop()
+        
+        # Остановка очереди исходящих запросов и закрытие сессии бота
+        await outbound.close()
         await bot.session.close()
         logger.info("Сессия бота закрыта")
+
+        # Закрытие HTTP-сессии геолокации
+        await get_ip_service().close()
+        
+        # Сброс буфера IP-подключений
+        await ip_writer.close()
+        logger.info("Буфер IP-подключений сброшен")
+        
+        # Сброс отложенных записей диалогов (повторное закрытие после shutdown диспетчера безопасно)
+        await storage.close()
+        await last_messages.close()
         
         # Закрытие пула соединений базы данных
         await db.close()
         logger.info("Пул соединений базы данных закрыт")
+        
+        # Остановка пулов CPU-задач
+        shutdown_worker_pools()
+        logger.info("Пулы воркеров остановлены")
 
 if __name__ == "__main__":
     try:
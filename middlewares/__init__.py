@@ -3,5 +3,11 @@
 """
 
 from .auth import AuthMiddleware
+from .callback_route import CallbackRouteMiddleware
+from .instrumentation import InstrumentationMiddleware, TelegramLatencyMiddleware
+from .outbound import OutboundScheduler, get_outbound_scheduler
+from .render import RenderFingerprintMiddleware, get_render_fingerprints
 
-__all__ = ['AuthMiddleware']
\ No newline at end of file
+__all__ = ['AuthMiddleware', 'CallbackRouteMiddleware', 'InstrumentationMiddleware', 'TelegramLatencyMiddleware',
+           'OutboundScheduler', 'get_outbound_scheduler',
+           'RenderFingerprintMiddleware', 'get_render_fingerprints']
\ No newline at end of file
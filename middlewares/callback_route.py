@@ -0,0 +1,23 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from utils.callback_data import CallbackRegistry
+
+
+class CallbackRouteMiddleware(BaseMiddleware):
+    """Разбор callback_data один раз на нажатие: результат в data["callback_route"] (None - некорректные данные)"""
+
+    def __init__(self, registry: CallbackRegistry):
+        self.registry = registry
+        super().__init__()
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        data["callback_route"] = self.registry.parse(event.data)
+        return await handler(event, data)
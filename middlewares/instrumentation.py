@@ -0,0 +1,93 @@
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Union
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, Message
+
+from utils.instrumentation import Instrumentation, UpdateTrace, current_trace
+
+# Команды Telegram: латиница, цифры и _, до 32 символов (прочий текст - просто сообщение)
+COMMAND_RE = re.compile(r"/([A-Za-z0-9_]{1,32})(?:@\w+)?(?:\s|$)")
+
+
+def route_label(event: Union[Message, CallbackQuery], data: Dict[str, Any]) -> str:
+    """Маршрут обновления: действие кнопки, состояние FSM или команда"""
+    if isinstance(event, CallbackQuery):
+        callback_route = data.get("callback_route")
+        return callback_route.action if callback_route is not None else "invalid"
+    raw_state = data.get("raw_state")
+    if raw_state:
+        return raw_state
+    command = COMMAND_RE.match(event.text or "")
+    if command:
+        return f"/{command.group(1)}"
+    return "message"
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """
+    Замер обработки обновления: задержка и ошибки по маршруту, запросы к БД
+    и subprocess внутри обработчика (через трассировку в контексте).
+
+    Для нажатий кнопок регистрируется после CallbackRouteMiddleware - маршрутом
+    служит разобранное действие.
+    """
+
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+        super().__init__()
+
+    async def __call__(
+        self,
+        handler: Callable[[Union[Message, CallbackQuery], Dict[str, Any]], Awaitable[Any]],
+        event: Union[Message, CallbackQuery],
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = UpdateTrace(route_label(event, data))
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            current_trace.reset(token)
+            self.instrumentation.record_update(trace, time.perf_counter() - started, error)
+
+
+class TelegramLatencyMiddleware(BaseRequestMiddleware):
+    """
+    Задержка запросов к Bot API по методам.
+
+    Регистрируется последней в сессии бота: измеряется сам HTTP-запрос, без
+    ожидания в очереди исходящих. getUpdates не учитывается - long polling
+    ждет обновлений, а не ответа.
+    """
+
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        if api_method == "getUpdates":
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        error = False
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.instrumentation.record_telegram_request(api_method, time.perf_counter() - started, error)
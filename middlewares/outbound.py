@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+# Полосы приоритета исходящих запросов: интерактивные ответы обслуживаются раньше фоновых
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+RATE_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+# Правки, которые можно схлопнуть: более новая правка того же сообщения заменяет ожидающую
+COLLAPSIBLE_METHODS = ("editMessageText", "editMessageReplyMarkup", "editMessageCaption", "editMessageMedia")
+
+
+@contextmanager
+def outbound_lane(priority: int):
+    """Выполнение блока с заданным приоритетом исходящих запросов"""
+    token = outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity, с паузой по retry_after"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, until: float) -> None:
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        """Корзина полна и не на паузе - ее можно не хранить"""
+        return now >= self.paused_until and self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+class _Ticket:
+    """Ожидающий отправки запрос"""
+    __slots__ = ('chat_id', 'method', 'granted', 'waiters', 'enqueued_at', 'collapse_key')
+
+    def __init__(self, chat_id: Any, method: TelegramMethod, collapse_key: Optional[tuple]):
+        self.chat_id = chat_id
+        self.method = method
+        self.collapse_key = collapse_key
+        self.granted = asyncio.Event()
+        self.waiters: List[asyncio.Future] = []
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов к Telegram (request-мидлварь сессии бота).
+
+    Запросы на отправку и правку сообщений проходят через глобальную корзину
+    токенов и корзину своего чата; из очереди первыми выпускаются запросы
+    интерактивной полосы. Ответ 429 ставит на паузу корзину чата (или
+    глобальную) на retry_after и повторяет запрос. Правка сообщения, еще
+    ожидающая отправки, заменяется более новой правкой того же сообщения -
+    отправляется только последняя, все вызывающие получают ее результат.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.logger = logging.getLogger(__name__)
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._lanes: Tuple[Deque[_Ticket], ...] = (deque(), deque())
+        self._pending_edits: Dict[tuple, _Ticket] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.collapsed = 0
+        self.retried = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def configure(self, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                  chat_burst: Optional[float] = None, group_rate: Optional[float] = None,
+                  max_retries: Optional[int] = None):
+        """Изменение лимитов (из конфигурации при запуске)"""
+        if global_rate is not None:
+            self.global_rate = global_rate
+            self._global = TokenBucket(global_rate, global_rate)
+        if chat_rate is not None:
+            self.chat_rate = chat_rate
+        if chat_burst is not None:
+            self.chat_burst = chat_burst
+        if group_rate is not None:
+            self.group_rate = group_rate
+        if max_retries is not None:
+            self.max_retries = max_retries
+        self._chats.clear()
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        if not api_method.startswith(RATE_LIMITED_PREFIXES):
+            # getUpdates, answerCallbackQuery, deleteMessage и т.п. идут напрямую
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        collapse_key = None
+        if api_method in COLLAPSIBLE_METHODS and getattr(method, 'message_id', None) is not None:
+            collapse_key = (api_method, chat_id, method.message_id)
+            pending = self._pending_edits.get(collapse_key)
+            if pending is not None:
+                # Правка еще не отправлена - заменяем ее содержимое на более новое
+                pending.method = method
+                self.collapsed += 1
+                waiter = asyncio.get_running_loop().create_future()
+                pending.waiters.append(waiter)
+                return await waiter
+
+        ticket = _Ticket(chat_id, method, collapse_key)
+        lane = outbound_priority.get()
+        try:
+            response = await self._send(make_request, bot, ticket, lane)
+        except BaseException as e:
+            for waiter in ticket.waiters:
+                if waiter.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    waiter.cancel()
+                else:
+                    waiter.set_exception(e)
+            raise
+        for waiter in ticket.waiters:
+            if not waiter.done():
+                waiter.set_result(response)
+        return response
+
+    async def _send(self, make_request, bot: Bot, ticket: _Ticket, lane: int):
+        attempt = 0
+        while True:
+            await self._admit(ticket, lane)
+            try:
+                return await make_request(bot, ticket.method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retried += 1
+                bucket = self._chat_bucket(ticket.chat_id) if ticket.chat_id is not None else self._global
+                bucket.pause(time.monotonic() + e.retry_after)
+                self.logger.warning(
+                    f"Flood control Telegram: пауза {e.retry_after} с для чата {ticket.chat_id} "
+                    f"(попытка {attempt}/{self.max_retries})"
+                )
+                if attempt > self.max_retries:
+                    raise
+                ticket.granted = asyncio.Event()
+                ticket.enqueued_at = time.monotonic()
+
+    async def _admit(self, ticket: _Ticket, lane: int) -> None:
+        """Постановка в очередь и ожидание разрешения диспетчера"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+        self._lanes[lane].append(ticket)
+        if ticket.collapse_key is not None:
+            self._pending_edits[ticket.collapse_key] = ticket
+        self._wakeup.set()
+        try:
+            await ticket.granted.wait()
+        finally:
+            if not ticket.granted.is_set():
+                # Отмена вызывающим - убираем запрос из очереди
+                self._lanes[lane].remove(ticket)
+                self._forget_edit(ticket)
+
+        wait = time.monotonic() - ticket.enqueued_at
+        self.sent += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    async def _dispatch(self) -> None:
+        """Выпуск запросов из очереди по мере появления токенов"""
+        while True:
+            now = time.monotonic()
+            ticket, delay = self._next_ready(now)
+            if ticket is not None:
+                self._global.take()
+                if ticket.chat_id is not None:
+                    self._chat_bucket(ticket.chat_id).take()
+                self._forget_edit(ticket)
+                ticket.granted.set()
+                continue
+
+            self._wakeup.clear()
+            if delay is None and len(self._chats) > 1000:
+                self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.idle(now)}
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _next_ready(self, now: float) -> Tuple[Optional[_Ticket], Optional[float]]:
+        """Первый запрос (по приоритету полос), которому хватает токенов, или время до следующей попытки"""
+        if not any(self._lanes):
+            return None, None
+
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+
+        min_wait = None
+        for lane in self._lanes:
+            for ticket in lane:
+                wait = self._chat_bucket(ticket.chat_id).wait_time(now) if ticket.chat_id is not None else 0.0
+                if wait == 0:
+                    lane.remove(ticket)
+                    return ticket, 0.0
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id (или @username) - группа или канал с более строгим лимитом
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = TokenBucket(rate, 1 if is_group else self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _forget_edit(self, ticket: _Ticket) -> None:
+        if ticket.collapse_key is not None and self._pending_edits.get(ticket.collapse_key) is ticket:
+            del self._pending_edits[ticket.collapse_key]
+
+    def get_stats(self) -> Dict[str, float]:
+        """Метрики очереди исходящих запросов"""
+        return {
+            'sent': self.sent,
+            'queued': sum(len(lane) for lane in self._lanes),
+            'collapsed': self.collapsed,
+            'retried': self.retried,
+            'avg_wait_ms': self.total_wait / self.sent * 1000 if self.sent else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+    async def close(self) -> None:
+        """Остановка диспетчера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Глобальный планировщик исходящих запросов
+outbound_scheduler = OutboundScheduler()
+
+
+def get_outbound_scheduler() -> OutboundScheduler:
+    """Получение экземпляра планировщика исходящих запросов"""
+    return outbound_scheduler
@@ -0,0 +1,188 @@
+import hashlib
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    DeleteMessage, DeleteMessages, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup,
+    EditMessageText, Response, SendMessage, TelegramMethod
+)
+from aiogram.methods.base import TelegramType
+from aiogram.types import InlineKeyboardMarkup, Message
+
+
+class RenderFingerprint(NamedTuple):
+    """Отпечаток отображаемого сообщения: хеши текста и клавиатуры по отдельности"""
+    text: str
+    markup: str
+
+
+class RenderMark(NamedTuple):
+    """Отрисовка сообщения: ключ (chat_id, message_id) и номер правки"""
+    key: Tuple[Any, int]
+    sequence: int
+
+
+# Последняя отрисовка, выполненная текущей задачей (правка, отправка или пропуск правки)
+last_render: ContextVar[Optional[RenderMark]] = ContextVar("last_render", default=None)
+
+
+def _digest(data: str) -> str:
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def render_fingerprint(method: TelegramMethod) -> RenderFingerprint:
+    """Отпечаток текста и inline-клавиатуры сообщения в том виде, в каком они уходят в Telegram"""
+    entities = method.entities
+    text = "\0".join((
+        method.text,
+        repr(method.parse_mode),
+        "" if not entities else "".join(entity.model_dump_json(exclude_none=True) for entity in entities),
+    ))
+    markup = method.reply_markup
+    markup_json = markup.model_dump_json(exclude_none=True) if isinstance(markup, InlineKeyboardMarkup) else ""
+    return RenderFingerprint(_digest(text), _digest(markup_json))
+
+
+class RenderFingerprintMiddleware(BaseRequestMiddleware):
+    """
+    Пропуск правок сообщений, которые ничего не меняют (request-мидлварь сессии бота).
+
+    Для каждого сообщения бота запоминается отпечаток последнего отображенного
+    текста и клавиатуры. editMessageText с тем же отпечатком не отправляется
+    вовсе; если изменилась только клавиатура, вместо него отправляется более
+    легкий editMessageReplyMarkup. Ответ "message is not modified" считается
+    успехом. Отпечатки хранятся для ограниченного числа последних сообщений
+    (LRU); удаленные и измененные иначе (подпись, медиа) сообщения забываются.
+
+    Каждая отрисовка сообщения получает номер; RenderMark последней отрисовки
+    задачи доступен через last_render. is_current(mark) проверяет, что после
+    нее сообщение никто не менял и не удалял - так отложенные правки
+    (дозаполнение экрана) не затирают экран, открытый позже.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Any, int], RenderFingerprint]" = OrderedDict()
+        # Последняя начатая правка каждого сообщения: отпечаток запоминает только она
+        self._latest: "OrderedDict[Tuple[Any, int], int]" = OrderedDict()
+        self._sequence = 0
+
+        self.skipped = 0
+        self.markup_edits = 0
+        self.text_edits = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, EditMessageText) and method.inline_message_id is None:
+            return await self._edit_text(make_request, bot, method)
+        if isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            if isinstance(result, Message):
+                key = (result.chat.id, result.message_id)
+                last_render.set(RenderMark(key, self._next_sequence(key)))
+                self._remember(key, render_fingerprint(method))
+            return result
+
+        if isinstance(method, (DeleteMessage, EditMessageReplyMarkup, EditMessageCaption, EditMessageMedia)):
+            # Содержимое меняется в обход отпечатка - сообщение забывается
+            if getattr(method, 'message_id', None) is not None:
+                self._invalidate((method.chat_id, method.message_id))
+        elif isinstance(method, DeleteMessages):
+            for message_id in method.message_ids:
+                self._invalidate((method.chat_id, message_id))
+        return await make_request(bot, method)
+
+    async def _edit_text(self, make_request, bot: Bot, method: EditMessageText):
+        key = (method.chat_id, method.message_id)
+        fingerprint = render_fingerprint(method)
+        previous = self._entries.get(key)
+        if previous == fingerprint:
+            self.skipped += 1
+            self._entries.move_to_end(key)
+            sequence = self._latest.get(key)
+            last_render.set(RenderMark(key, sequence) if sequence is not None else None)
+            return True
+
+        request: TelegramMethod = method
+        if previous is not None and previous.text == fingerprint.text:
+            # Изменилась только клавиатура
+            request = EditMessageReplyMarkup(
+                chat_id=method.chat_id,
+                message_id=method.message_id,
+                reply_markup=method.reply_markup,
+            )
+            self.markup_edits += 1
+        else:
+            self.text_edits += 1
+
+        sequence = self._next_sequence(key)
+        last_render.set(RenderMark(key, sequence))
+
+        try:
+            result = await make_request(bot, request)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                self._forget(key)
+                raise
+            # Содержимое уже такое (например, после перезапуска бота)
+            result = True
+        except BaseException:
+            self._forget(key)
+            raise
+
+        if self._latest.get(key) == sequence:
+            self._remember(key, fingerprint)
+        return result
+
+    def _next_sequence(self, key: Tuple[Any, int]) -> int:
+        """Номер новой отрисовки сообщения (последняя начатая правка)"""
+        self._sequence += 1
+        self._latest[key] = self._sequence
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.max_entries:
+            self._latest.popitem(last=False)
+        return self._sequence
+
+    def is_current(self, mark: Optional[RenderMark]) -> bool:
+        """Сообщение все еще показывает эту отрисовку (не правилось и не удалялось после нее)"""
+        return mark is not None and self._latest.get(mark.key) == mark.sequence
+
+    def _invalidate(self, key: Tuple[Any, int]) -> None:
+        """Содержимое сообщения изменено в обход отпечатка или сообщение удалено"""
+        self._forget(key)
+        self._next_sequence(key)
+
+    def _remember(self, key: Tuple[Any, int], fingerprint: RenderFingerprint) -> None:
+        self._entries[key] = fingerprint
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: Tuple[Any, int]) -> None:
+        self._entries.pop(key, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Метрики пропущенных и сокращенных правок"""
+        return {
+            'entries': len(self._entries),
+            'skipped': self.skipped,
+            'markup_edits': self.markup_edits,
+            'text_edits': self.text_edits,
+        }
+
+
+# Глобальная мидлварь отпечатков отображенных сообщений
+render_fingerprints = RenderFingerprintMiddleware()
+
+
+def get_render_fingerprints() -> RenderFingerprintMiddleware:
+    """Получение экземпляра мидлвари отпечатков сообщений"""
+    return render_fingerprints
@@ -3,17 +3,76 @@ import logging
 import os
 import subprocess
 import pwd
+import time
 import grp
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Tuple, Dict, Callable, Awaitable, NamedTuple
 from pathlib import Path
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.backends import default_backend
 import base64
 import ipaddress
+import re
 from config import Config
 from database.database import Client, get_db
+from database.ip_connections import get_ip_connection_writer
 from services.settings_service import SettingsService
+from utils.traffic_parser import parse_handshake_seconds
+from utils.instrumentation import get_instrumentation, subprocess_command
+from utils.workers import run_in_pool
+
+# Пиров в одном вызове awg set при массовом удалении (ограничение длины командной строки)
+PEER_BATCH_SIZE = 200
+
+
+class PeerStatsSnapshot(NamedTuple):
+    """Последний успешно полученный вывод awg show (по public key) и время его получения"""
+    taken_at: float
+    peers: Dict[str, Dict]
+
+
+# Общий для всех экземпляров AWGManager: метрики читают его, не вызывая awg
+_peer_stats_snapshot: Optional[PeerStatsSnapshot] = None
+
+
+def get_peer_stats_snapshot() -> Optional[PeerStatsSnapshot]:
+    """Последняя статистика пиров (None - еще не получена)"""
+    return _peer_stats_snapshot
+
+
+def generate_x25519_keypair() -> Tuple[str, str]:
+    """Пара ключей X25519 в base64 (приватный, публичный)"""
+    private_key = x25519.X25519PrivateKey.generate()
+    
+    private_key_bytes = private_key.private_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PrivateFormat.Raw,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    
+    public_key_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    
+    return (
+        base64.b64encode(private_key_bytes).decode('utf-8'),
+        base64.b64encode(public_key_bytes).decode('utf-8')
+    )
+
+
+def generate_client_keys(count: int) -> List[Tuple[str, str, str]]:
+    """
+    Ключи для count клиентов: (приватный, публичный, preshared).
+
+    Функция уровня модуля, чтобы ее можно было выполнять в процессном пуле.
+    """
+    keys = []
+    for _ in range(count):
+        private_key_b64, public_key_b64 = generate_x25519_keypair()
+        keys.append((private_key_b64, public_key_b64, base64.b64encode(os.urandom(32)).decode('utf-8')))
+    return keys
+
 
 class AWGManager:
     """Менеджер для работы с AmneziaWG"""
@@ -22,6 +81,7 @@ class AWGManager:
         self.config = config
         self.logger = logging.getLogger(__name__)
         self.db = get_db()
+        self.ip_writer = get_ip_connection_writer()
         
         self.logger.info("Инициализация AWGManager")
         self.logger.info(f"AWG интерфейс: {self.config.awg_interface}")
@@ -35,21 +95,30 @@ class AWGManager:
         except Exception:
             self.logger.warning("Не удалось получить имя пользователя")
 
-    async def _run_subprocess(self, *args, timeout: float = 15.0):
+    async def _run_subprocess(self, *args, timeout: float = 15.0, input: Optional[bytes] = None):
         """Запуск subprocess с таймаутом. Возвращает (returncode, stdout, stderr)."""
-        process = await asyncio.create_subprocess_exec(
-            *args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        started = time.perf_counter()
+        failed = True
         try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-            return process.returncode, stdout, stderr
-        except asyncio.TimeoutError:
-            process.kill()
-            await process.communicate()
-            self.logger.error(f"Таймаут ({timeout}s) при выполнении: {' '.join(str(a) for a in args)}")
-            raise
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.PIPE if input is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(input=input), timeout=timeout)
+                failed = process.returncode != 0
+                return process.returncode, stdout, stderr
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.communicate()
+                self.logger.error(f"Таймаут ({timeout}s) при выполнении: {' '.join(str(a) for a in args)}")
+                raise
+        finally:
+            get_instrumentation().record_subprocess(
+                subprocess_command(args), time.perf_counter() - started, error=failed
+            )
 
     async def save_server_config(self) -> bool:
         """Сохранить конфигурацию сервера с sudo если необходимо"""
@@ -80,6 +149,7 @@ class AWGManager:
 
     async def get_interface_stats(self) -> Dict[str, Dict]:
         """Получить статистику интерфейса с трекингом IP"""
+        global _peer_stats_snapshot
         self.logger.debug("Получение статистики интерфейса")
         try:
             rc, stdout, stderr = await self._run_subprocess(
@@ -108,14 +178,14 @@ class AWGManager:
                 elif current_peer and ':' in line and not line.startswith('interface:'):
                     key, value = line.split(':', 1)
                     stats[current_peer][key.strip()] = value.strip()
-                    
-                    if key.strip() == 'endpoint':
-                        endpoint_value = value.strip()
-                        if endpoint_value:
-                            client_ip = endpoint_value.split(':')[0]
-                            await self._track_client_ip(current_peer, client_ip)
-                            self.logger.debug(f"Трекаем IP {client_ip} для peer {current_peer[:20]}...")
-            
+
+            for public_key, peer_stats in stats.items():
+                endpoint_value = peer_stats.get('endpoint')
+                if endpoint_value:
+                    await self._track_client_ip(public_key, endpoint_value, peer_stats.get('latest handshake'))
+
+            _peer_stats_snapshot = PeerStatsSnapshot(time.time(), stats)
+
             self.logger.debug(f"Получена статистика для {len(stats)} peers")
             return stats
             
@@ -123,22 +193,11 @@ class AWGManager:
             self.logger.error(f"Ошибка при получении статистики: {e}")
             return {}
 
-    async def _track_client_ip(self, public_key: str, client_ip: str):
-        """Трекинг IP клиента по его public key"""
+    async def _track_client_ip(self, public_key: str, endpoint: str, latest_handshake: Optional[str]):
+        """Трекинг IP клиента по его public key (буферизированная запись в БД)"""
         try:
-            client = await self.db.get_client_by_public_key(public_key)
-
-            if not client:
-                self.logger.warning(f"Клиент с public key {public_key[:20]}... не найден в БД")
-                return
-            
-            client.last_ip = client_ip
-            await self.db.update_client(client)
-            
-            await self.db.add_client_ip_connection(client.id, client_ip)
-            
-            self.logger.debug(f"IP {client_ip} зафиксирован для клиента {client.name}")
-            
+            client_ip = endpoint.rsplit(':', 1)[0].strip('[]')
+            await self.ip_writer.observe(public_key, client_ip, parse_handshake_seconds(latest_handshake))
         except Exception as e:
             self.logger.error(f"Ошибка при трекинге IP: {e}")
 
@@ -249,22 +308,7 @@ class AWGManager:
         """Генерация пары ключей для клиента"""
         self.logger.debug("Генерация ключей клиента")
         try:
-            private_key = x25519.X25519PrivateKey.generate()
-            public_key = private_key.public_key()
-            
-            private_key_bytes = private_key.private_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PrivateFormat.Raw,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            
-            public_key_bytes = public_key.public_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PublicFormat.Raw
-            )
-            
-            private_key_b64 = base64.b64encode(private_key_bytes).decode('utf-8')
-            public_key_b64 = base64.b64encode(public_key_bytes).decode('utf-8')
+            private_key_b64, public_key_b64 = generate_x25519_keypair()
             
             self.logger.debug("Ключи сгенерированы успешно")
             self.logger.debug(f"Public key: {public_key_b64[:20]}...")
@@ -275,6 +319,22 @@ class AWGManager:
             self.logger.error(f"Ошибка при генерации ключей: {e}")
             raise
 
+    async def generate_keypair_async(self) -> Tuple[str, str]:
+        """Генерация пары ключей в пуле crypto, не блокируя цикл событий"""
+        try:
+            return await run_in_pool("crypto", generate_x25519_keypair)
+        except Exception as e:
+            self.logger.error(f"Ошибка при генерации ключей: {e}")
+            raise
+
+    async def generate_keypair_with_preshared_async(self) -> Tuple[str, str, str]:
+        """Генерация пары ключей + preshared key в пуле crypto"""
+        try:
+            return (await run_in_pool("crypto", generate_client_keys, 1))[0]
+        except Exception as e:
+            self.logger.error(f"Ошибка при генерации ключей с Preshared: {e}")
+            raise
+
     async def get_next_available_ip(self) -> Optional[str]:
         """Получить следующий доступный IP-адрес"""
         self.logger.info("Поиск свободного IP-адреса")
@@ -284,9 +344,8 @@ class AWGManager:
             
             used_ips = set()
             
-            clients = await self.db.get_all_clients()
-            for client in clients:
-                used_ips.add(client.ip_address)
+            async for (ip_address,) in self.db.iter_clients(columns=('ip_address',)):
+                used_ips.add(ip_address)
             
             used_ips.add(self.config.server_ip)
             
@@ -318,11 +377,10 @@ class AWGManager:
             
             # Собираем занятые IPv6 адреса
             used_ipv6s = set()
-            clients = await self.db.get_all_clients()
             
-            for client in clients:
-                if client.ipv6_address:
-                    used_ipv6s.add(client.ipv6_address)
+            async for (ipv6_address,) in self.db.iter_clients(columns=('ipv6_address',)):
+                if ipv6_address:
+                    used_ipv6s.add(ipv6_address)
             
             # Добавляем адрес сервера если он задан
             if self.config.server_ipv6:
@@ -361,43 +419,151 @@ class AWGManager:
             self.logger.error(f"Ошибка при поиске IPv6: {e}")
             return None
 
+    async def allocate_addresses(self, count: int, with_ipv6: bool = False) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Свободные адреса для count новых клиентов за один проход по таблице.
+
+        Возвращает (IPv4-адреса, IPv6-адреса) или None, если IPv4-адресов не хватает.
+        IPv6-адресов может оказаться меньше count - такие клиенты создаются только с IPv4.
+        """
+        self.logger.info(f"Выделение адресов для {count} клиентов")
+        try:
+            used_ips = {self.config.server_ip}
+            used_ipv6s = set()
+            async for ip_address, ipv6_address in self.db.iter_clients(columns=('ip_address', 'ipv6_address')):
+                used_ips.add(ip_address)
+                if ipv6_address:
+                    used_ipv6s.add(ipv6_address)
+
+            ipv4_addresses = []
+            for ip in ipaddress.IPv4Network(self.config.server_subnet).hosts():
+                if len(ipv4_addresses) == count:
+                    break
+                if str(ip) not in used_ips:
+                    ipv4_addresses.append(str(ip))
+
+            if len(ipv4_addresses) < count:
+                self.logger.error(f"Недостаточно свободных IP-адресов: {len(ipv4_addresses)} из {count}")
+                return None
+
+            ipv6_addresses = []
+            if with_ipv6 and self.config.server_ipv6_subnet:
+                if self.config.server_ipv6:
+                    used_ipv6s.add(self.config.server_ipv6)
+
+                host_iterator = ipaddress.IPv6Network(self.config.server_ipv6_subnet).hosts()
+                # ::1 зарезервирован за сервером, как в get_next_available_ipv6
+                next(host_iterator, None)
+                for ip in host_iterator:
+                    if len(ipv6_addresses) == count:
+                        break
+                    if str(ip) not in used_ipv6s:
+                        ipv6_addresses.append(str(ip))
+
+            return ipv4_addresses, ipv6_addresses
+
+        except Exception as e:
+            self.logger.error(f"Ошибка при выделении адресов: {e}")
+            return None
+
+    async def add_peers_to_server(self, clients: List[Client]) -> bool:
+        """Добавить пиров одним вызовом awg addconf и одним сохранением конфигурации"""
+        self.logger.info(f"Добавление {len(clients)} пиров на сервер")
+
+        sections = []
+        for client in clients:
+            allowed_ips = f"{client.ip_address}/32"
+            if client.has_ipv6 and client.ipv6_address:
+                allowed_ips += f", {client.ipv6_address}/128"
+            section = f"[Peer]\nPublicKey = {client.public_key}\n"
+            # У старых клиентов и восстановленных из копии ключа может не быть:
+            # пустая строка PresharedKey = ломает разбор всей конфигурации
+            if client.preshared_key:
+                section += f"PresharedKey = {client.preshared_key}\n"
+            section += f"AllowedIPs = {allowed_ips}\n"
+            sections.append(section)
+        # Ключи передаются через stdin, а не в аргументах команды
+        peers_conf = "\n".join(sections).encode()
+
+        try:
+            rc, stdout, stderr = await self._run_subprocess(
+                'awg', 'addconf', self.config.awg_interface, '/dev/stdin',
+                input=peers_conf, timeout=60.0
+            )
+            if rc != 0:
+                rc, stdout, stderr = await self._run_subprocess(
+                    'sudo', 'awg', 'addconf', self.config.awg_interface, '/dev/stdin',
+                    input=peers_conf, timeout=60.0
+                )
+            if rc != 0:
+                error = stderr.decode(errors='replace')
+                self.logger.error(f"Ошибка добавления пиров: {error}")
+                rejected = self._rejected_peer_sections(clients, sections, error)
+                if rejected:
+                    self.logger.error(f"awg отклонил секции [Peer] клиентов: {', '.join(rejected)}")
+                return False
+
+            self.logger.info(f"Добавлено пиров: {len(clients)}")
+            return await self.save_server_config()
+
+        except asyncio.TimeoutError:
+            return False
+        except Exception as e:
+            self.logger.error(f"Ошибка при добавлении пиров: {e}")
+            return False
+
+    @staticmethod
+    def _rejected_peer_sections(clients: List[Client], sections: List[str], error: str) -> List[str]:
+        """
+        Клиенты, чьи секции упомянуты в ошибке awg addconf: awg не сообщает
+        номер строки, но приводит отвергнутую строку или значение.
+
+        Значение (ключ, адрес из AllowedIPs) должно встречаться в ошибке
+        целиком: 10.0.0.2 не совпадает с 10.0.0.25.
+        """
+        def mentioned(token: str) -> bool:
+            return re.search(rf"(?<![\w.:/+-]){re.escape(token)}(?![\w.:/+-])", error) is not None
+
+        rejected = []
+        for client, section in zip(clients, sections):
+            for line in section.splitlines()[1:]:
+                key, _, value = line.partition('=')
+                tokens = [f"{key.strip()}={value.strip()}", line.strip()]
+                tokens += [part.strip() for part in value.split(',') if part.strip()]
+                if any(mentioned(token) for token in tokens):
+                    rejected.append(client.name)
+                    break
+        return rejected
+
     async def add_peer_to_server(self, client: Client) -> bool:
         try:
             allowed_ips = f"{client.ip_address}/32"
             if client.has_ipv6 and client.ipv6_address:
                 allowed_ips += f", {client.ipv6_address}/128"
             
-            process = await asyncio.create_subprocess_exec(
+            rc, stdout, stderr = await self._run_subprocess(
                 'awg', 'set', self.config.awg_interface,
                 'peer', client.public_key,
                 'preshared-key', '/dev/stdin',
                 'allowed-ips', allowed_ips,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                input=client.preshared_key.encode()
             )
             
-            stdout, stderr = await process.communicate(input=client.preshared_key.encode())
-            
-            if process.returncode == 0:
+            if rc == 0:
                 self.logger.info(f"Клиент добавлен на сервер с AllowedIPs: {allowed_ips}")
                 await self.save_server_config()
                 return True
             
             # Пробуем с sudo
-            sudo_process = await asyncio.create_subprocess_exec(
+            sudo_rc, sudo_stdout, sudo_stderr = await self._run_subprocess(
                 'sudo', 'awg', 'set', self.config.awg_interface,
                 'peer', client.public_key,
                 'preshared-key', '/dev/stdin',
                 'allowed-ips', allowed_ips,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                input=client.preshared_key.encode()
             )
             
-            sudo_stdout, sudo_stderr = await sudo_process.communicate(input=client.preshared_key.encode())
-            
-            if sudo_process.returncode == 0:
+            if sudo_rc == 0:
                 self.logger.info(f"Клиент добавлен на сервер с sudo, AllowedIPs: {allowed_ips}")
                 await self.save_server_config()
                 return True
@@ -490,55 +656,75 @@ class AWGManager:
         self.logger.debug(f"Создание конфигурации для клиента: {client.name}")
         
         try:
-            settings_service = SettingsService()
-            server_public_key = await self.get_server_public_key()
-            if not server_public_key:
-                raise Exception("Не удалось получить публичный ключ сервера")
-            
-            dns_servers = await settings_service.get_default_dns()
-            additional_params = await self.get_server_amnezia_params()
-            if additional_params is None:
-                self.logger.error("Не удалось получить параметры Amnezia, используем обычный WireGuard")
-                raise Exception("Ошибка получения параметров Amnezia")
-            
-            address_line = f"Address = {client.ip_address}/32"
-            if client.has_ipv6 and client.ipv6_address:
-                address_line += f", {client.ipv6_address}/128"
-
-            config_lines = [
-                "[Interface]",
-                f"PrivateKey = {client.private_key}",
-                address_line,
-                f"DNS = {dns_servers}"
-            ]
-
-            if additional_params:
-                for param_name, param_value in additional_params.items():
-                    config_lines.append(f"{param_name} = {param_value}")
-                self.logger.info(f"Добавлены параметры Amnezia: {list(additional_params.keys())}")
-            else:
-                self.logger.info("Используются стандартные параметры WireGuard")
+            server_public_key, dns_servers, additional_params = await self._get_client_config_context()
+            return self._render_client_config(client, server_public_key, dns_servers, additional_params)
             
-            allowed_ips_line = "AllowedIPs = 0.0.0.0/0"
-            if client.has_ipv6 and client.ipv6_address:
-                allowed_ips_line += ", ::/0"
-
-            config_lines.extend([
-                "",
-                "[Peer]",
-                f"PublicKey = {server_public_key}",
-                f"PresharedKey = {client.preshared_key}",
-                allowed_ips_line,
-                f"Endpoint = {client.endpoint}:{self.config.server_port}",
-                "PersistentKeepalive = 25"
-            ])
+        except Exception as e:
+            self.logger.error(f"Ошибка при создании конфигурации: {e}")
+            raise
 
-            return '\n'.join(config_lines)
+    async def create_client_configs(self, clients: List[Client]) -> List[str]:
+        """Конфигурации нескольких клиентов (параметры сервера читаются один раз)"""
+        try:
+            context = await self._get_client_config_context()
+            return [self._render_client_config(client, *context) for client in clients]
             
         except Exception as e:
-            self.logger.error(f"Ошибка при создании конфигурации: {e}")
+            self.logger.error(f"Ошибка при создании конфигураций: {e}")
             raise
 
+    async def _get_client_config_context(self) -> Tuple[str, str, Dict[str, str]]:
+        """Общие для всех клиентов части конфигурации: ключ сервера, DNS, параметры Amnezia"""
+        settings_service = SettingsService()
+        server_public_key = await self.get_server_public_key()
+        if not server_public_key:
+            raise Exception("Не удалось получить публичный ключ сервера")
+        
+        dns_servers = await settings_service.get_default_dns()
+        additional_params = await self.get_server_amnezia_params()
+        if additional_params is None:
+            self.logger.error("Не удалось получить параметры Amnezia, используем обычный WireGuard")
+            raise Exception("Ошибка получения параметров Amnezia")
+        
+        return server_public_key, dns_servers, additional_params
+
+    def _render_client_config(self, client: Client, server_public_key: str, dns_servers: str,
+                              additional_params: Dict[str, str]) -> str:
+        """Текст конфигурации клиента"""
+        address_line = f"Address = {client.ip_address}/32"
+        if client.has_ipv6 and client.ipv6_address:
+            address_line += f", {client.ipv6_address}/128"
+
+        config_lines = [
+            "[Interface]",
+            f"PrivateKey = {client.private_key}",
+            address_line,
+            f"DNS = {dns_servers}"
+        ]
+
+        if additional_params:
+            for param_name, param_value in additional_params.items():
+                config_lines.append(f"{param_name} = {param_value}")
+            self.logger.debug(f"Добавлены параметры Amnezia: {list(additional_params.keys())}")
+        else:
+            self.logger.debug("Используются стандартные параметры WireGuard")
+        
+        allowed_ips_line = "AllowedIPs = 0.0.0.0/0"
+        if client.has_ipv6 and client.ipv6_address:
+            allowed_ips_line += ", ::/0"
+
+        config_lines.extend([
+            "",
+            "[Peer]",
+            f"PublicKey = {server_public_key}",
+            f"PresharedKey = {client.preshared_key}",
+            allowed_ips_line,
+            f"Endpoint = {client.endpoint}:{self.config.server_port}",
+            "PersistentKeepalive = 25"
+        ])
+
+        return '\n'.join(config_lines)
+
     async def remove_peer_from_server(self, public_key: str) -> bool:
         """Удалить пира с сервера AmneziaWG"""
         self.logger.info(f"Удаление пира с сервера: {public_key[:20]}...")
@@ -562,6 +748,46 @@ class AWGManager:
             self.logger.error(f"Ошибка при удалении пира: {e}")
             return False
 
+    async def remove_peers_from_server(self, public_keys: List[str],
+                                       on_progress: Optional[Callable[[int], Awaitable[None]]] = None) -> int:
+        """
+        Удалить пиров пачками (один вызовом awg set на пачку) с одним сохранением конфигурации.
+
+        Возвращает число удаленных пиров: при ошибке пачки удаление останавливается,
+        уже удаленные пиры идут первыми в списке public_keys.
+        """
+        self.logger.info(f"Удаление {len(public_keys)} пиров с сервера")
+        removed = 0
+        try:
+            for start in range(0, len(public_keys), PEER_BATCH_SIZE):
+                batch = public_keys[start:start + PEER_BATCH_SIZE]
+                args = []
+                for public_key in batch:
+                    args.extend(('peer', public_key, 'remove'))
+
+                rc, stdout, stderr = await self._run_subprocess(
+                    'sudo', 'awg', 'set', self.config.awg_interface, *args
+                )
+                if rc != 0:
+                    self.logger.error(f"Ошибка удаления пиров: {stderr.decode()}")
+                    break
+                removed += len(batch)
+                if on_progress:
+                    await on_progress(removed)
+
+        except asyncio.TimeoutError:
+            self.logger.error(
+                f"Таймаут удаления пиров: пачка с позиции {removed} из {len(public_keys)} не удалена, "
+                f"удаление остановлено"
+            )
+        except Exception as e:
+            self.logger.error(f"Ошибка при удалении пиров: {e}")
+
+        if removed:
+            self.logger.info(f"Удалено пиров: {removed}")
+            await self.save_server_config()
+        return removed
+
     async def get_server_amnezia_params(self) -> Optional[Dict[str, str]]:
         """Получить параметры Amnezia из конфигурации сервера"""
         self.logger.debug("Получение параметров Amnezia")
@@ -4,11 +4,15 @@ import zipfile
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import aiofiles
 
 from config import Config
 from database.database import get_db, Client
+from utils.workers import run_in_pool
+
+# Количество клиентов в одной пачке записи clients.json
+BACKUP_WRITE_BATCH = 500
 
 
 class BackupService:
@@ -28,9 +32,7 @@ class BackupService:
             backup_path = self.backup_dir / backup_filename
             
             db = get_db()
-            clients = await db.get_all_clients()
-            
-            backup_data = {
+            header = {
                 'version': '1.0',
                 'created_at': datetime.now().isoformat(),
                 'config': {
@@ -38,36 +40,50 @@ class BackupService:
                     'server_ip': self.config.server_ip,
                     'server_port': self.config.server_port,
                     'server_subnet': self.config.server_subnet
-                },
-                'clients': []
-            }
-            
-            for client in clients:
-                client_data = {
-                    'name': client.name,
-                    'public_key': client.public_key,
-                    'private_key': client.private_key,
-                    'ip_address': client.ip_address,
-                    'endpoint': client.endpoint,
-                    'created_at': client.created_at.isoformat() if client.created_at else None,
-                    'expires_at': client.expires_at.isoformat() if client.expires_at else None,
-                    'traffic_limit': client.traffic_limit,
-                    'traffic_used': client.traffic_used,
-                    'is_active': client.is_active,
-                    'is_blocked': client.is_blocked
                 }
-                backup_data['clients'].append(client_data)
+            }
             
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                clients_json = json.dumps(backup_data, indent=2, ensure_ascii=False)
-                zipf.writestr('clients.json', clients_json)
-                
-                server_config_path = Path(self.config.awg_config_dir) / f"{self.config.awg_interface}.conf"
-                if server_config_path.exists():
-                    zipf.write(server_config_path, f"server_{self.config.awg_interface}.conf")
+            # Сжатие и запись архива выполняются в пуле archive; цикл событий только
+            # сериализует клиентов и передает пулу готовые пачки байт
+            zipf = await run_in_pool("archive", zipfile.ZipFile, backup_path, 'w', zipfile.ZIP_DEFLATED)
+            try:
+                # clients.json пишется потоково: клиенты не собираются в памяти целиком
+                f = await run_in_pool("archive", zipf.open, 'clients.json', 'w')
+                try:
+                    head = json.dumps({**header, 'clients': []}, indent=2, ensure_ascii=False)
+                    chunk = [head[:head.rindex('[') + 1]]
+                    
+                    separator = "\n"
+                    async for client in db.iter_clients():
+                        client_data = {
+                            'name': client.name,
+                            'public_key': client.public_key,
+                            'private_key': client.private_key,
+                            'ip_address': client.ip_address,
+                            'endpoint': client.endpoint,
+                            'created_at': client.created_at.isoformat() if client.created_at else None,
+                            'expires_at': client.expires_at.isoformat() if client.expires_at else None,
+                            'traffic_limit': client.traffic_limit,
+                            'traffic_used': client.traffic_used,
+                            'is_active': client.is_active,
+                            'is_blocked': client.is_blocked
+                        }
+                        item = json.dumps(client_data, indent=2, ensure_ascii=False)
+                        chunk.append(separator + "    " + item.replace("\n", "\n    "))
+                        separator = ",\n"
+                        
+                        if len(chunk) >= BACKUP_WRITE_BATCH:
+                            await run_in_pool("archive", f.write, "".join(chunk).encode('utf-8'))
+                            chunk = []
+                    
+                    chunk.append("\n  ]\n}")
+                    await run_in_pool("archive", f.write, "".join(chunk).encode('utf-8'))
+                finally:
+                    await run_in_pool("archive", f.close)
                 
-                if os.path.exists(self.config.database_path):
-                    zipf.write(self.config.database_path, 'database.db')
+                await run_in_pool("archive", self._write_server_files, zipf)
+            finally:
+                await run_in_pool("archive", zipf.close)
             
             self.logger.info(f"Резервная копия создана: {backup_filename}")
             return backup_filename
@@ -108,32 +124,29 @@ class BackupService:
             
             db = get_db()
             
-            with zipfile.ZipFile(backup_path, 'r') as zipf:
-                if 'clients.json' not in zipf.namelist():
-                    self.logger.error("Некорректная резервная копия: отсутствует clients.json")
-                    return False
-                
-                with zipf.open('clients.json') as f:
-                    backup_data = json.loads(f.read().decode('utf-8'))
-                
-                current_clients = await db.get_all_clients()
-                for client in current_clients:
-                    await db.delete_client(client.id)
-                
-                for client_data in backup_data['clients']:
-                    client = Client(
-                        name=client_data['name'],
-                        public_key=client_data['public_key'],
-                        private_key=client_data['private_key'],
-                        ip_address=client_data['ip_address'],
-                        endpoint=client_data['endpoint'],
-                        expires_at=datetime.fromisoformat(client_data['expires_at']) if client_data['expires_at'] else None,
-                        traffic_limit=client_data['traffic_limit'],
-                        traffic_used=client_data['traffic_used'],
-                        is_active=client_data['is_active'],
-                        is_blocked=client_data['is_blocked']
-                    )
-                    await db.add_client(client)
+            backup_data = await run_in_pool("archive", self._read_backup_data, backup_path)
+            if backup_data is None:
+                self.logger.error("Некорректная резервная копия: отсутствует clients.json")
+                return False
+            
+            clients = [
+                Client(
+                    name=client_data['name'],
+                    public_key=client_data['public_key'],
+                    private_key=client_data['private_key'],
+                    ip_address=client_data['ip_address'],
+                    endpoint=client_data['endpoint'],
+                    expires_at=datetime.fromisoformat(client_data['expires_at']) if client_data['expires_at'] else None,
+                    traffic_limit=client_data['traffic_limit'],
+                    traffic_used=client_data['traffic_used'],
+                    is_active=client_data['is_active'],
+                    is_blocked=client_data['is_blocked']
+                )
+                for client_data in backup_data['clients']
+            ]
+            
+            # Старые клиенты удаляются и новые добавляются одной транзакцией
+            await db.replace_all_clients(clients)
             
             self.logger.info(f"Резервная копия восстановлена: {backup_filename}")
             return True
@@ -142,6 +155,24 @@ class BackupService:
             self.logger.error(f"Ошибка при восстановлении резервной копии: {e}")
             return False
     
+    def _write_server_files(self, zipf: zipfile.ZipFile) -> None:
+        """Добавление в архив конфигурации сервера и файла БД (выполняется в пуле archive)"""
+        server_config_path = Path(self.config.awg_config_dir) / f"{self.config.awg_interface}.conf"
+        if server_config_path.exists():
+            zipf.write(server_config_path, f"server_{self.config.awg_interface}.conf")
+        
+        if os.path.exists(self.config.database_path):
+            zipf.write(self.config.database_path, 'database.db')
+    
+    @staticmethod
+    def _read_backup_data(backup_path: Path) -> Optional[Dict[str, Any]]:
+        """Чтение clients.json из архива (выполняется в пуле archive)"""
+        with zipfile.ZipFile(backup_path, 'r') as zipf:
+            if 'clients.json' not in zipf.namelist():
+                return None
+            with zipf.open('clients.json') as f:
+                return json.loads(f.read().decode('utf-8'))
+    
     async def delete_backup(self, backup_filename: str) -> bool:
         """Удаление резервной копии"""
         try:
@@ -0,0 +1,338 @@
+import asyncio
+import io
+import logging
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from config import Config
+from database.database import Client, get_db
+from services.awg_manager import AWGManager, generate_client_keys
+from utils.artifact_cache import get_artifact_cache, get_client_qr_png
+from utils.traffic_parser import parse_handshake_seconds
+from utils.workers import get_worker_pool, run_in_pool
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+# Сроки продления для массового действия extend
+EXTEND_PERIODS = {
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+    "90d": timedelta(days=90),
+    "365d": timedelta(days=365),
+}
+
+
+@dataclass
+class BulkCreateResult:
+    """Результат массового создания клиентов"""
+    clients: List[Client] = field(default_factory=list)
+    archive: Optional[bytes] = None
+    archive_name: str = ""
+    error: str = ""
+
+
+@dataclass
+class ClientFilter:
+    """Условия выбора клиентов для массовых операций (все условия должны выполняться)"""
+    expires_before: Optional[datetime] = None
+    traffic_percent: Optional[float] = None
+    idle_days: Optional[int] = None
+    name_prefix: Optional[str] = None
+    is_blocked: Optional[bool] = None
+
+    def describe(self) -> str:
+        """Человекочитаемое описание фильтра"""
+        parts = []
+        if self.expires_before is not None:
+            parts.append(f"срок истекает до {self.expires_before.strftime('%d.%m.%Y %H:%M')}")
+        if self.traffic_percent is not None:
+            parts.append(f"трафик ≥ {self.traffic_percent:g}% лимита")
+        if self.idle_days is not None:
+            parts.append(f"нет подключений > {self.idle_days} дн.")
+        if self.name_prefix:
+            parts.append(f"имя начинается с {self.name_prefix}")
+        if self.is_blocked is not None:
+            parts.append("заблокированные" if self.is_blocked else "незаблокированные")
+        return ", ".join(parts) or "все клиенты"
+
+
+@dataclass
+class BulkActionResult:
+    """Результат массовой операции"""
+    matched: int = 0
+    changed: int = 0
+    error: str = ""
+
+
+def parse_client_filter(expression: str) -> ClientFilter:
+    """
+    Разбор выражения фильтра: условия через пробел, например
+    "expired", "expires<01.12.2026", "traffic>80%", "idle>30d", "name:event", "blocked", "active", "all".
+
+    Неверное условие - ValueError с понятным сообщением.
+    """
+    client_filter = ClientFilter()
+    terms = expression.split()
+    if not terms:
+        raise ValueError("Пустой фильтр")
+
+    for term in terms:
+        lowered = term.lower()
+        if lowered == "all":
+            continue
+        elif lowered == "expired":
+            client_filter.expires_before = datetime.now()
+        elif lowered.startswith("expires<"):
+            value = term[len("expires<"):]
+            for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+                try:
+                    client_filter.expires_before = datetime.strptime(value, date_format)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"Неверная дата в {term} (ожидается ДД.ММ.ГГГГ)")
+        elif lowered.startswith("traffic>") and lowered.endswith("%"):
+            try:
+                client_filter.traffic_percent = float(term[len("traffic>"):-1])
+            except ValueError:
+                raise ValueError(f"Неверный процент в {term}")
+        elif lowered.startswith("idle>") and lowered.endswith("d"):
+            value = term[len("idle>"):-1]
+            if not value.isdigit():
+                raise ValueError(f"Неверное число дней в {term}")
+            client_filter.idle_days = int(value)
+        elif lowered.startswith("name:") and len(term) > len("name:"):
+            client_filter.name_prefix = term[len("name:"):]
+        elif lowered == "blocked":
+            client_filter.is_blocked = True
+        elif lowered == "active":
+            client_filter.is_blocked = False
+        else:
+            raise ValueError(f"Неизвестное условие: {term}")
+
+    return client_filter
+
+
+def build_zip(files: List[Tuple[str, bytes]]) -> bytes:
+    """ZIP в памяти: конфигурации сжимаются, уже сжатые PNG сохраняются как есть"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for name, data in files:
+            compress_type = zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED
+            zipf.writestr(name, data, compress_type=compress_type)
+    return buffer.getvalue()
+
+
+class BulkService:
+    """Массовые операции над клиентами"""
+
+    def __init__(self, config: Config, awg_manager: AWGManager):
+        self.config = config
+        self.awg_manager = awg_manager
+        self.db = get_db()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def make_names(prefix: str, count: int) -> List[str]:
+        """Имена клиентов вида prefix-001 ... prefix-300"""
+        width = max(len(str(count)), 2)
+        return [f"{prefix}-{i:0{width}d}" for i in range(1, count + 1)]
+
+    async def create_clients(self, prefix: str, count: int, endpoint: str,
+                             expires_at: Optional[datetime], traffic_limit: Optional[int],
+                             with_ipv6: bool = False,
+                             on_progress: Optional[ProgressCallback] = None) -> BulkCreateResult:
+        """
+        Создание count клиентов: ключи генерируются в пуле crypto, адреса
+        выделяются за один проход, клиенты добавляются одной транзакцией,
+        пиры применяются одним вызовом awg и одним сохранением конфигурации.
+        """
+        async def progress(text: str):
+            if on_progress:
+                await on_progress(text)
+
+        names = self.make_names(prefix, count)
+        existing = await self.db.get_existing_names(names)
+        if existing:
+            return BulkCreateResult(error=f"Имена уже заняты: {', '.join(sorted(existing)[:5])}"
+                                          f"{' и др.' if len(existing) > 5 else ''}")
+
+        await progress(f"🔑 Генерация ключей ({count})...")
+        keys = await self._generate_keys(count)
+
+        await progress("📡 Выделение адресов...")
+        addresses = await self.awg_manager.allocate_addresses(count, with_ipv6)
+        if addresses is None:
+            return BulkCreateResult(error="Недостаточно свободных IP-адресов")
+        ipv4_addresses, ipv6_addresses = addresses
+
+        clients = []
+        for i, (name, (private_key, public_key, preshared_key)) in enumerate(zip(names, keys)):
+            ipv6_address = ipv6_addresses[i] if i < len(ipv6_addresses) else ""
+            clients.append(Client(
+                name=name,
+                public_key=public_key,
+                private_key=private_key,
+                preshared_key=preshared_key,
+                ip_address=ipv4_addresses[i],
+                ipv6_address=ipv6_address,
+                has_ipv6=bool(ipv6_address),
+                endpoint=endpoint,
+                expires_at=expires_at,
+                traffic_limit=traffic_limit,
+                is_active=True,
+                is_blocked=False
+            ))
+
+        await progress("💾 Сохранение в базу...")
+        try:
+            client_ids = await self.db.add_clients_batch(clients)
+        except Exception as e:
+            self.logger.error(f"Ошибка при сохранении клиентов: {e}")
+            return BulkCreateResult(error="Ошибка при сохранении клиентов в базу")
+
+        await progress("🛰 Добавление пиров на сервер...")
+        if not await self.awg_manager.add_peers_to_server(clients):
+            # Без пиров на сервере клиенты бесполезны - откатываем создание
+            await self.db.delete_clients_batch(client_ids)
+            return BulkCreateResult(error="Ошибка при добавлении пиров на сервер")
+
+        self.logger.info(f"Создано клиентов: {count} (префикс {prefix})")
+
+        await progress("📦 Подготовка архива конфигураций и QR-кодов...")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive = await self.build_client_archive(clients)
+        return BulkCreateResult(clients=clients, archive=archive, archive_name=f"{prefix}_{timestamp}.zip")
+
+    async def build_client_archive(self, clients: List[Client]) -> bytes:
+        """ZIP с .conf и QR-кодом каждого клиента"""
+        configs = await self.awg_manager.create_client_configs(clients)
+        # Рендеринг идет в пуле image; число одновременных задач ограничено самим пулом
+        qr_codes = await asyncio.gather(*(
+            get_client_qr_png(client.id, config_text) for client, config_text in zip(clients, configs)
+        ))
+
+        files = []
+        for client, config_text, png in zip(clients, configs, qr_codes):
+            files.append((f"{client.name}.conf", config_text.encode('utf-8')))
+            files.append((f"{client.name}.png", png))
+        return await run_in_pool("archive", build_zip, files)
+
+    async def _generate_keys(self, count: int) -> List[Tuple[str, str, str]]:
+        """Ключи для count клиентов, поделенные на части по числу исполнителей пула crypto"""
+        workers = get_worker_pool("crypto").max_workers
+        chunk = -(-count // workers)
+        parts = await asyncio.gather(*(
+            run_in_pool("crypto", generate_client_keys, min(chunk, count - start))
+            for start in range(0, count, chunk)
+        ))
+        return [keys for part in parts for keys in part]
+
+    async def select_clients(self, client_filter: ClientFilter) -> List[Client]:
+        """Клиенты под фильтр: условия по таблице - в SQL, простой - по статистике интерфейса"""
+        clients = await self.db.get_clients_filtered(
+            expires_before=client_filter.expires_before,
+            traffic_percent=client_filter.traffic_percent,
+            name_prefix=client_filter.name_prefix,
+            is_blocked=client_filter.is_blocked
+        )
+        if client_filter.idle_days is None or not clients:
+            return clients
+
+        stats = await self.awg_manager.get_interface_stats()
+        threshold = client_filter.idle_days * 86400
+        now = datetime.now()
+
+        def idle_seconds(client: Client) -> float:
+            seconds = parse_handshake_seconds(stats.get(client.public_key, {}).get('latest handshake', ''))
+            if seconds is not None:
+                return seconds
+            # Без handshake клиент простаивает с момента создания
+            return (now - client.created_at).total_seconds() if client.created_at else float("inf")
+
+        return [client for client in clients if idle_seconds(client) > threshold]
+
+    async def apply_action(self, action: str, clients: List[Client],
+                           on_progress: Optional[ProgressCallback] = None) -> BulkActionResult:
+        """
+        Массовое действие над выбранными клиентами: block, unblock, extend:<срок> или delete.
+
+        Изменения пишутся одной транзакцией, пиры применяются одним пакетом
+        с одним сохранением конфигурации сервера.
+        """
+        async def progress(text: str):
+            if on_progress:
+                await on_progress(text)
+
+        result = BulkActionResult(matched=len(clients))
+
+        if action == "block":
+            targets = [client for client in clients if not client.is_blocked]
+            if targets:
+                async def removed(done: int):
+                    await progress(f"🛰 Удаление пиров с сервера: {done}/{len(targets)}")
+
+                removed_count = await self.awg_manager.remove_peers_from_server(
+                    [client.public_key for client in targets], on_progress=removed
+                )
+                if removed_count < len(targets):
+                    # Уже снятые с сервера клиенты все равно отмечаются заблокированными
+                    result.error = f"Ошибка при удалении пиров с сервера: заблокировано {removed_count} из {len(targets)}"
+                    targets = targets[:removed_count]
+                for client in targets:
+                    client.is_blocked = True
+
+        elif action == "unblock":
+            targets = [client for client in clients if client.is_blocked]
+            if targets:
+                await progress(f"🛰 Добавление пиров на сервер: {len(targets)}")
+                if not await self.awg_manager.add_peers_to_server(targets):
+                    return BulkActionResult(matched=len(clients), error="Ошибка при добавлении пиров на сервер")
+                for client in targets:
+                    client.is_blocked = False
+
+        elif action.startswith("extend:"):
+            delta = EXTEND_PERIODS.get(action.split(":", 1)[1])
+            if delta is None:
+                return BulkActionResult(matched=len(clients), error=f"Неизвестный срок продления: {action}")
+            # Клиенты без срока действия не ограничены - продлевать нечего
+            targets = [client for client in clients if client.expires_at is not None]
+            now = datetime.now()
+            for client in targets:
+                client.expires_at = max(client.expires_at, now) + delta
+
+        elif action == "delete":
+            targets = clients
+            if targets:
+                # Пиров заблокированных клиентов на сервере уже нет
+                active_keys = [client.public_key for client in targets if not client.is_blocked]
+
+                async def removed(done: int):
+                    await progress(f"🛰 Удаление пиров с сервера: {done}/{len(active_keys)}")
+
+                removed_count = await self.awg_manager.remove_peers_from_server(active_keys, on_progress=removed)
+                if removed_count < len(active_keys):
+                    # Из базы удаляются только клиенты, которых уже нет на сервере
+                    removed_keys = set(active_keys[:removed_count])
+                    result.error = f"Ошибка при удалении пиров с сервера: удалено {removed_count} из {len(active_keys)}"
+                    targets = [client for client in targets if client.is_blocked or client.public_key in removed_keys]
+
+                await progress(f"💾 Удаление из базы: {len(targets)}")
+                result.changed = await self.db.delete_clients_batch([client.id for client in targets])
+                artifact_cache = get_artifact_cache()
+                for client in targets:
+                    artifact_cache.invalidate_owner(client.id)
+            self.logger.info(f"Массовое удаление: {result.changed} клиентов")
+            return result
+
+        else:
+            return BulkActionResult(matched=len(clients), error=f"Неизвестное действие: {action}")
+
+        if targets:
+            await progress(f"💾 Сохранение изменений: {len(targets)}")
+            result.changed = await self.db.update_clients_batch(targets)
+        self.logger.info(f"Массовое действие {action}: изменено {result.changed} из {len(clients)}")
+        return result
@@ -1,89 +1,244 @@
 import asyncio
 import aiohttp
 import logging
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import time
+from typing import Optional, Dict, Any, Iterable, List, Mapping
 from config import Config
+from services.mmdb_provider import MMDBProvider, maxminddb
+from utils.geo_cache import GeoCache, get_geo_cache
+
+# Поля ответа IP-API
+IP_API_FIELDS = 'status,message,country,regionName,city,isp,org,as,query'
+# Максимум адресов в одном запросе к batch-эндпоинту
+IP_API_BATCH_MAX = 100
+# Окно сбора запросов одновременных вызовов в один пакет (сек)
+BATCH_WINDOW = 0.05
+
+
+class RateLimitState:
+    """
+    Остаток лимита эндпоинта по заголовкам ответа провайдера: X-Rl -
+    запросов до конца окна, X-Ttl - секунд до его сброса. До первого ответа
+    и после сброса окна считается доступным весь limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def acquire(self) -> bool:
+        """Занять один запрос; False - лимит исчерпан до сброса окна"""
+        if self.remaining <= 0 and time.monotonic() >= self.reset_at:
+            self.remaining = self.limit
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        try:
+            remaining = int(headers['X-Rl'])
+            ttl = int(headers['X-Ttl'])
+        except (KeyError, ValueError):
+            return
+        self.remaining = remaining
+        self.reset_at = time.monotonic() + ttl
+
+    @property
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_at - time.monotonic())
+
 
 class IPService:
-    """Сервис для работы с IP-API для получения информации о геолокации"""
+    """
+    Сервис для работы с IP-API для получения информации о геолокации.
+
+    Ответы кэшируются в GeoCache (таблица geo_cache с LRU в памяти), так
+    что повторные экраны не тратят лимит запросов. Сетевые ошибки не
+    кэшируются - следующий запрос повторит попытку.
+
+    Промахи кэша всех одновременных вызовов собираются в течение
+    BATCH_WINDOW в общую очередь: адрес, который уже запрашивается, не
+    запрашивается повторно, а очередь уходит пакетами до IP_API_BATCH_MAX
+    адресов одним POST на batch-эндпоинт (одиночный адрес - обычным GET).
+    Лимиты эндпоинтов отслеживаются по заголовкам X-Rl/X-Ttl.
+
+    Если настроена локальная база MaxMind (geo_mmdb_path), адреса сначала
+    ищутся в ней; кэш и IP-API остаются запасным путем для адресов, которых
+    в ней нет.
+    """
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, cache: Optional[GeoCache] = None):
         self.config = config
+        self.cache = cache or get_geo_cache()
         self.logger = logging.getLogger(__name__)
-        self._last_request_time = None
-        self._request_count = 0
-        self._rate_limit_reset = datetime.now()
+
+        self._single_limit = RateLimitState(config.ip_api_rate_limit)
+        self._batch_limit = RateLimitState(config.ip_api_batch_rate_limit)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        self.offline: Optional[MMDBProvider] = None
+        if config.geo_mmdb_path:
+            if maxminddb is None:
+                self.logger.warning("Пакет maxminddb не установлен, локальная база геолокации отключена")
+            else:
+                self.offline = MMDBProvider(config.geo_mmdb_path, config.geo_asn_mmdb_path,
+                                            config.geo_mmdb_check_interval)
+
+    def start(self):
+        """Загрузка локальной базы геолокации и запуск проверки ее обновлений"""
+        if self.offline is not None:
+            self.offline.start()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Общая HTTP-сессия сервиса, создается при первом запросе (внутри цикла
+        событий). Соединения переиспользуются (keep-alive), DNS кэшируется,
+        число одновременных соединений ограничено - лишние запросы ждут.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.ip_api_max_connections,
+                limit_per_host=self.config.ip_api_max_connections,
+                ttl_dns_cache=self.config.ip_api_dns_cache_ttl,
+                keepalive_timeout=self.config.ip_api_keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.config.ip_api_timeout)
+            )
+        return self._session
+
+    async def close(self):
+        """Остановка очереди запросов, закрытие HTTP-сессии и локальной базы"""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        self._dispatcher = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self.offline is not None:
+            await self.offline.close()
 
     async def get_ip_info(self, ip_address: str) -> Optional[Dict[str, Any]]:
-        """Получение информации об IP-адресе"""
-        if not await self._check_rate_limit():
-            self.logger.warning("Rate limit превышен для IP-API")
-            return None
-        
-        try:
-            url = f"{self.config.ip_api_url}/{ip_address}"
-            params = {
-                'fields': 'status,message,country,regionName,city,isp,org,as,query'
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        self._update_rate_limit()
-                        
-                        if data.get('status') == 'success':
-                            return {
-                                'country': data.get('country', 'Неизвестно'),
-                                'region': data.get('regionName', 'Неизвестно'),
-                                'city': data.get('city', 'Неизвестно'),
-                                'isp': data.get('isp', 'Неизвестно'),
-                                'org': data.get('org', 'Неизвестно'),
-                                'as': data.get('as', 'Неизвестно'),
-                                'ip': data.get('query', ip_address)
-                            }
-                        else:
-                            self.logger.error(f"IP-API вернул ошибку: {data.get('message', 'Неизвестная ошибка')}")
-                            return None
-                    else:
-                        self.logger.error(f"Ошибка HTTP при запросе IP-API: {response.status}")
-                        return None
-        
-        except asyncio.TimeoutError:
-            self.logger.error("Таймаут при запросе к IP-API")
-            return None
-        except Exception as e:
-            self.logger.error(f"Ошибка при запросе к IP-API: {e}")
-            return None
+        """Получение информации об IP-адресе (локальная база, кэш, затем IP-API)"""
+        return (await self.get_ip_info_batch([ip_address])).get(ip_address)
 
-    async def get_ip_info_batch(self, ip_addresses: list) -> Dict[str, Dict[str, Any]]:
-        """Пакетное получение информации о нескольких IP-адресах"""
-        results = {}
-        
-        for ip in ip_addresses[:5]:
-            ip_info = await self.get_ip_info(ip)
-            if ip_info:
-                results[ip] = ip_info
-            await asyncio.sleep(0.5)
-        
+    async def get_ip_info_batch(self, ip_addresses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Пакетное получение информации о нескольких IP-адресах (только найденные)"""
+        ip_addresses = list(dict.fromkeys(ip_addresses))
+        results: Dict[str, Dict[str, Any]] = {}
+        if self.offline is not None and self.offline.available:
+            results = await self.offline.lookup_many(ip_addresses)
+            ip_addresses = [ip for ip in ip_addresses if ip not in results]
+
+        cached = await self.cache.get_many(ip_addresses)
+        results.update((ip, entry.info) for ip, entry in cached.items() if entry.info is not None)
+
+        futures = self._enqueue([ip for ip in ip_addresses if ip not in cached])
+        if futures:
+            answers = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+            results.update((ip, info) for ip, info in zip(futures, answers) if info is not None)
         return results
 
-    async def _check_rate_limit(self) -> bool:
-        """Проверка ограничений по количеству запросов"""
-        now = datetime.now()
-        
-        if now >= self._rate_limit_reset:
-            self._request_count = 0
-            self._rate_limit_reset = now + timedelta(minutes=1)
-        
-        return self._request_count < self.config.ip_api_rate_limit
+    def _enqueue(self, ip_addresses: List[str]) -> Dict[str, asyncio.Future]:
+        """Постановка промахов в очередь запросов (уже запрашиваемые адреса не дублируются)"""
+        futures = {}
+        for ip in ip_addresses:
+            future = self._inflight.get(ip)
+            if future is None:
+                future = self._inflight[ip] = asyncio.get_running_loop().create_future()
+                self._queue.append(ip)
+            futures[ip] = future
+        if self._queue and (self._dispatcher is None or self._dispatcher.done()):
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        return futures
+
+    async def _dispatch(self):
+        """Отправка очереди пакетами; каждый адрес получает ответ или None"""
+        await asyncio.sleep(BATCH_WINDOW)
+        chunk: List[str] = []
+        try:
+            while self._queue:
+                chunk = self._queue[:IP_API_BATCH_MAX]
+                del self._queue[:IP_API_BATCH_MAX]
+                try:
+                    answers = await self._lookup(chunk)
+                except Exception as e:
+                    self.logger.error(f"Ошибка при запросе к IP-API: {e}")
+                    answers = {}
+                for ip in chunk:
+                    future = self._inflight.pop(ip, None)
+                    if future is not None and not future.done():
+                        future.set_result(answers.get(ip))
+                chunk = []
+        finally:
+            # Остановка бота: ожидающие вызовы получают None
+            for ip in chunk + self._queue:
+                future = self._inflight.pop(ip, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+            self._queue.clear()
+
+    async def _lookup(self, ip_addresses: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Запрос пакета к IP-API и запись окончательных ответов в кэш"""
+        single = len(ip_addresses) == 1
+        limit = self._single_limit if single else self._batch_limit
+        if not limit.acquire():
+            self.logger.warning(
+                f"Rate limit превышен для IP-API, сброс через {limit.retry_after:.0f} с "
+                f"(не запрошено адресов: {len(ip_addresses)})"
+            )
+            return {}
+
+        session = self._get_session()
+        if single:
+            request = session.get(f"{self.config.ip_api_url}/{ip_addresses[0]}",
+                                  params={'fields': IP_API_FIELDS})
+        else:
+            request = session.post(self.config.ip_api_batch_url, params={'fields': IP_API_FIELDS},
+                                   json=ip_addresses)
+        async with request as response:
+            limit.update(response.headers)
+            if response.status == 429:
+                self.logger.warning(f"IP-API: лимит запросов исчерпан, сброс через {limit.retry_after:.0f} с")
+                return {}
+            if response.status != 200:
+                self.logger.error(f"Ошибка HTTP при запросе IP-API: {response.status}")
+                return {}
+            data = await response.json()
+
+        items = [data] if single else data
+        if not isinstance(items, list) or len(items) != len(ip_addresses):
+            self.logger.error("IP-API вернул ответ неожиданного формата")
+            return {}
+
+        answers = {ip: self._parse(ip, item) for ip, item in zip(ip_addresses, items)}
+        await self.cache.put_many(answers)
+        return answers
 
-    def _update_rate_limit(self):
-        """Обновление счетчика запросов"""
-        self._request_count += 1
-        self._last_request_time = datetime.now()
+    def _parse(self, ip_address: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Ответ IP-API по одному адресу; None - адрес неизвестен провайдеру"""
+        if data.get('status') != 'success':
+            self.logger.error(f"IP-API вернул ошибку для {ip_address}: {data.get('message', 'Неизвестная ошибка')}")
+            return None
+        return {
+            'country': data.get('country', 'Неизвестно'),
+            'region': data.get('regionName', 'Неизвестно'),
+            'city': data.get('city', 'Неизвестно'),
+            'isp': data.get('isp', 'Неизвестно'),
+            'org': data.get('org', 'Неизвестно'),
+            'as': data.get('as', 'Неизвестно'),
+            'ip': data.get('query', ip_address)
+        }
 
     def format_ip_info(self, ip_info: Dict[str, Any]) -> str:
         """Форматирование информации об IP для отображения"""
@@ -111,4 +266,16 @@ class IPService:
             result += f"   📍 {info['country']}, {info['city']}\n"
             result += f"   🌐 {info['isp']}\n\n"
         
-        return result
\ No newline at end of file
+        return result
+
+
+# Глобальный экземпляр создается при первом обращении
+ip_service: Optional[IPService] = None
+
+
+def get_ip_service(config: Optional[Config] = None) -> IPService:
+    """Получение экземпляра сервиса геолокации"""
+    global ip_service
+    if ip_service is None:
+        ip_service = IPService(config or Config())
+    return ip_service
@@ -0,0 +1,263 @@
+import ipaddress
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from config import Config
+from database.database import get_db
+from services.awg_manager import PeerStatsSnapshot, get_peer_stats_snapshot
+from services.ip_service import get_ip_service
+from utils.geo_cache import get_geo_cache
+from utils.instrumentation import Instrumentation, LatencyHistogram, get_instrumentation
+from utils.traffic_parser import parse_handshake_seconds, parse_traffic_size
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Пир считается онлайн, если handshake был не позже (WireGuard обновляет его каждые 2 минуты)
+ONLINE_HANDSHAKE_SECONDS = 180
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class MetricsWriter:
+    """Построение ответа в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def header(self, name: str, kind: str, help_text: str) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        self.lines.append(f"{name}{_labels(labels or {})} {value}")
+
+    def gauge(self, name: str, value: float, help_text: str) -> None:
+        self.header(name, "gauge", help_text)
+        self.sample(name, value)
+
+    def histogram(self, name: str, help_text: str,
+                  series: Iterable[Tuple[Dict[str, str], LatencyHistogram]], errors: bool = True) -> None:
+        """Гистограммы в секундах (внутри - миллисекунды); ошибки - отдельным счетчиком"""
+        series = list(series)
+        self.header(name, "histogram", help_text)
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                self.sample(f"{name}_bucket", cumulative, {**labels, "le": f"{bound / 1000:g}"})
+            self.sample(f"{name}_bucket", histogram.count, {**labels, "le": "+Inf"})
+            self.sample(f"{name}_sum", histogram.total_ms / 1000, labels)
+            self.sample(f"{name}_count", histogram.count, labels)
+        if not errors:
+            return
+        self.header(f"{name}_errors_total", "counter", f"{help_text} (с ошибкой)")
+        for labels, histogram in series:
+            self.sample(f"{name}_errors_total", histogram.errors, labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class PeerMetrics:
+    """Разобранный снимок пиров: трафик и handshake, ключи в стабильном порядке для страниц"""
+
+    def __init__(self, snapshot: PeerStatsSnapshot):
+        self.snapshot = snapshot
+        self.keys = sorted(snapshot.peers)
+        self.transfer: Dict[str, Tuple[int, int]] = {}
+        self.handshake: Dict[str, int] = {}
+        for key, stats in snapshot.peers.items():
+            rx, _, tx = stats.get('transfer', '').partition(', ')
+            self.transfer[key] = (parse_traffic_size(rx), parse_traffic_size(tx))
+            seconds = parse_handshake_seconds(stats.get('latest handshake', ''))
+            if seconds is not None:
+                self.handshake[key] = seconds
+
+    def handshake_age(self, key: str, now: float) -> Optional[float]:
+        """Возраст handshake на текущий момент с учетом возраста снимка"""
+        seconds = self.handshake.get(key)
+        if seconds is None:
+            return None
+        return seconds + max(0.0, now - self.snapshot.taken_at)
+
+
+class MetricsServer:
+    """
+    HTTP-эндпоинт /metrics в формате Prometheus.
+
+    Данные берутся только из уже накопленного состояния: снимка awg show,
+    который обновляют проверка лимитов и экраны бота, и счетчиков
+    utils.instrumentation. Сбор метрик не вызывает awg; из БД читается
+    только число клиентов.
+
+    Метрики по пирам разбиты на страницы по peer_page_size (параметр
+    ?page=N, нумерация с 1; ?page=0 - без пиров): при десятках тысяч пиров
+    каждая страница снимается отдельным заданием Prometheus, а общие
+    метрики есть на любой странице.
+    """
+
+    def __init__(self, config: Config, instrumentation: Optional[Instrumentation] = None,
+                 peer_page_size: int = 1000):
+        self.config = config
+        self.instrumentation = instrumentation or get_instrumentation()
+        self.peer_page_size = peer_page_size
+        self.logger = logging.getLogger(__name__)
+
+        self._runner: Optional[web.AppRunner] = None
+        self._peers: Optional[PeerMetrics] = None
+
+        try:
+            network = ipaddress.ip_network(config.server_subnet, strict=False)
+            self.ip_pool_size = max(network.num_addresses - 2, 0)
+        except ValueError:
+            self.ip_pool_size = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        return app
+
+    async def start(self, host: str, port: int) -> None:
+        """Запуск HTTP-сервера"""
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            page = int(request.query.get("page", "1"))
+        except ValueError:
+            return web.Response(status=400, text="page должен быть числом\n")
+        if page < 0:
+            return web.Response(status=400, text="page должен быть >= 0\n")
+
+        body = await self.render(page)
+        return web.Response(body=body.encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    def _peer_metrics(self) -> Optional[PeerMetrics]:
+        """Разбор снимка кэшируется до появления нового"""
+        snapshot = get_peer_stats_snapshot()
+        if snapshot is None:
+            return None
+        if self._peers is None or self._peers.snapshot is not snapshot:
+            self._peers = PeerMetrics(snapshot)
+        return self._peers
+
+    async def render(self, page: int = 1) -> str:
+        writer = MetricsWriter()
+        now = time.time()
+        peers = self._peer_metrics()
+
+        self._write_server(writer, peers, now)
+        await self._write_ip_pool(writer)
+        self._write_instrumentation(writer)
+        if peers is not None and page > 0:
+            self._write_peers(writer, peers, page, now)
+        return writer.render()
+
+    def _write_server(self, writer: MetricsWriter, peers: Optional[PeerMetrics], now: float) -> None:
+        if peers is None:
+            return
+        online = sum(
+            1 for key in peers.handshake
+            if peers.handshake_age(key, now) <= ONLINE_HANDSHAKE_SECONDS
+        )
+        pages = -(-len(peers.keys) // self.peer_page_size) if self.peer_page_size else 0
+        writer.gauge("awg_stats_snapshot_age_seconds", now - peers.snapshot.taken_at,
+                     "Возраст снимка awg show, из которого взяты метрики пиров")
+        writer.gauge("awg_peers", len(peers.keys), "Пиров на интерфейсе")
+        writer.gauge("awg_peers_online", online,
+                     f"Пиров с handshake не старше {ONLINE_HANDSHAKE_SECONDS} с")
+        writer.gauge("awg_peer_pages", pages, "Страниц метрик пиров (параметр page)")
+        rx_total = sum(rx for rx, _ in peers.transfer.values())
+        tx_total = sum(tx for _, tx in peers.transfer.values())
+        writer.gauge("awg_receive_bytes", rx_total, "Получено от всех пиров (байт)")
+        writer.gauge("awg_transmit_bytes", tx_total, "Отправлено всем пирам (байт)")
+
+    async def _write_ip_pool(self, writer: MetricsWriter) -> None:
+        try:
+            clients = await get_db().get_clients_count()
+        except Exception as e:
+            self.logger.error(f"Метрики: не удалось получить число клиентов: {e}")
+            return
+        writer.gauge("awg_clients", clients, "Клиентов в базе (занятых IP-адресов)")
+        writer.gauge("awg_ip_pool_size", self.ip_pool_size, "Адресов в подсети клиентов")
+        writer.gauge("awg_ip_pool_utilization", clients / self.ip_pool_size if self.ip_pool_size else 0.0,
+                     "Доля занятых адресов подсети")
+
+    def _write_instrumentation(self, writer: MetricsWriter) -> None:
+        instrumentation = self.instrumentation
+        routes = sorted(instrumentation.routes().items())
+        writer.histogram(
+            "bot_update_duration_seconds", "Обработка обновлений по маршрутам",
+            (({"route": route}, stats.latency) for route, stats in routes)
+        )
+        writer.header("bot_update_db_queries_total", "counter", "Обращений к БД при обработке обновлений")
+        for route, stats in routes:
+            writer.sample("bot_update_db_queries_total", stats.db_queries, {"route": route})
+        writer.header("bot_update_subprocesses_total", "counter", "Запусков subprocess при обработке обновлений")
+        for route, stats in routes:
+            writer.sample("bot_update_subprocesses_total", stats.subprocesses, {"route": route})
+        writer.histogram("bot_db_query_duration_seconds", "Работа с соединением БД",
+                         [({}, instrumentation.db_latency)], errors=False)
+        writer.histogram("bot_db_pool_wait_seconds", "Ожидание соединения из пула БД",
+                         [({}, instrumentation.db_pool_wait)], errors=False)
+        writer.histogram(
+            "bot_subprocess_duration_seconds", "Выполнение внешних команд",
+            (({"command": command}, histogram)
+             for command, histogram in sorted(instrumentation.subprocess_latency.items()))
+        )
+        writer.histogram(
+            "bot_telegram_request_duration_seconds", "Запросы к Bot API",
+            (({"method": method}, histogram)
+             for method, histogram in sorted(instrumentation.telegram_latency.items()))
+        )
+        writer.histogram("bot_limit_sweep_duration_seconds", "Проход проверки лимитов клиентов",
+                         [({}, instrumentation.sweep_latency)])
+
+        geo_stats = get_geo_cache().get_stats()
+        writer.header("bot_geo_lookups_total", "counter", "Запросы геолокации IP по источнику ответа")
+        for result in ('memory_hits', 'db_hits', 'negative_hits', 'private', 'misses'):
+            writer.sample("bot_geo_lookups_total", geo_stats[result], {"result": result})
+        writer.gauge("bot_geo_cache_memory_entries", geo_stats['memory_entries'],
+                     "Записей геолокации в памяти")
+        offline = get_ip_service().offline
+        if offline is not None:
+            writer.gauge("bot_geo_offline_available", int(offline.available),
+                         "Локальная база геолокации загружена")
+            writer.header("bot_geo_offline_lookups_total", "counter", "Поиски в локальной базе геолокации")
+            writer.sample("bot_geo_offline_lookups_total", offline.hits, {"result": "found"})
+            writer.sample("bot_geo_offline_lookups_total", offline.lookups - offline.hits, {"result": "missing"})
+
+    def _write_peers(self, writer: MetricsWriter, peers: PeerMetrics, page: int, now: float) -> None:
+        start = (page - 1) * self.peer_page_size
+        keys = peers.keys[start:start + self.peer_page_size]
+        if not keys:
+            return
+        writer.header("awg_peer_receive_bytes", "gauge", "Получено от пира (байт)")
+        for key in keys:
+            writer.sample("awg_peer_receive_bytes", peers.transfer[key][0], {"peer": key})
+        writer.header("awg_peer_transmit_bytes", "gauge", "Отправлено пиру (байт)")
+        for key in keys:
+            writer.sample("awg_peer_transmit_bytes", peers.transfer[key][1], {"peer": key})
+        writer.header("awg_peer_handshake_age_seconds", "gauge", "Время с последнего handshake пира")
+        for key in keys:
+            age = peers.handshake_age(key, now)
+            if age is not None:
+                writer.sample("awg_peer_handshake_age_seconds", age, {"peer": key})
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+# Отображение файла в память: через C-расширение libmaxminddb, если оно собрано
+# (в разы быстрее), иначе - чистый Python поверх mmap
+try:
+    import maxminddb.extension
+    MMDB_MODE = maxminddb.MODE_MMAP_EXT
+except ImportError:
+    MMDB_MODE = maxminddb.MODE_MMAP if maxminddb is not None else None
+
+# Поиск по многим адресам отдает управление циклу событий каждые N адресов
+LOOKUP_YIELD_EVERY = 1000
+
+
+class MMDBFile:
+    """
+    Файл базы в формате MaxMind (.mmdb), читаемый через отображение в память.
+
+    refresh() открывает файл заново, если изменились его mtime, размер или
+    inode; прежний читатель закрывается. Файл нужно обновлять заменой
+    (запись во временный файл и rename, как делает geoipupdate): запись
+    поверх открытого файла портит отображение.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reader = None
+        self.logger = logging.getLogger(__name__)
+        self._signature: Optional[Tuple[int, int, int]] = None
+
+    def refresh(self) -> bool:
+        """Открыть или перечитать файл; True - загружена новая версия"""
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            if self.reader is None:
+                self.logger.error(f"База геолокации {self.path} недоступна: {e}")
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self._signature:
+            return False
+
+        try:
+            reader = maxminddb.open_database(self.path, MMDB_MODE)
+        except Exception as e:
+            # Файл мог быть недописан - повторим при следующей проверке
+            self.logger.error(f"Не удалось открыть базу геолокации {self.path}: {e}")
+            return False
+
+        previous, self.reader, self._signature = self.reader, reader, signature
+        if previous is not None:
+            previous.close()
+        self.logger.info(
+            f"База геолокации {self.path} загружена: {reader.metadata().database_type}, "
+            f"сборка {reader.metadata().build_epoch}"
+        )
+        return True
+
+    def get(self, ip: str) -> Optional[Dict[str, Any]]:
+        if self.reader is None:
+            return None
+        try:
+            return self.reader.get(ip)
+        except ValueError:
+            # Не IP-адрес или IPv6 в базе только с IPv4
+            return None
+
+    def close(self) -> None:
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+            self._signature = None
+
+
+def _name(record: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not record:
+        return None
+    return record.get('names', {}).get('en')
+
+
+class MMDBProvider:
+    """
+    Локальная геолокация по базам MaxMind: города (GeoLite2-City или
+    совместимая, например DB-IP City Lite) и, необязательно, провайдеров
+    (GeoLite2-ASN).
+
+    Поиск выполняется в памяти за микросекунды, без сети и лимитов.
+    Результат имеет тот же вид, что и ответ IP-API; адрес, которого нет в
+    базе городов, возвращается как None. Файлы проверяются на обновление
+    раз в check_interval и перечитываются без остановки бота.
+    """
+
+    def __init__(self, city_path: str, asn_path: str = "", check_interval: float = 60.0):
+        self.city = MMDBFile(city_path) if city_path else None
+        self.asn = MMDBFile(asn_path) if asn_path else None
+        self.files = [file for file in (self.city, self.asn) if file is not None]
+        self.check_interval = check_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.lookups = 0
+        self.hits = 0
+        self.reloads = 0
+
+    @property
+    def available(self) -> bool:
+        return self.city is not None and self.city.reader is not None
+
+    def refresh(self) -> bool:
+        """Загрузка изменившихся файлов; True - хотя бы один перечитан"""
+        reloaded = False
+        for file in self.files:
+            if file.refresh():
+                reloaded = True
+        if reloaded:
+            self.reloads += 1
+        return reloaded
+
+    def start(self):
+        """Загрузка баз и запуск проверки обновлений файлов"""
+        self.refresh()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        """Остановка проверки обновлений и закрытие баз"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for file in self.files:
+            file.close()
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Ошибка проверки обновления базы геолокации: {e}")
+
+    def lookup(self, ip_address: str) -> Optional[Dict[str, Any]]:
+        """Геолокация адреса или None, если его нет в базе городов"""
+        self.lookups += 1
+        record = self.city.get(ip_address) if self.city is not None else None
+        if not record or 'country' not in record:
+            return None
+        self.hits += 1
+
+        subdivisions = record.get('subdivisions') or [None]
+        asn = (self.asn.get(ip_address) if self.asn is not None else None) or {}
+        organization = asn.get('autonomous_system_organization')
+        number = asn.get('autonomous_system_number')
+        return {
+            'country': _name(record.get('country')) or 'Неизвестно',
+            'region': _name(subdivisions[0]) or 'Неизвестно',
+            'city': _name(record.get('city')) or 'Неизвестно',
+            'isp': organization or 'Неизвестно',
+            'org': organization or 'Неизвестно',
+            'as': f"AS{number} {organization or ''}".strip() if number else 'Неизвестно',
+            'ip': ip_address
+        }
+
+    async def lookup_many(self, ip_addresses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Геолокация многих адресов (только найденные), не блокируя цикл событий надолго"""
+        results = {}
+        for i, ip in enumerate(ip_addresses, 1):
+            info = self.lookup(ip)
+            if info is not None:
+                results[ip] = info
+            if i % LOOKUP_YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики локальной базы"""
+        return {
+            'available': self.available,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'reloads': self.reloads,
+        }
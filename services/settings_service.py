@@ -3,6 +3,8 @@ from typing import Optional, List
 import ipaddress
 import re
 from database.database import get_db, BotSettings
+from utils.vpn_converter import get_endpoint_resolver, is_ip_address
+from utils.artifact_cache import get_artifact_cache
 
 class SettingsService:
     """Сервис для управления настройками бота"""
@@ -18,11 +20,15 @@ class SettingsService:
     
     async def set_default_dns(self, dns_servers: str) -> bool:
         """Установить DNS серверы по умолчанию"""
-        return await self.db.set_setting(
+        success = await self.db.set_setting(
             'default_dns', 
             dns_servers, 
             'DNS сервера по умолчанию'
         )
+        if success:
+            # DNS входит в профиль сервера всех конфигураций - готовые QR/vpn:// устарели
+            get_artifact_cache().clear()
+        return success
     
     async def get_default_endpoint(self) -> Optional[str]:
         """Получить endpoint по умолчанию"""
@@ -30,8 +36,18 @@ class SettingsService:
         return endpoint if endpoint and endpoint.strip() else None
     
     async def set_default_endpoint(self, endpoint: str) -> bool:
-        """Установить endpoint по умолчанию"""
-        return await self.db.set_setting('default_endpoint', endpoint, 'Endpoint по умолчанию')
+        """Установить endpoint по умолчанию (доменное имя сразу разрешается в кэш)"""
+        success = await self.db.set_setting('default_endpoint', endpoint, 'Endpoint по умолчанию')
+        endpoint = endpoint.strip()
+        if success and endpoint and not is_ip_address(endpoint):
+            resolver = get_endpoint_resolver()
+            resolver.invalidate(endpoint)
+            ip = await resolver.resolve(endpoint)
+            if ip:
+                self.logger.info(f"Endpoint по умолчанию {endpoint} разрешен в {ip}")
+            else:
+                self.logger.warning(f"Endpoint по умолчанию {endpoint} пока не разрешается в IP")
+        return success
     
     def validate_dns_servers(self, dns_servers: str) -> bool:
         """Проверить корректность DNS серверов"""
@@ -0,0 +1,174 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+import time
+from contextlib import suppress
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import Config
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram через webhook на встроенном aiohttp-сервере.
+
+    Запрос без верного секретного токена отклоняется (401). Обновление
+    обрабатывается в фоне, но не больше max_concurrency одновременно: при
+    заполнении лимита ответ Telegram задерживается до освобождения места,
+    и Telegram сам снижает темп доставки. При остановке новые запросы
+    отклоняются (503, Telegram повторит их позже), а уже принятые
+    обновления дорабатываются в пределах drain_timeout.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str,
+                 max_concurrency: int = 16, drain_timeout: float = 30.0):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_concurrency = max_concurrency
+        self.drain_timeout = drain_timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self._site: Optional[web.TCPSite] = None
+        self._closing = False
+
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_process_time = 0.0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def start(self, host: str, port: int) -> None:
+        """Запуск HTTP-сервера"""
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        self._site = web.TCPSite(self._runner, host, port)
+        await self._site.start()
+        self.logger.info(f"Webhook-сервер слушает {host}:{port}{self.path}")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Прием одного обновления"""
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self._closing:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate_json(await request.read(), context={"bot": self.bot})
+        except ValueError as e:
+            self.rejected += 1
+            self.logger.warning(f"Некорректное обновление webhook: {e}")
+            return web.Response(status=400)
+
+        # Ожидание свободного места - обратное давление на Telegram
+        await self._slots.acquire()
+        if self._closing:
+            # Остановка началась, пока запрос ждал места: обработку уже не дождутся
+            self._slots.release()
+            return web.Response(status=503)
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update) -> None:
+        started = time.monotonic()
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            self.logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self.total_process_time += time.monotonic() - started
+            self._slots.release()
+
+    async def stop(self) -> None:
+        """Остановка приема и доработка принятых обновлений"""
+        self._closing = True
+        if self._tasks:
+            self.logger.info(f"Ожидание обработки {len(self._tasks)} обновлений...")
+            _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.logger.warning(f"Не дождались обработки {len(pending)} обновлений, они отменены")
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            self._site = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """Метрики приема обновлений"""
+        finished = self.processed + self.failed
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'in_flight': len(self._tasks),
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_process_ms': self.total_process_time / finished * 1000 if finished else 0.0,
+        }
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, config: Config) -> None:
+    """
+    Работа в режиме webhook до сигнала SIGINT/SIGTERM.
+
+    Webhook регистрируется при каждом запуске; без заданного секрета
+    используется случайный токен на время работы процесса.
+    """
+    logger = logging.getLogger(__name__)
+    secret_token = config.webhook_secret or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        dispatcher,
+        bot,
+        path=config.webhook_path,
+        secret_token=secret_token,
+        max_concurrency=config.update_concurrency,
+        drain_timeout=config.webhook_drain_timeout
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    workflow_data = {"dispatcher": dispatcher, "bots": [bot], **dispatcher.workflow_data}
+    await dispatcher.emit_startup(bot=bot, **workflow_data)
+    await server.start(config.webhook_host, config.webhook_port)
+    try:
+        await bot.set_webhook(
+            url=config.webhook_url,
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=config.webhook_max_connections
+        )
+        logger.info(f"Webhook установлен: {config.webhook_url}")
+        await stop_event.wait()
+        logger.info("Получен сигнал завершения работы")
+    finally:
+        # Webhook не снимается: обновления, пришедшие во время остановки, Telegram доставит позже
+        await server.stop()
+        await dispatcher.emit_shutdown(bot=bot, **workflow_data)
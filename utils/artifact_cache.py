@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Hashable, Optional
+
+import aiofiles
+
+from . import qr_generator
+from .vpn_converter import encode_vpn_url, resolve_conf_endpoints
+from .workers import run_in_pool
+
+
+def artifact_key(kind: str, content: str) -> str:
+    """Ключ артефакта: хеш содержимого, из которого он построен"""
+    return hashlib.sha256(f"{kind}\n{content}".encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Кэш сгенерированных артефактов (PNG QR-кодов, vpn:// строк) по хешу содержимого.
+
+    В памяти - LRU, ограниченный суммарным размером в байтах. Вытесненные
+    записи при заданном spill_dir сохраняются на диск (тоже с ограничением
+    размера) и поднимаются обратно в память при повторном обращении.
+
+    Ключ зависит от полного текста конфигурации, поэтому смена ключей,
+    endpoint или профиля сервера дает новый ключ. Записи владельца (клиента)
+    отслеживаются, и устаревшая запись удаляется, как только для того же
+    владельца и вида артефакта появляется новая.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, spill_dir: Optional[str] = None,
+                 max_spill_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_spill_bytes = max_spill_bytes
+        self.logger = logging.getLogger(__name__)
+
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._spilled: "OrderedDict[str, int]" = OrderedDict()
+        self._spill_size = 0
+        self._owners: Dict[tuple, str] = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes: Optional[int] = None, spill_dir: Optional[str] = None,
+                  max_spill_bytes: Optional[int] = None):
+        """Изменение параметров кэша (из конфигурации при запуске)"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if spill_dir is not None:
+            self.spill_dir = Path(spill_dir) if spill_dir else None
+        if max_spill_bytes is not None:
+            self.max_spill_bytes = max_spill_bytes
+        if self.spill_dir:
+            # Артефакты содержат приватные ключи клиентов
+            self.spill_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            self._index_spill()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Артефакт по ключу (из памяти или с диска) или None"""
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+        if key in self._spilled:
+            path = self.spill_dir / key
+            try:
+                async with aiofiles.open(path, 'rb') as f:
+                    data = await f.read()
+            except FileNotFoundError:
+                data = None
+            except OSError as e:
+                self.logger.warning(f"Ошибка чтения артефакта с диска: {e}")
+                data = None
+
+            if data is not None:
+                self.disk_hits += 1
+                self._remove_spilled(key)
+                await self.put(key, data)
+                return data
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, data: bytes, owner: Optional[Hashable] = None, kind: str = "") -> None:
+        """Сохранить артефакт; owner/kind связывают запись с клиентом для инвалидации"""
+        if owner is not None:
+            owner_key = (owner, kind)
+            previous = self._owners.get(owner_key)
+            if previous is not None and previous != key:
+                self.discard(previous)
+            self._owners[owner_key] = key
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        if len(data) > self.max_bytes:
+            return
+
+        self._entries[key] = data
+        self._size += len(data)
+
+        while self._size > self.max_bytes:
+            old_key, old_data = self._entries.popitem(last=False)
+            self._size -= len(old_data)
+            self.evictions += 1
+            await self._spill(old_key, old_data)
+
+    def discard(self, key: str) -> None:
+        """Удалить артефакт из памяти и с диска"""
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self._size -= len(data)
+        self._remove_spilled(key)
+
+    def invalidate_owner(self, owner: Hashable) -> None:
+        """Удалить все артефакты владельца (клиент удален, перевыпущены ключи и т.п.)"""
+        for owner_key in [k for k in self._owners if k[0] == owner]:
+            self.discard(self._owners.pop(owner_key))
+
+    def clear(self) -> None:
+        """Полная очистка кэша (например, после изменения профиля сервера)"""
+        self._entries.clear()
+        self._size = 0
+        self._owners.clear()
+        for key in list(self._spilled):
+            self._remove_spilled(key)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Метрики кэша для мониторинга"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'spilled': len(self._spilled),
+            'spilled_bytes': self._spill_size,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    async def _spill(self, key: str, data: bytes) -> None:
+        """Сохранение вытесненной записи на диск с удалением самых старых файлов сверх лимита"""
+        if not self.spill_dir or len(data) > self.max_spill_bytes:
+            return
+        if key in self._spilled:
+            # Содержимое по ключу неизменно - файл уже на диске
+            self._spilled.move_to_end(key)
+            return
+        try:
+            async with aiofiles.open(self.spill_dir / key, 'wb') as f:
+                await f.write(data)
+        except OSError as e:
+            self.logger.warning(f"Ошибка записи артефакта на диск: {e}")
+            return
+
+        self._spilled[key] = len(data)
+        self._spill_size += len(data)
+        while self._spill_size > self.max_spill_bytes:
+            self._remove_spilled(next(iter(self._spilled)))
+
+    def _remove_spilled(self, key: str) -> None:
+        """Удаление файла записи с диска"""
+        size = self._spilled.pop(key, None)
+        if size is None:
+            return
+        self._spill_size -= size
+        (self.spill_dir / key).unlink(missing_ok=True)
+
+    def _index_spill(self) -> None:
+        """Учет файлов, оставшихся на диске с прошлого запуска (от старых к новым)"""
+        files = []
+        with os.scandir(self.spill_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        self._spilled.clear()
+        self._spill_size = 0
+        for _, name, size in sorted(files):
+            self._spilled[name] = size
+            self._spill_size += size
+        while self._spill_size > self.max_spill_bytes:
+            self._remove_spilled(next(iter(self._spilled)))
+
+
+# Глобальный экземпляр кэша артефактов
+artifact_cache = ArtifactCache()
+
+
+def get_artifact_cache() -> ArtifactCache:
+    """Получение экземпляра кэша артефактов"""
+    return artifact_cache
+
+
+def qr_artifact_key(config_text: str) -> str:
+    """Ключ QR-кода конфигурации: зависит и от текущих параметров рендеринга"""
+    return artifact_key("qr", f"{qr_generator.qr_render_options()}\n{config_text}")
+
+
+async def get_client_qr_png(client_id: int, config_text: str) -> bytes:
+    """PNG QR-кода конфигурации клиента (из кэша или с генерацией)"""
+    key = qr_artifact_key(config_text)
+    png = await artifact_cache.get(key)
+    if png is None:
+        png = await run_in_pool(
+            "image", qr_generator.render_qr, config_text,
+            qr_generator.qr_backend, qr_generator.qr_box_size
+        )
+    await artifact_cache.put(key, png, owner=client_id, kind="qr")
+    return png
+
+
+async def get_client_vpn_url(client_id: int, config_text: str) -> str:
+    """vpn:// строка конфигурации клиента (из кэша или с генерацией)"""
+    # Ключ строится по конфигурации с уже разрешенным endpoint: смена IP дает новый артефакт
+    processed = await resolve_conf_endpoints(config_text)
+    key = artifact_key("vpn", processed)
+    data = await artifact_cache.get(key)
+    if data is None:
+        data = (await run_in_pool("archive", encode_vpn_url, processed)).encode('ascii')
+    await artifact_cache.put(key, data, owner=client_id, kind="vpn")
+    return data.decode('ascii')
@@ -0,0 +1,138 @@
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.state import State
+
+# Лимит Telegram на callback_data кнопки
+CALLBACK_DATA_LIMIT = 64
+SEPARATOR = ":"
+
+# Тип аргумента: int, str или набор допустимых строк
+ArgType = Union[type, Tuple[str, ...]]
+
+
+def pack_callback(action: str, *args: Any) -> str:
+    """
+    callback_data вида "действие:арг1:арг2".
+
+    Разделитель допустим только в последнем аргументе (он забирает остаток
+    строки при разборе). Превышение лимита Telegram - ошибка при построении
+    клавиатуры, а не молча обрезанная кнопка. Также, когда обработчики
+    зарегистрированы, ошибкой считается неизвестное действие, неверное число
+    или тип аргументов: такая кнопка не дошла бы ни до одного обработчика.
+    """
+    parts = [action, *(str(arg) for arg in args)]
+    if any(SEPARATOR in part for part in parts[:-1]):
+        raise ValueError(f"Разделитель '{SEPARATOR}' в callback_data допустим только в последнем аргументе: {parts}")
+    data = SEPARATOR.join(parts)
+    if len(data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    if callback_registry and callback_registry.parse(data) is None:
+        raise ValueError(f"callback_data не соответствует зарегистрированным действиям: {data}")
+    return data
+
+
+def _convert(raw: str, arg_type: ArgType) -> Any:
+    if arg_type is int:
+        # Только десятичные цифры: без знаков, пробелов и не-ASCII цифр
+        if not (raw.isascii() and raw.isdigit()):
+            raise ValueError(raw)
+        return int(raw)
+    if isinstance(arg_type, tuple):
+        if raw not in arg_type:
+            raise ValueError(raw)
+        return raw
+    if not raw:
+        raise ValueError(raw)
+    return raw
+
+
+class CallbackEntry(NamedTuple):
+    """Зарегистрированное действие кнопки"""
+    action: str
+    handler: CallableObject
+    arg_names: Tuple[str, ...]
+    arg_types: Tuple[ArgType, ...]
+    state: Optional[str]
+
+
+class CallbackRoute(NamedTuple):
+    """Разобранная callback_data: действие, типизированные аргументы и обработчик"""
+    action: str
+    args: Dict[str, Any]
+    entry: CallbackEntry
+
+
+class CallbackRegistry:
+    """
+    Маршрутизация нажатий кнопок по словарю действий.
+
+    Обработчик регистрируется на действие с именованными типизированными
+    аргументами: @callbacks.route("client_details", client_id=int). Разбор -
+    одно деление строки и поиск действия в словаре, без перебора фильтров;
+    неизвестное действие, лишние или некорректные аргументы дают None еще до
+    вызова обработчика. Аргументы передаются обработчику по именам.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CallbackEntry] = {}
+
+    def route(self, action: str, /, state: Optional[State] = None, **arg_types: ArgType) -> Callable:
+        """Регистрация обработчика действия (декораторы можно складывать)"""
+        if SEPARATOR in action:
+            raise ValueError(f"Недопустимое действие: {action}")
+
+        def decorator(handler: Callable) -> Callable:
+            if action in self._entries:
+                raise ValueError(f"Действие {action} уже зарегистрировано")
+            self._entries[action] = CallbackEntry(
+                action=action,
+                handler=CallableObject(handler),
+                arg_names=tuple(arg_types),
+                arg_types=tuple(arg_types.values()),
+                state=state.state if state is not None else None,
+            )
+            return handler
+
+        return decorator
+
+    def parse(self, data: Optional[str]) -> Optional[CallbackRoute]:
+        """Разбор callback_data; None - неизвестное действие или некорректные аргументы"""
+        if not data:
+            return None
+        action, separator, rest = data.partition(SEPARATOR)
+        entry = self._entries.get(action)
+        if entry is None:
+            return None
+
+        if not entry.arg_types:
+            return CallbackRoute(action, {}, entry) if not separator else None
+        if not separator:
+            return None
+        raw_args = rest.split(SEPARATOR, len(entry.arg_types) - 1)
+        if len(raw_args) != len(entry.arg_types):
+            return None
+        try:
+            args = {
+                name: _convert(raw, arg_type)
+                for name, raw, arg_type in zip(entry.arg_names, raw_args, entry.arg_types)
+            }
+        except ValueError:
+            return None
+        return CallbackRoute(action, args, entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def entries(self) -> Tuple[CallbackEntry, ...]:
+        """Зарегистрированные действия в порядке регистрации"""
+        return tuple(self._entries.values())
+
+
+# Глобальный реестр действий кнопок
+callback_registry = CallbackRegistry()
+
+
+def get_callback_registry() -> CallbackRegistry:
+    """Получение экземпляра реестра действий кнопок"""
+    return callback_registry
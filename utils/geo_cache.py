@@ -0,0 +1,166 @@
+import ipaddress
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from database.database import get_db
+
+
+class GeoEntry(NamedTuple):
+    """Запись кэша геолокации: info None - неудачный ответ или непубличный адрес"""
+    info: Optional[Dict[str, Any]]
+    expires_at: float
+
+
+def is_public_ip(ip: str) -> bool:
+    """Адрес, который имеет смысл геолокировать (не частный, не служебный)"""
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+class GeoCache:
+    """
+    Кэш геолокации IP-адресов.
+
+    Результаты хранятся в таблице geo_cache (переживают перезапуск) с LRU в
+    памяти перед ней. Успешный ответ живет ttl, неудачный (провайдер не знает
+    адрес) - negative_ttl. Частные и служебные адреса считаются неудачными
+    сразу, без БД и внешних запросов. Истекшие строки удаляются из таблицы
+    не чаще раза в evict_interval при записи.
+    """
+
+    def __init__(self, ttl: float = 7 * 24 * 3600, negative_ttl: float = 3600.0,
+                 max_memory_entries: int = 4096, evict_interval: float = 3600.0):
+        self.db = get_db()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_memory_entries = max_memory_entries
+        self.evict_interval = evict_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._memory: "OrderedDict[str, GeoEntry]" = OrderedDict()
+        self._last_evict = 0.0
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.negative_hits = 0
+        self.private = 0
+        self.misses = 0
+
+    def configure(self, ttl: Optional[float] = None, negative_ttl: Optional[float] = None,
+                  max_memory_entries: Optional[int] = None):
+        """Изменение параметров кэша (из конфигурации при запуске)"""
+        if ttl is not None:
+            self.ttl = ttl
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        if max_memory_entries is not None:
+            self.max_memory_entries = max_memory_entries
+
+    async def get(self, ip: str) -> Optional[GeoEntry]:
+        """Запись для адреса или None, если его нужно запросить у провайдера"""
+        return (await self.get_many([ip])).get(ip)
+
+    async def get_many(self, ips: Iterable[str]) -> Dict[str, GeoEntry]:
+        """Записи для адресов, найденных в кэше; отсутствующие в результате - промахи"""
+        now = time.time()
+        found: Dict[str, GeoEntry] = {}
+        unknown = []
+        for ip in dict.fromkeys(ips):
+            if not is_public_ip(ip):
+                self.private += 1
+                found[ip] = GeoEntry(None, float("inf"))
+                continue
+            entry = self._memory.get(ip)
+            if entry is not None and entry.expires_at > now:
+                self._memory.move_to_end(ip)
+                self._count_hit(entry, memory=True)
+                found[ip] = entry
+            else:
+                unknown.append(ip)
+
+        if unknown:
+            try:
+                rows = await self.db.get_geo_records(unknown, int(now))
+            except Exception as e:
+                self.logger.error(f"Ошибка чтения кэша геолокации: {e}")
+                rows = []
+            for ip, data, expires_at in rows:
+                entry = GeoEntry(json.loads(data) if data is not None else None, expires_at)
+                self._remember(ip, entry)
+                self._count_hit(entry, memory=False)
+                found[ip] = entry
+            self.misses += len(unknown) - len(rows)
+        return found
+
+    async def put(self, ip: str, info: Optional[Dict[str, Any]]) -> None:
+        """Запомнить ответ провайдера (None - адрес неизвестен провайдеру)"""
+        await self.put_many({ip: info})
+
+    async def put_many(self, results: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        now = time.time()
+        rows = []
+        for ip, info in results.items():
+            entry = GeoEntry(info, now + (self.ttl if info is not None else self.negative_ttl))
+            self._remember(ip, entry)
+            rows.append((ip, json.dumps(info, ensure_ascii=False) if info is not None else None,
+                         int(entry.expires_at)))
+        try:
+            await self.db.write_geo_records(rows)
+            if now - self._last_evict >= self.evict_interval:
+                await self.evict()
+        except Exception as e:
+            self.logger.error(f"Ошибка записи кэша геолокации: {e}")
+
+    async def evict(self) -> int:
+        """Удаление истекших записей из памяти и БД"""
+        now = time.time()
+        self._last_evict = now
+        for ip in [ip for ip, entry in self._memory.items() if entry.expires_at <= now]:
+            del self._memory[ip]
+        deleted = await self.db.delete_geo_records_before(int(now))
+        if deleted:
+            self.logger.info(f"Удалено истекших записей геолокации: {deleted}")
+        return deleted
+
+    def _remember(self, ip: str, entry: GeoEntry) -> None:
+        self._memory[ip] = entry
+        self._memory.move_to_end(ip)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _count_hit(self, entry: GeoEntry, memory: bool) -> None:
+        if entry.info is None:
+            self.negative_hits += 1
+        elif memory:
+            self.memory_hits += 1
+        else:
+            self.db_hits += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики кэша: попадания в память, БД, неудачные ответы и промахи"""
+        hits = self.memory_hits + self.db_hits + self.negative_hits + self.private
+        lookups = hits + self.misses
+        return {
+            'lookups': lookups,
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'negative_hits': self.negative_hits,
+            'private': self.private,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+
+# Глобальный экземпляр кэша геолокации
+geo_cache = GeoCache()
+
+
+def get_geo_cache() -> GeoCache:
+    """Получение экземпляра кэша геолокации"""
+    return geo_cache
@@ -0,0 +1,210 @@
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+# Границы корзин гистограмм задержек (мс); последняя корзина - все, что больше
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Корзины для проверки лимитов (обход всех клиентов - секунды и минуты)
+SWEEP_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+# Предел числа маршрутов: остальные учитываются под OTHER_ROUTE
+MAX_ROUTES = 200
+OTHER_ROUTE = "other"
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами, счетчиком ошибок и максимумом"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def observe(self, elapsed_ms: float, error: bool = False) -> None:
+        self.counts[bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попал (мс)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+@dataclass
+class UpdateTrace:
+    """Счетчики обработки одного обновления (запросы к БД и subprocess внутри него)"""
+    route: str
+    db_queries: int = 0
+    db_time: float = 0.0
+    subprocesses: int = 0
+    subprocess_time: float = 0.0
+
+
+class RouteStats:
+    """Накопленные метрики маршрута: задержки обновлений и вызванная ими работа"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.db_queries = 0
+        self.subprocesses = 0
+        self.slow = 0
+
+
+# Трассировка текущего обновления (None - фоновая работа вне обработчиков)
+current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("current_trace", default=None)
+
+
+class Instrumentation:
+    """
+    Метрики обработки обновлений по маршрутам.
+
+    Маршрут - действие кнопки, команда или состояние FSM. Для каждого
+    маршрута ведется гистограмма задержек с ошибками, а также суммарное
+    число запросов к БД и subprocess, выполненных во время его обновлений:
+    так видны обработчики, которые повторяют дорогие вызовы (например
+    несколько awg show на один экран). Обновления дольше slow_update_ms
+    пишутся в лог с разбивкой.
+
+    Запросы к БД и subprocess учитываются и глобально (вместе с фоновыми
+    задачами) - отдельными гистограммами для экспорта метрик.
+    """
+
+    def __init__(self, slow_update_ms: float = 1000.0):
+        self.slow_update_ms = slow_update_ms
+        self.logger = logging.getLogger(__name__)
+
+        self._routes: Dict[str, RouteStats] = {}
+        self.db_latency = LatencyHistogram()
+        self.db_pool_wait = LatencyHistogram()
+        self.subprocess_latency: Dict[str, LatencyHistogram] = {}
+        self.telegram_latency: Dict[str, LatencyHistogram] = {}
+        self.sweep_latency = LatencyHistogram(SWEEP_BUCKETS_MS)
+
+    def configure(self, slow_update_ms: Optional[float] = None):
+        """Изменение параметров (из конфигурации при запуске)"""
+        if slow_update_ms is not None:
+            self.slow_update_ms = slow_update_ms
+
+    def _route_stats(self, route: str) -> RouteStats:
+        stats = self._routes.get(route)
+        if stats is None:
+            if len(self._routes) >= MAX_ROUTES:
+                route = OTHER_ROUTE
+                stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+        return stats
+
+    def record_update(self, trace: UpdateTrace, elapsed: float, error: bool = False) -> None:
+        """Учет завершенного обновления"""
+        elapsed_ms = elapsed * 1000
+        stats = self._route_stats(trace.route)
+        stats.latency.observe(elapsed_ms, error)
+        stats.db_queries += trace.db_queries
+        stats.subprocesses += trace.subprocesses
+
+        if elapsed_ms >= self.slow_update_ms:
+            stats.slow += 1
+            self.logger.warning(
+                f"Медленное обновление {trace.route}: {elapsed_ms:.0f} мс, "
+                f"БД: {trace.db_queries} запр. ({trace.db_time * 1000:.0f} мс), "
+                f"subprocess: {trace.subprocesses} ({trace.subprocess_time * 1000:.0f} мс)"
+                f"{', с ошибкой' if error else ''}"
+            )
+
+    def record_db_query(self, elapsed: float, wait: float = 0.0) -> None:
+        """Учет обращения к БД: время работы с соединением и ожидание соединения (сек)"""
+        self.db_latency.observe(elapsed * 1000)
+        self.db_pool_wait.observe(wait * 1000)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.db_queries += 1
+            trace.db_time += elapsed
+
+    def record_subprocess(self, command: str, elapsed: float, error: bool = False) -> None:
+        """Учет выполненной внешней команды (сек)"""
+        histogram = self.subprocess_latency.get(command)
+        if histogram is None:
+            histogram = self.subprocess_latency[command] = LatencyHistogram()
+        histogram.observe(elapsed * 1000, error)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.subprocesses += 1
+            trace.subprocess_time += elapsed
+
+    def record_telegram_request(self, method: str, elapsed: float, error: bool = False) -> None:
+        """Учет запроса к Bot API (сек)"""
+        histogram = self.telegram_latency.get(method)
+        if histogram is None:
+            histogram = self.telegram_latency[method] = LatencyHistogram()
+        histogram.observe(elapsed * 1000, error)
+
+    def record_sweep(self, elapsed: float, error: bool = False) -> None:
+        """Учет прохода фоновой проверки лимитов (сек)"""
+        self.sweep_latency.observe(elapsed * 1000, error)
+
+    def routes(self) -> Dict[str, RouteStats]:
+        """Метрики всех маршрутов"""
+        return dict(self._routes)
+
+    def get_stats(self, top: int = 5) -> Dict[str, Any]:
+        """Сводка для экрана статистики: самые медленные маршруты по p95"""
+        slowest: List[Dict[str, Any]] = []
+        for route, stats in self._routes.items():
+            count = stats.latency.count
+            slowest.append({
+                'route': route,
+                'count': count,
+                'errors': stats.latency.errors,
+                'slow': stats.slow,
+                'p95_ms': stats.latency.quantile(0.95),
+                'max_ms': stats.latency.max_ms,
+                'db_per_update': stats.db_queries / count if count else 0.0,
+                'subprocess_per_update': stats.subprocesses / count if count else 0.0,
+            })
+        slowest.sort(key=lambda item: item['p95_ms'], reverse=True)
+        return {
+            'updates': sum(stats.latency.count for stats in self._routes.values()),
+            'errors': sum(stats.latency.errors for stats in self._routes.values()),
+            'slow': sum(stats.slow for stats in self._routes.values()),
+            'slowest': slowest[:top],
+            'db_queries': self.db_latency.count,
+            'db_avg_ms': self.db_latency.avg_ms,
+            'subprocesses': sum(h.count for h in self.subprocess_latency.values()),
+        }
+
+
+def subprocess_command(args: Sequence[Any]) -> str:
+    """Метка команды для метрик: исполняемый файл и подкоманда, без sudo и аргументов"""
+    parts = [str(arg) for arg in args]
+    if parts and parts[0] == "sudo":
+        parts = parts[1:]
+    return " ".join(parts[:2])
+
+
+# Глобальный экземпляр метрик
+instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    """Получение экземпляра метрик обработки обновлений"""
+    return instrumentation
@@ -1,38 +1,152 @@
 import io
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
 import qrcode
+from PIL import Image
 from qrcode.image.styledpil import StyledPilImage
 from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
 from aiogram.types import BufferedInputFile
 
+from .workers import run_in_pool
 
-def generate_qr_code(data: str) -> BufferedInputFile:
-    """Генерация QR-кода для конфигурации"""
-    
-    # Создаем QR-код
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    
+# Уровни коррекции ошибок от слабого к сильному
+ERROR_CORRECTION_LEVELS = [
+    qrcode.constants.ERROR_CORRECT_L,
+    qrcode.constants.ERROR_CORRECT_M,
+    qrcode.constants.ERROR_CORRECT_Q,
+    qrcode.constants.ERROR_CORRECT_H,
+]
+
+
+@dataclass(frozen=True)
+class QRBackend:
+    """Способ рендеринга QR-кода"""
+    name: str
+    render: Callable[[qrcode.QRCode, int], bytes]
+    media_type: str
+    extension: str
+    raster: bool  # Можно отправить как фото в Telegram
+
+
+def build_qr(data: str, border: int = 4) -> qrcode.QRCode:
+    """
+    QR-код минимальной версии для данных.
+
+    Версия подбирается для уровня L, затем уровень коррекции повышается,
+    пока данные помещаются в ту же версию: размер кода не растет, а
+    устойчивость к повреждениям бесплатно увеличивается.
+    """
+    qr = qrcode.QRCode(version=None, error_correction=ERROR_CORRECTION_LEVELS[0], border=border)
     qr.add_data(data)
-    qr.make(fit=True)
-    
-    # Создаем изображение с rounded стилем
+    version = qr.best_fit()
+
+    for level in ERROR_CORRECTION_LEVELS[:0:-1]:
+        candidate = qrcode.QRCode(version=None, error_correction=level, border=border)
+        candidate.add_data(data)
+        try:
+            if candidate.best_fit() == version:
+                qr = candidate
+                break
+        except qrcode.exceptions.DataOverflowError:
+            continue
+
+    qr.make(fit=False)
+    return qr
+
+
+def render_styled_png(qr: qrcode.QRCode, box_size: int) -> bytes:
+    """PNG со скругленными модулями (медленно, самый крупный файл)"""
+    qr.box_size = box_size
     img = qr.make_image(
         image_factory=StyledPilImage,
         module_drawer=RoundedModuleDrawer(),
         fill_color="black",
         back_color="white"
     )
-    
-    # Конвертируем в байты
     bio = io.BytesIO()
     img.save(bio, format='PNG')
-    bio.seek(0)
-    
+    return bio.getvalue()
+
+
+def render_bitmap_png(qr: qrcode.QRCode, box_size: int) -> bytes:
+    """Однобитный PNG: по пикселю на модуль с масштабированием без сглаживания"""
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    pixels = bytes(0 if module else 255 for row in matrix for module in row)
+    img = Image.frombytes('L', (size, size), pixels).convert('1')
+    img = img.resize((size * box_size, size * box_size), Image.NEAREST)
+    bio = io.BytesIO()
+    img.save(bio, format='PNG')
+    return bio.getvalue()
+
+
+def render_svg(qr: qrcode.QRCode, box_size: int) -> bytes:
+    """SVG с одним path из горизонтальных отрезков темных модулей"""
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    segments: List[str] = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            segments.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(segments)}"/></svg>'
+    ).encode('ascii')
+
+
+QR_BACKENDS: Dict[str, QRBackend] = {
+    "styled": QRBackend("styled", render_styled_png, "image/png", "png", raster=True),
+    "bitmap": QRBackend("bitmap", render_bitmap_png, "image/png", "png", raster=True),
+    "svg": QRBackend("svg", render_svg, "image/svg+xml", "svg", raster=False),
+}
+
+# Параметры рендеринга QR-кодов конфигураций (задаются из Config при запуске)
+qr_backend = "bitmap"
+qr_box_size = 10
+
+
+def configure_qr_rendering(backend: str, box_size: int) -> None:
+    """Выбор бэкенда для QR-кодов, отправляемых фото"""
+    global qr_backend, qr_box_size
+    if backend not in QR_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд QR: {backend} (доступны: {', '.join(QR_BACKENDS)})")
+    if not QR_BACKENDS[backend].raster:
+        raise ValueError(f"Бэкенд QR {backend} не растровый и не подходит для отправки фото")
+    qr_backend = backend
+    qr_box_size = box_size
+
+
+def qr_render_options() -> str:
+    """Текущие параметры рендеринга (входят в ключи кэшей QR-кодов)"""
+    return f"{qr_backend}:{qr_box_size}"
+
+
+def render_qr(data: str, backend: str = "bitmap", box_size: int = 10) -> bytes:
+    """Рендеринг QR-кода выбранным бэкендом"""
+    return QR_BACKENDS[backend].render(build_qr(data), box_size)
+
+
+def render_qr_png(data: str) -> bytes:
+    """Рендеринг QR-кода для конфигурации текущим бэкендом"""
+    return render_qr(data, qr_backend, qr_box_size)
+
+
+async def generate_qr_code(data: str) -> BufferedInputFile:
+    """Генерация QR-кода для конфигурации (рендеринг в пуле image)"""
+    backend = QR_BACKENDS[qr_backend]
     return BufferedInputFile(
-        bio.read(),
-        filename="config_qr.png"
-    )
\ No newline at end of file
+        await run_in_pool("image", render_qr, data, backend.name, qr_box_size),
+        filename=f"config_qr.{backend.extension}"
+    )
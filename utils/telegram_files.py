@@ -0,0 +1,112 @@
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from database.database import get_db
+
+
+class TelegramFileCache:
+    """
+    Повторное использование file_id уже загруженных в Telegram файлов.
+
+    Соответствие "хеш содержимого -> file_id" хранится в таблице telegram_files
+    (с небольшим LRU в памяти перед ней). Файл загружается только при первой
+    отправке; дальше отправляется file_id. Новое содержимое дает новый хеш,
+    прежняя запись клиента того же вида удаляется.
+    """
+
+    def __init__(self, max_memory_entries: int = 1024):
+        self.db = get_db()
+        self.max_memory_entries = max_memory_entries
+        self.logger = logging.getLogger(__name__)
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+
+        self.reused = 0
+        self.uploaded = 0
+        self.rejected = 0
+
+    async def send_photo(self, bot: Bot, chat_id: int, content_hash: str,
+                         render: Callable[[], Awaitable[bytes]], filename: str,
+                         kind: str = "photo", client_id: Optional[int] = None, **kwargs) -> Message:
+        """send_photo с file_id, если это содержимое уже загружалось"""
+        return await self._send(
+            bot.send_photo, "photo", lambda message: message.photo[-1].file_id,
+            chat_id, content_hash, render, filename, kind, client_id, kwargs
+        )
+
+    async def send_document(self, bot: Bot, chat_id: int, content_hash: str,
+                            render: Callable[[], Awaitable[bytes]], filename: str,
+                            kind: str = "document", client_id: Optional[int] = None, **kwargs) -> Message:
+        """send_document с file_id, если это содержимое уже загружалось"""
+        return await self._send(
+            bot.send_document, "document", lambda message: message.document.file_id,
+            chat_id, content_hash, render, filename, kind, client_id, kwargs
+        )
+
+    async def _send(self, method, field: str, extract_file_id, chat_id: int, content_hash: str,
+                    render, filename: str, kind: str, client_id: Optional[int], kwargs: dict) -> Message:
+        file_id = await self._get(content_hash)
+        if file_id:
+            try:
+                message = await method(chat_id=chat_id, **{field: file_id}, **kwargs)
+                self.reused += 1
+                return message
+            except TelegramBadRequest as e:
+                # file_id мог стать недействительным (например, после смены токена бота)
+                self.logger.warning(f"Telegram отклонил сохраненный file_id ({kind}): {e}")
+                self.rejected += 1
+                self._memory.pop(content_hash, None)
+                await self.db.delete_telegram_file_id(content_hash)
+
+        data = await render()
+        message = await method(chat_id=chat_id, **{field: BufferedInputFile(data, filename=filename)}, **kwargs)
+        self.uploaded += 1
+
+        file_id = extract_file_id(message)
+        self._remember(content_hash, file_id)
+        try:
+            await self.db.set_telegram_file_id(content_hash, file_id, kind, client_id)
+        except Exception as e:
+            self.logger.error(f"Ошибка при сохранении file_id: {e}")
+        return message
+
+    async def _get(self, content_hash: str) -> Optional[str]:
+        """file_id из памяти или из БД"""
+        file_id = self._memory.get(content_hash)
+        if file_id is not None:
+            self._memory.move_to_end(content_hash)
+            return file_id
+
+        file_id = await self.db.get_telegram_file_id(content_hash)
+        if file_id is not None:
+            self._remember(content_hash, file_id)
+        return file_id
+
+    def _remember(self, content_hash: str, file_id: str) -> None:
+        self._memory[content_hash] = file_id
+        self._memory.move_to_end(content_hash)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """Метрики повторного использования file_id"""
+        sends = self.reused + self.uploaded
+        return {
+            'reused': self.reused,
+            'uploaded': self.uploaded,
+            'rejected': self.rejected,
+            'reuse_rate': self.reused / sends if sends else 0.0,
+        }
+
+
+# Глобальный экземпляр кэша file_id
+telegram_file_cache = TelegramFileCache()
+
+
+def get_telegram_file_cache() -> TelegramFileCache:
+    """Получение экземпляра кэша file_id"""
+    return telegram_file_cache
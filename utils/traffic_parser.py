@@ -1,3 +1,7 @@
+import re
+from typing import Optional
+
+
 def parse_traffic_size(size_str: str) -> int:
     """Преобразование строки размера трафика (из вывода awg show) в байты"""
     size_str = size_str.strip()
@@ -27,3 +31,35 @@ def parse_traffic_size(size_str: str) -> int:
     }
 
     return int(value * multipliers.get(unit, 1))
+
+
+_HANDSHAKE_UNITS = (
+    (re.compile(r'(\d+)\s*(?:second|секунд)', re.IGNORECASE), 1),
+    (re.compile(r'(\d+)\s*(?:minute|минут)', re.IGNORECASE), 60),
+    (re.compile(r'(\d+)\s*(?:hour|час)', re.IGNORECASE), 3600),
+    (re.compile(r'(\d+)\s*(?:day|д[нея])', re.IGNORECASE), 86400),
+    (re.compile(r'(\d+)\s*(?:week|недел)', re.IGNORECASE), 604800),
+    (re.compile(r'(\d+)\s*(?:month|месяц)', re.IGNORECASE), 2592000),
+    (re.compile(r'(\d+)\s*(?:year|год|лет)', re.IGNORECASE), 31536000),
+)
+
+
+def parse_handshake_seconds(handshake_str: str) -> Optional[int]:
+    """
+    Преобразование строки latest handshake (из вывода awg show) в секунды.
+    Возвращает None если handshake не было или строку не удалось разобрать.
+    """
+    if not handshake_str or handshake_str.lower() in ('never', 'никогда'):
+        return None
+
+    total_seconds = 0
+    for pattern, multiplier in _HANDSHAKE_UNITS:
+        match = pattern.search(handshake_str)
+        if match:
+            total_seconds += int(match.group(1)) * multiplier
+
+    if total_seconds == 0:
+        # "Now" - handshake только что произошел
+        return 0 if 'now' in handshake_str.lower() else None
+
+    return total_seconds
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Минимальный интервал между промежуточными правками экрана (сек)
+PROGRESS_EDIT_INTERVAL = 0.3
+
+
+class ViewData:
+    """Результаты источников данных экрана; источники с ошибкой или таймаутом - в failed"""
+
+    def __init__(self, values: Dict[str, Any], failed: Set[str]):
+        self.values = values
+        self.failed = failed
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.values.get(name, default)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.failed)
+
+
+async def _load_source(name: str, source: Awaitable, timeout: Optional[float]) -> Any:
+    try:
+        return await asyncio.wait_for(source, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Источник {name} не ответил за {timeout} с, экран показан без него")
+        raise
+    except Exception as e:
+        logger.error(f"Источник {name} завершился ошибкой: {e}")
+        raise
+
+
+async def load_view(sources: Mapping[str, Awaitable], timeout: Optional[float] = 5.0,
+                    timeouts: Optional[Mapping[str, float]] = None) -> ViewData:
+    """
+    Параллельная загрузка независимых данных экрана.
+
+    Каждый источник ограничен своим таймаутом (timeouts[name] или общий
+    timeout); ошибка или таймаут одного источника не мешает остальным -
+    экран строится по частичным данным.
+    """
+    timeouts = timeouts or {}
+    names = list(sources)
+    results = await asyncio.gather(
+        *(_load_source(name, sources[name], timeouts.get(name, timeout)) for name in names),
+        return_exceptions=True
+    )
+    values, failed = {}, set()
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            failed.add(name)
+        else:
+            values[name] = result
+    return ViewData(values, failed)
+
+
+async def fill_progressively(sources: Mapping[str, Awaitable], render: Callable[[Dict[str, Any]], str],
+                             apply: Callable[[str], Awaitable[Any]], shown: Optional[str] = None,
+                             timeout: Optional[float] = 10.0,
+                             interval: float = PROGRESS_EDIT_INTERVAL,
+                             active: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """
+    Дозаполнение уже показанного экрана медленными данными (геолокация и т.п.).
+
+    Источники выполняются параллельно; по мере готовности экран
+    перерисовывается render(готовые результаты) и применяется apply(текст),
+    не чаще раза в interval секунд; shown - уже показанный текст (без
+    изменений правка не отправляется). Последняя правка - после завершения
+    всех источников или общего таймаута: источники с ошибкой или без ответа
+    получают None. Возвращает результаты всех источников.
+
+    active() проверяется перед каждой правкой: False (экран уже сменился) -
+    правки прекращаются, оставшиеся источники отменяются.
+    """
+    tasks = {asyncio.ensure_future(source): name for name, source in sources.items()}
+    ready: Dict[str, Any] = {}
+    last_text = shown
+    last_edit = time.monotonic()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    async def show() -> bool:
+        nonlocal last_text, last_edit
+        text = render(ready)
+        if text != last_text:
+            if active is not None and not active():
+                return False
+            last_text = text
+            last_edit = time.monotonic()
+            await apply(text)
+        return True
+
+    try:
+        pending = set(tasks)
+        unshown = False
+        while pending:
+            now = time.monotonic()
+            wait = None if deadline is None else deadline - now
+            if wait is not None and wait <= 0:
+                logger.warning(f"Не дождались {len(pending)} источников экрана за {timeout} с")
+                break
+            if unshown:
+                # Есть непоказанные результаты: ждем не дольше момента следующей правки
+                until_edit = max(0.0, interval - (now - last_edit))
+                wait = until_edit if wait is None else min(wait, until_edit)
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    ready[tasks[task]] = task.result()
+                    unshown = True
+                else:
+                    logger.error(f"Источник {tasks[task]} завершился ошибкой: {task.exception()}")
+            if unshown and pending and time.monotonic() - last_edit >= interval:
+                if not await show():
+                    return ready
+                unshown = False
+        for name in tasks.values():
+            ready.setdefault(name, None)
+        await show()
+    finally:
+        for task in tasks:
+            task.cancel()
+    return ready
@@ -1,9 +1,18 @@
+import asyncio
+import logging
 import struct
+import time
 import zlib
 import base64
 import socket
 import ipaddress
 import re
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .workers import run_in_pool
+
+ENDPOINT_PATTERN = re.compile(r'^(.*Endpoint\s*=\s*)([^\s:]+)(?::(\d+))(.*)$', re.MULTILINE)
 
 def qCompress(data, level=-1):
     compressed = zlib.compress(data, level)
@@ -21,24 +30,160 @@ def is_ip_address(address):
     except ValueError:
         return False
 
-def resolve_dns_to_ip(dns_name):
-    try:
-        ip_address = socket.gethostbyname(dns_name)
-        return ip_address
-    except socket.gaierror:
-        return None
 
-def process_conf_data(data):
-    """Обрабатывает конфигурационные данные, заменяя DNS на IP"""
+@dataclass
+class ResolvedEntry:
+    """Результат разрешения имени в кэше (ip=None - отрицательный результат)"""
+    ip: Optional[str]
+    expires_at: float
+
+
+class EndpointResolver:
+    """
+    Асинхронное разрешение DNS-имен endpoint с кэшем.
+
+    getaddrinfo выполняется в executor цикла событий и не блокирует бота.
+    Успешные результаты кэшируются на ttl, неудачные - на negative_ttl;
+    одновременные запросы одного имени объединяются в один.
+    """
+
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 30.0, timeout: float = 5.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._cache: Dict[str, ResolvedEntry] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def configure(self, ttl: Optional[float] = None, negative_ttl: Optional[float] = None,
+                  timeout: Optional[float] = None):
+        """Изменение параметров кэша (из конфигурации при запуске)"""
+        if ttl is not None:
+            self.ttl = ttl
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        if timeout is not None:
+            self.timeout = timeout
+
+    async def resolve(self, hostname: str) -> Optional[str]:
+        """IPv4-адрес для имени или None, если имя не разрешается"""
+        if is_ip_address(hostname):
+            return hostname
+
+        key = hostname.lower()
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            if entry.ip is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry.ip
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            ip = await self._lookup(hostname)
+            future.set_result(ip)
+            return ip
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            # Ожидающие этот же запрос получают ту же ошибку, а не ждут вечно
+            future.set_exception(e)
+            future.exception()  # без ожидающих ошибка не считается потерянной
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _lookup(self, hostname: str) -> Optional[str]:
+        """Запрос к резолверу с записью результата и метрик"""
+        self.misses += 1
+        started = time.perf_counter()
+        ip = None
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(
+                    hostname, None, family=socket.AF_INET, type=socket.SOCK_STREAM
+                ),
+                self.timeout
+            )
+            if infos:
+                ip = infos[0][4][0]
+        except (socket.gaierror, asyncio.TimeoutError, OSError, ValueError) as e:
+            # ValueError (UnicodeError) - недопустимое имя, например метка длиннее 63 символов
+            self.logger.warning(f"Не удалось разрешить {hostname}: {e}")
+
+        latency = time.perf_counter() - started
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+        if ip is None:
+            self.failures += 1
+            self._cache[hostname.lower()] = ResolvedEntry(None, time.monotonic() + self.negative_ttl)
+        else:
+            self._cache[hostname.lower()] = ResolvedEntry(ip, time.monotonic() + self.ttl)
+            self.logger.debug(f"{hostname} -> {ip} за {latency * 1000:.1f} мс")
+        return ip
+
+    def invalidate(self, hostname: Optional[str] = None):
+        """Сброс кэша для имени (или целиком)"""
+        if hostname is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(hostname.lower(), None)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Метрики резолвера для мониторинга"""
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'failures': self.failures,
+            'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+            'avg_latency_ms': self.total_latency / self.misses * 1000 if self.misses else 0.0,
+            'max_latency_ms': self.max_latency * 1000,
+            'cached': len(self._cache),
+        }
+
+
+# Глобальный экземпляр резолвера endpoint
+endpoint_resolver = EndpointResolver()
+
+
+def get_endpoint_resolver() -> EndpointResolver:
+    """Получение экземпляра резолвера endpoint"""
+    return endpoint_resolver
+
+
+def process_conf_data(data: str, resolved: Dict[str, Optional[str]]) -> str:
+    """Обрабатывает конфигурационные данные, заменяя DNS на IP из resolved"""
     def replace_endpoint(match):
         full_line = match.group(0)
         prefix = match.group(1)
         address = match.group(2)
         port = match.group(3)
         suffix = match.group(4)
-        
+
         if not is_ip_address(address):
-            resolved_ip = resolve_dns_to_ip(address)
+            resolved_ip = resolved.get(address)
             if resolved_ip:
                 return f"{prefix}{resolved_ip}:{port}{suffix}"
             else:
@@ -46,17 +191,29 @@ def process_conf_data(data):
                 return full_line
         else:
             return full_line
-    
-    pattern = r'^(.*Endpoint\s*=\s*)([^\s:]+)(?::(\d+))(.*)$'
-    return re.sub(pattern, replace_endpoint, data, flags=re.MULTILINE)
 
-def conf_to_vpn_url(conf_data: str) -> str:
+    return ENDPOINT_PATTERN.sub(replace_endpoint, data)
+
+async def resolve_conf_endpoints(data: str) -> str:
+    """Разрешает DNS-имена Endpoint в конфигурации без блокировки цикла событий"""
+    hostnames = {
+        match.group(2) for match in ENDPOINT_PATTERN.finditer(data)
+        if not is_ip_address(match.group(2))
+    }
+    resolved = {hostname: await endpoint_resolver.resolve(hostname) for hostname in hostnames}
+    return process_conf_data(data, resolved)
+
+def encode_vpn_url(conf_data: str) -> str:
+    """Кодирует готовую конфигурацию (с IP в Endpoint) в vpn:// строку"""
+    data_bytes = conf_data.encode('utf-8')
+    compressed = qCompress(data_bytes, level=8)
+    base64_encoded = base64url_encode(compressed)
+    return 'vpn://' + base64_encoded.decode('ascii')
+
+async def conf_to_vpn_url(conf_data: str) -> str:
     """Конвертирует .conf конфигурацию в vpn:// формат"""
     try:
-        processed_data = process_conf_data(conf_data)
-        data_bytes = processed_data.encode('utf-8')
-        compressed = qCompress(data_bytes, level=8)
-        base64_encoded = base64url_encode(compressed)
-        return 'vpn://' + base64_encoded.decode('ascii')
+        processed_data = await resolve_conf_endpoints(conf_data)
+        return await run_in_pool("archive", encode_vpn_url, processed_data)
     except Exception as e:
-        raise Exception(f"Ошибка при конвертации в vpn:// формат: {e}")
\ No newline at end of file
+        raise Exception(f"Ошибка при конвертации в vpn:// формат: {e}")
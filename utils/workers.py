@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class WorkerPool:
+    """
+    Именованный пул для CPU-емкой работы вне цикла событий.
+
+    Одновременно принимается не больше max_workers + max_queue задач:
+    остальные вызывающие ждут свободного места (backpressure), а не
+    накапливают неограниченную очередь в executor. Процессный пул дает
+    настоящую параллельность для кода под GIL, но требует сериализуемых
+    функций и аргументов.
+    """
+
+    def __init__(self, name: str, max_workers: int = 1, max_queue: int = 32, use_processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self.logger = logging.getLogger(__name__)
+
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(max_workers + max_queue)
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_run_time = 0.0
+        self.total_wait_time = 0.0
+
+    def configure(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None,
+                  use_processes: Optional[bool] = None):
+        """Изменение параметров пула (до первого использования или с пересозданием executor)"""
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if use_processes is not None:
+            self.use_processes = use_processes
+        self.shutdown()
+        self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+
+    @property
+    def queue_depth(self) -> int:
+        """Задачи, ожидающие исполнителя: в очереди executor и перед входом в пул"""
+        return max(0, self.in_flight - self.max_workers) + self.waiting
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполнить fn(*args, **kwargs) в пуле и дождаться результата"""
+        started = time.perf_counter()
+        contended = self._slots.locked()
+        if contended:
+            self.waiting += 1
+            self._track_depth()
+        try:
+            await self._slots.acquire()
+        finally:
+            if contended:
+                self.waiting -= 1
+
+        submitted = time.perf_counter()
+        self.total_wait_time += submitted - started
+        self.in_flight += 1
+        self._track_depth()
+        try:
+            call = functools.partial(fn, *args, **kwargs) if kwargs else fn
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), call, *([] if kwargs else args))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_run_time += time.perf_counter() - submitted
+            self._slots.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики пула для мониторинга"""
+        return {
+            'workers': self.max_workers,
+            'processes': self.use_processes,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_run_ms': self.total_run_time / self.completed * 1000 if self.completed else 0.0,
+            'avg_wait_ms': self.total_wait_time / self.completed * 1000 if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        """Остановка executor (незапущенные задачи отменяются)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"{self.name}-worker"
+                )
+            self.logger.info(
+                f"Пул {self.name}: {self.max_workers} "
+                f"{'процесс(ов)' if self.use_processes else 'поток(ов)'}, очередь {self.max_queue}"
+            )
+        return self._executor
+
+    def _track_depth(self):
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+
+# Именованные пулы: рендеринг изображений, криптография, сжатие и архивы.
+# archive работает только на потоках: в него передаются открытые файловые объекты.
+worker_pools: Dict[str, WorkerPool] = {
+    "image": WorkerPool("image", max_workers=2),
+    "crypto": WorkerPool("crypto", max_workers=1),
+    "archive": WorkerPool("archive", max_workers=1),
+}
+
+
+def get_worker_pool(name: str) -> WorkerPool:
+    """Получение именованного пула"""
+    return worker_pools[name]
+
+
+async def run_in_pool(name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполнить функцию в именованном пуле"""
+    return await worker_pools[name].run(fn, *args, **kwargs)
+
+
+def configure_worker_pools(config) -> None:
+    """Настройка пулов из Config"""
+    worker_pools["image"].configure(config.image_workers, config.worker_queue_limit, config.worker_use_processes)
+    worker_pools["crypto"].configure(config.crypto_workers, config.worker_queue_limit, config.worker_use_processes)
+    worker_pools["archive"].configure(config.archive_workers, config.worker_queue_limit, False)
+
+
+def shutdown_worker_pools() -> None:
+    """Остановка всех пулов при завершении работы"""
+    for pool in worker_pools.values():
+        pool.shutdown()
+
+
+def get_worker_pools_stats() -> Dict[str, Dict[str, Any]]:
+    """Метрики всех пулов"""
+    return {name: pool.get_stats() for name, pool in worker_pools.items()}